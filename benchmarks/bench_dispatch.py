@@ -0,0 +1,59 @@
+"""
+Dispatch of the block and market events to the workers, see
+dexbot.worker.WorkerInfrastructure
+"""
+
+import time
+
+from dexbot.worker import WorkerInfrastructure
+
+from simulated_chain import SimulatedChain
+
+# Seconds to wait for the workers to handle the events of a timing
+TIMEOUT = 60
+
+
+class Dispatch:
+
+    params = [1, 10, 100]
+    param_names = ['workers']
+
+    def setup(self, workers):
+        self.chain = SimulatedChain()
+        config = {'node': None, 'workers': {}}
+        for number in range(workers):
+            account = 'bench-{}'.format(number)
+            self.chain.add_account(account)
+            config['workers']['worker-{}'.format(number)] = self.chain.worker_config(
+                account, module='dexbot.strategies.echo')
+        self.infrastructure = WorkerInfrastructure(config, bitshares_instance=self.chain.bitshares)
+        self.infrastructure.init_workers(config)
+        self.order = self.chain.order('bench-market')
+        self.workers = workers
+
+    def teardown(self, workers):
+        self.infrastructure.shutdown()
+        self.infrastructure.dispatcher.shutdown(wait=True)
+        self.chain.close()
+
+    def handled(self):
+        return sum(lane['handled'] for lane in self.infrastructure.dispatcher.metrics().values())
+
+    def wait(self, handled):
+        """ Waits for the workers to handle the events dispatched to them
+        """
+        deadline = time.time() + TIMEOUT
+        while self.handled() < handled:
+            if time.time() > deadline:
+                raise RuntimeError('The workers did not handle their events in time')
+            time.sleep(0.0005)
+
+    def time_on_block(self, workers):
+        handled = self.handled() + workers
+        self.infrastructure.on_block(self.chain.exchange.produce_block())
+        self.wait(handled)
+
+    def time_on_market(self, workers):
+        handled = self.handled() + workers
+        self.infrastructure.on_market(self.order)
+        self.wait(handled)
@@ -0,0 +1,51 @@
+"""
+Journal queries and their translation for the graphs, see dexbot.graph
+"""
+
+import datetime
+import os
+import shutil
+import tempfile
+
+from dexbot import graph
+from dexbot.storage import DatabaseWorker, Journal
+
+# Keys journaled at each stamp, as the strategies do
+KEYS = ('base', 'quote', 'price', 'total')
+
+# Time of the first stamp of the journal, one minute apart from then on
+START = datetime.datetime(2018, 1, 1)
+
+
+def fill_journal(session, category, stamps):
+    """ Journals the keys every minute from :data:`START`, on the database thread
+    """
+    for number in range(stamps):
+        stamp = START + datetime.timedelta(minutes=number)
+        session.add_all(Journal(key=key, category=category, amount=float(number), stamp=stamp) for key in KEYS)
+
+
+class JournalQueries:
+
+    params = [1000, 25000]
+    param_names = ['stamps']
+
+    def setup(self, stamps):
+        self.data_dir = tempfile.mkdtemp(prefix='dexbot-bench-')
+        self.worker = DatabaseWorker(path=os.path.join(self.data_dir, 'bench.sqlite'))
+        self.worker.execute_noreturn(lambda: fill_journal(self.worker.session, 'bench', stamps))
+        self.worker.flush()
+        self.rows = self.query()
+
+    def teardown(self, stamps):
+        self.worker.stop()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def query(self):
+        return self.worker.execute(self.worker.query_journal, 'bench', START - datetime.timedelta(minutes=1), None)
+
+    def time_query_journal(self, stamps):
+        self.query()
+
+    def time_query_to_dicts(self, stamps):
+        graph.query_to_dicts(self.rows)
@@ -0,0 +1,30 @@
+"""
+Ladder computations of the Staggered Orders and Ataxia strategies, see
+dexbot.ladder
+"""
+
+from dexbot import ladder
+
+# (center price, amount, spread, lower bound, upper bound) of the ladders
+STAGGERED = (1.0, 10, 0.06, 1e-6, 1e6)
+
+# (size, spread, upper bound, lower bound) of the Ataxia ladders
+ATAXIA = (10, 0.06, 1e6, 1e-6)
+
+
+class Ladder:
+
+    params = [0.04, 0.001, 0.0001]
+    param_names = ['increment']
+
+    def time_staggered_ladder(self, increment):
+        center_price, amount, spread, lower_bound, upper_bound = STAGGERED
+        ladder.staggered_ladder(center_price, amount, spread, increment, lower_bound, upper_bound)
+
+    def time_staggered_required_assets(self, increment):
+        center_price, amount, spread, lower_bound, upper_bound = STAGGERED
+        ladder.staggered_required_assets(center_price, amount, spread, increment, lower_bound, upper_bound)
+
+    def time_ataxia_ladder(self, increment):
+        size, spread, upper_bound, lower_bound = ATAXIA
+        ladder.ataxia_ladder(size, spread, increment, upper_bound, lower_bound)
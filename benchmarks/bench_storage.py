@@ -0,0 +1,92 @@
+"""
+Throughput of the DatabaseWorker, see dexbot.storage
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+
+from dexbot.storage import DatabaseWorker
+
+# Operations of each timing
+OPERATIONS = 1000
+
+# Keys the operations cycle through
+KEYS = 100
+
+ORDER = {
+    'id': '1.7.0',
+    'seller': '1.2.100',
+    'for_sale': 1000000,
+    'sell_price': {
+        'base': {'amount': 1000000, 'asset_id': '1.3.0'},
+        'quote': {'amount': 200000, 'asset_id': '1.3.121'}
+    },
+    'expiration': '2030-01-01T00:00:00',
+    'deleted': False
+}
+
+
+class Storage:
+
+    def setup(self):
+        self.data_dir = tempfile.mkdtemp(prefix='dexbot-bench-')
+        self.worker = DatabaseWorker(path=os.path.join(self.data_dir, 'bench.sqlite'))
+        for key in range(KEYS):
+            self.worker.set_item('bench', 'key{}'.format(key), {'value': key})
+        self.worker.flush()
+
+    def teardown(self):
+        self.worker.stop()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def time_set_item(self):
+        for number in range(OPERATIONS):
+            self.worker.set_item('bench', 'key{}'.format(number % KEYS), {'value': number})
+        self.worker.flush()
+
+    def time_get_item(self):
+        for number in range(OPERATIONS):
+            self.worker.get_item('bench', 'key{}'.format(number % KEYS))
+
+    def time_save_order(self):
+        for number in range(OPERATIONS):
+            self.worker.save_order('bench', '1.7.{}'.format(number % KEYS), ORDER)
+        self.worker.flush()
+
+    def time_save_orders(self):
+        self.worker.save_orders('bench', [('1.7.{}'.format(number % KEYS), ORDER) for number in range(OPERATIONS)])
+        self.worker.flush()
+
+
+class ConcurrentReads:
+    """ Reads of callers threads waiting on the worker at the same time
+    """
+
+    params = [1, 4, 16]
+    param_names = ['callers']
+
+    def setup(self, callers):
+        self.data_dir = tempfile.mkdtemp(prefix='dexbot-bench-')
+        self.worker = DatabaseWorker(path=os.path.join(self.data_dir, 'bench.sqlite'))
+        for key in range(KEYS):
+            self.worker.set_item('bench', 'key{}'.format(key), {'value': key})
+        self.worker.flush()
+
+    def teardown(self, callers):
+        self.worker.stop()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def read(self, caller, reads):
+        for number in range(reads):
+            self.worker.get_item('bench', 'key{}'.format((caller + number) % KEYS))
+
+    def time_get_item(self, callers):
+        # The callers share the operations of the timing
+        threads = [threading.Thread(target=self.read, args=(caller, OPERATIONS // callers))
+                   for caller in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
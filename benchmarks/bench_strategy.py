@@ -0,0 +1,37 @@
+"""
+Order checks of the Relative Orders strategy against a simulated account,
+see dexbot.strategies.relative_orders
+"""
+
+from dexbot.strategies.relative_orders import Strategy
+
+from simulated_chain import SimulatedChain
+
+# Balances of the account of the worker
+BALANCES = {'USD': 100000, 'BTS': 1000000}
+
+# Prices the market alternates between, so that the orders are replaced
+PRICES = (0.2, 0.21)
+
+
+class RelativeOrders:
+
+    def setup(self):
+        self.chain = SimulatedChain(balances=BALANCES)
+        self.chain.add_account('bench')
+        config = {'node': None, 'workers': {'bench': self.chain.worker_config('bench', amount=100)}}
+        # The worker places its orders as it starts
+        self.worker = Strategy(config=config, name='bench', bitshares_instance=self.chain.bitshares,
+                               clock=self.chain.exchange.now)
+        self.updates = 0
+
+    def teardown(self):
+        self.chain.close()
+
+    def time_check_orders(self):
+        self.worker.check_orders()
+
+    def time_update_orders(self):
+        self.updates += 1
+        self.chain.set_price(PRICES[self.updates % len(PRICES)])
+        self.worker.update_orders()
@@ -0,0 +1,386 @@
+"""
+Runs the benchmark suite and keeps its results across commits
+
+python3 benchmarks/run.py run [-k pattern] [--repeat N] [--no-save]
+python3 benchmarks/run.py compare [base commit] [head commit] [--threshold percent]
+python3 benchmarks/run.py history [-k pattern]
+python3 benchmarks/run.py load [--workers N] [--seconds N] [--latency ms] [--block-interval ms]
+
+The benchmarks are the ``time_*`` methods of the classes of the
+``bench_*.py`` modules of this directory, in the manner of asv. A class may
+have ``setup`` and ``teardown`` methods, run around the timings of each of
+its methods, ``params`` with their ``param_names`` to run each timing with
+every parameter (a list of lists giving their product), and a ``number``
+of calls per timing, found by ``timeit`` otherwise.
+
+The results of a run are stored in ``benchmarks/results/<machine>/<commit>.json``,
+the commit of a tree with local changes being marked dirty. ``compare``
+prints the ratio of the timings of two commits, by default the last two
+commits run on this machine, and exits with 1 when one of them got slower
+by more than the threshold. ``history`` prints the timings of every commit
+run on this machine, oldest first.
+
+``load`` is a load test rather than a timing: it starts a NodeServer on
+localhost with a few random markets and one account per worker, runs that
+many relative orders workers in one WorkerInfrastructure connected to it
+as to a node of the network, and prints the events handled, the handler
+latencies and the orders placed and filled once the time is up.
+"""
+
+import argparse
+import datetime
+import fnmatch
+import importlib
+import inspect
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import timeit
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+# The simulated chain of the tests is shared by the benchmarks
+TESTS_DIR = os.path.join(ROOT_DIR, 'tests')
+
+# Results of the runs, by machine
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+
+# Timings of each benchmark, the best and the median are kept
+REPEAT = 5
+
+# Seconds a timing lasts at least when the benchmark has no number of calls
+MIN_TIME = 0.2
+
+# Percent a benchmark may get slower by before compare reports it
+THRESHOLD = 10
+
+# Markets of the workers of the load test, with their initial prices
+LOAD_MARKETS = (('USD', 4, 0.2), ('CNY', 4, 1.3), ('EUR', 4, 0.17), ('BTC', 8, 0.000002))
+
+
+def git(*args):
+    try:
+        return subprocess.check_output(('git',) + args, cwd=ROOT_DIR, stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def commit_info():
+    """ Returns the commit of the tree, its date and whether it has local changes
+    """
+    commit = git('rev-parse', 'HEAD') or 'unknown'
+    date = git('log', '-1', '--format=%cI')
+    dirty = bool(git('status', '--porcelain', '--untracked-files=no'))
+    return commit, date, dirty
+
+
+def param_sets(cls):
+    """ Returns the parameter tuples the methods of a class run with
+    """
+    params = getattr(cls, 'params', None)
+    if params is None:
+        return [()]
+    if params and all(isinstance(values, (list, tuple)) for values in params):
+        return list(itertools.product(*params))
+    return [(value,) for value in params]
+
+
+def benchmark_name(module, cls, method, params):
+    name = '{}.{}.{}'.format(module.__name__, cls.__name__, method)
+    if params:
+        name += '[{}]'.format(', '.join(str(value) for value in params))
+    return name
+
+
+def discover(pattern=None):
+    """ Returns the benchmarks as (name, class, method, params) tuples
+
+        :param str pattern: glob the names are to match, anywhere in them
+    """
+    benchmarks = []
+    for filename in sorted(os.listdir(BENCHMARKS_DIR)):
+        if not (filename.startswith('bench_') and filename.endswith('.py')):
+            continue
+        module = importlib.import_module(filename[:-3])
+        for _, cls in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ != module.__name__:
+                continue
+            methods = sorted(name for name in dir(cls) if name.startswith('time_'))
+            for method, params in itertools.product(methods, param_sets(cls)):
+                name = benchmark_name(module, cls, method, params)
+                if pattern is None or fnmatch.fnmatch(name, '*{}*'.format(pattern)):
+                    benchmarks.append((name, cls, method, params))
+    return benchmarks
+
+
+def run_benchmark(cls, method, params, repeat=REPEAT):
+    """ Times a benchmark, returns the seconds taken by one call of it
+    """
+    instance = cls()
+    if hasattr(instance, 'setup'):
+        instance.setup(*params)
+    try:
+        function = getattr(instance, method)
+        timer = timeit.Timer(lambda: function(*params))
+        number = getattr(instance, 'number', None)
+        if number is None:
+            # Calls until a timing lasts MIN_TIME, the calibration is the first timing
+            number = 1
+            while True:
+                elapsed = timer.timeit(number)
+                if elapsed >= MIN_TIME:
+                    break
+                number = max(number * 2, int(number * MIN_TIME / max(elapsed, 1e-9)))
+            timings = [elapsed] + timer.repeat(repeat - 1, number)
+        else:
+            timings = timer.repeat(repeat, number)
+    finally:
+        if hasattr(instance, 'teardown'):
+            instance.teardown(*params)
+    timings = [timing / number for timing in timings]
+    return {'min': min(timings), 'median': statistics.median(timings), 'number': number, 'repeat': repeat}
+
+
+def results_dir():
+    return os.path.join(RESULTS_DIR, platform.node() or 'unknown')
+
+
+def load_results():
+    """ Returns the runs of this machine by commit
+    """
+    runs = {}
+    directory = results_dir()
+    if os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            if filename.endswith('.json'):
+                with open(os.path.join(directory, filename)) as f:
+                    run = json.load(f)
+                runs[run['commit']] = run
+    return runs
+
+
+def ordered_commits(runs):
+    """ Returns the commits of the runs, oldest first along the history of
+        HEAD, the others by date of the run
+    """
+    history = git('rev-list', '--reverse', 'HEAD').split()
+    position = {commit: index for index, commit in enumerate(history)}
+    return sorted(runs, key=lambda commit: (position.get(commit, len(history)), runs[commit]['timestamp']))
+
+
+def find_commit(runs, ref):
+    commit = git('rev-parse', ref) or ref
+    matches = [run for run in runs if run.startswith(commit)]
+    if len(matches) != 1:
+        raise SystemExit('No single run of {} in {}'.format(ref, results_dir()))
+    return matches[0]
+
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e3), ('us', 1e6)):
+        if seconds >= 1 / scale:
+            return '{:.3g} {}'.format(seconds * scale, unit)
+    return '{:.3g} ns'.format(seconds * 1e9)
+
+
+def command_run(args):
+    commit, date, dirty = commit_info()
+    results = {}
+    for name, cls, method, params in discover(args.k):
+        try:
+            result = run_benchmark(cls, method, params, args.repeat)
+        except Exception as e:
+            print('{:<70} failed: {}'.format(name, e))
+            continue
+        results[name] = result
+        print('{:<70} {:>10}'.format(name, format_time(result['min'])))
+        sys.stdout.flush()
+
+    if not args.no_save:
+        directory = results_dir()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '{}.json'.format(commit))
+        run = {
+            'commit': commit,
+            'date': date,
+            'dirty': dirty,
+            'python': platform.python_version(),
+            'timestamp': datetime.datetime.now().isoformat(),
+            'results': results
+        }
+        # A partial run adds to the results of the commit
+        if os.path.exists(path):
+            with open(path) as f:
+                previous = json.load(f)
+            if previous.get('dirty') == dirty:
+                run['results'] = dict(previous['results'], **results)
+        with open(path, 'w') as f:
+            json.dump(run, f, indent=2, sort_keys=True)
+        print('Saved to {}{}'.format(path, ' (local changes)' if dirty else ''))
+
+
+def command_compare(args):
+    runs = load_results()
+    commits = ordered_commits(runs)
+    if args.base is not None:
+        base = find_commit(runs, args.base)
+        head = find_commit(runs, args.head) if args.head is not None else commits[-1]
+    elif len(commits) >= 2:
+        base, head = commits[-2:]
+    else:
+        raise SystemExit('Two runs are needed to compare, {} found in {}'.format(len(commits), results_dir()))
+
+    base_results = runs[base]['results']
+    head_results = runs[head]['results']
+    print('{:<70} {:>10} {:>10} {:>7}'.format('', base[:8], head[:8], 'ratio'))
+    regressions = []
+    for name in sorted(set(base_results) & set(head_results)):
+        before = base_results[name]['min']
+        after = head_results[name]['min']
+        ratio = after / before if before else float('inf')
+        mark = ''
+        if ratio > 1 + args.threshold / 100:
+            regressions.append(name)
+            mark = ' slower'
+        elif ratio < 1 / (1 + args.threshold / 100):
+            mark = ' faster'
+        print('{:<70} {:>10} {:>10} {:>7.2f}{}'.format(name, format_time(before), format_time(after), ratio, mark))
+    if regressions:
+        print('{} benchmarks slower by more than {}%'.format(len(regressions), args.threshold))
+        sys.exit(1)
+
+
+def command_history(args):
+    runs = load_results()
+    commits = ordered_commits(runs)
+    names = sorted({name for run in runs.values() for name in run['results']
+                    if args.k is None or fnmatch.fnmatch(name, '*{}*'.format(args.k))})
+    for name in names:
+        print(name)
+        for commit in commits:
+            result = runs[commit]['results'].get(name)
+            if result is not None:
+                print('  {}{} {:>10}'.format(commit[:8], '+' if runs[commit]['dirty'] else ' ',
+                                             format_time(result['min'])))
+
+
+def command_load(args):
+    import tempfile
+    import time
+
+    from bitshares import BitShares
+    from bitshares.instance import set_shared_bitshares_instance
+    from bitsharesbase.account import PrivateKey
+
+    from dexbot import storage
+    from dexbot.assets import asset_registry
+    from dexbot.backtest.exchange import Exchange
+    from dexbot.backtest.server import NodeServer, RandomMarket
+    from dexbot.worker import WorkerInfrastructure
+
+    from simulated_chain import RELATIVE_ORDERS
+
+    key = PrivateKey()
+    exchange = Exchange()
+    markets = []
+    for symbol, precision, price in LOAD_MARKETS:
+        exchange.add_asset(symbol, precision)
+        markets.append(RandomMarket(symbol, 'BTS', price, trade_amount=2000, seed=len(markets)))
+
+    config = {'node': None, 'workers': {}}
+    for number in range(args.workers):
+        symbol, _, price = LOAD_MARKETS[number % len(LOAD_MARKETS)]
+        account = 'load-{}'.format(number)
+        # The accounts share one key, so that a single wallet signs for all
+        exchange.add_account(account, {symbol: 100000 * price, 'BTS': 100000}, key=str(key.pubkey))
+        config['workers']['worker-{}'.format(number)] = dict(
+            RELATIVE_ORDERS, account=account, market='BTS:{}'.format(symbol), amount=100, spread=2)
+
+    server = NodeServer(exchange, latency=args.latency / 1000, block_interval=args.block_interval / 1000,
+                        markets=markets).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_worker = storage.use_database(os.path.join(tmp, storage.storageDatabase))
+        asset_registry.path = None
+        config['node'] = server.url
+        bitshares = BitShares(server.url, keys=[str(key)], num_retries=0)
+        set_shared_bitshares_instance(bitshares)
+
+        started = time.time()
+        infrastructure = WorkerInfrastructure(config, bitshares_instance=bitshares)
+        infrastructure.daemon = True
+        infrastructure.start()
+        # The workers place their orders as they start, the notifications
+        # are subscribed to once all of them are running
+        while infrastructure.notify is None and infrastructure.is_alive():
+            time.sleep(0.1)
+        startup = time.time() - started
+        first_block = exchange.head_block
+
+        started = time.time()
+        time.sleep(args.seconds)
+        elapsed = time.time() - started
+        metrics = infrastructure.metrics()['workers']
+        infrastructure.stop()
+        infrastructure.join()
+        # The handlers still running need the node to finish
+        infrastructure.dispatcher.shutdown(wait=True)
+        server.stop()
+        db_worker.stop()
+
+    lanes = list(metrics.values())
+    handled = sum(lane['handled'] for lane in lanes)
+    print('{} workers started in {:.1f} s, then {} blocks in {:.1f} s, {} RPC calls in all'.format(
+        len(lanes), startup, exchange.head_block - first_block, elapsed, server.node.calls))
+    print('events:  {} handled ({:.0f}/s), {} failed, {} dropped'.format(
+        handled, handled / elapsed, sum(lane['failed'] for lane in lanes),
+        sum(lane['dropped'] for lane in lanes)))
+    if handled:
+        print('latency: {:.1f} ms average, {:.1f} ms max, {:.1f} ms waiting in queue'.format(
+            1000 * sum(lane['latency_avg'] * lane['handled'] for lane in lanes) / handled,
+            1000 * max(lane['latency_max'] for lane in lanes),
+            1000 * sum(lane['wait_avg'] * lane['handled'] for lane in lanes) / handled))
+    print('orders:  {} created, {} canceled, {} fills'.format(
+        exchange.orders_created, exchange.orders_canceled, len(exchange.fills)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark suite of dexbot')
+    commands = parser.add_subparsers(dest='command')
+    run = commands.add_parser('run', help='Run the benchmarks and save their results')
+    run.add_argument('-k', help='Run the benchmarks with names matching this glob only')
+    run.add_argument('--repeat', type=int, default=REPEAT, help='Timings of each benchmark')
+    run.add_argument('--no-save', action='store_true', help='Only print the results')
+    compare = commands.add_parser('compare', help='Compare the results of two commits')
+    compare.add_argument('base', nargs='?', help='Commit compared to, the last but one run by default')
+    compare.add_argument('head', nargs='?', help='Commit compared, the last run by default')
+    compare.add_argument('--threshold', type=float, default=THRESHOLD,
+                         help='Percent a benchmark may get slower by')
+    history = commands.add_parser('history', help='Print the results of every commit')
+    history.add_argument('-k', help='Print the benchmarks with names matching this glob only')
+    load = commands.add_parser('load', help='Run workers against a simulated node for a while')
+    load.add_argument('--workers', type=int, default=200, help='Number of workers')
+    load.add_argument('--seconds', type=int, default=30, help='Seconds the workers run for')
+    load.add_argument('--latency', type=int, default=0, help='Milliseconds the node takes to answer')
+    load.add_argument('--block-interval', type=int, default=3000, help='Milliseconds between two blocks')
+    args = parser.parse_args(argv)
+
+    # The benchmarks import dexbot, the modules of this directory and the simulated chain of the tests
+    sys.path[:0] = [ROOT_DIR, BENCHMARKS_DIR, TESTS_DIR]
+    if args.command == 'compare':
+        command_compare(args)
+    elif args.command == 'history':
+        command_history(args)
+    elif args.command == 'load':
+        command_load(args)
+    else:
+        # Running the benchmarks is the default
+        command_run(args if args.command else run.parse_args([]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+import collections
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from appdirs import user_data_dir
+from bitshares.asset import Asset
+from bitshares.instance import shared_bitshares_instance
+
+from dexbot import APP_NAME, AUTHOR
+
+log = logging.getLogger(__name__)
+
+# File the asset descriptors are kept in across restarts
+ASSETS_FILE = os.path.join(user_data_dir(APP_NAME, AUTHOR), 'assets.json')
+
+
+class AssetInfo(collections.namedtuple('AssetInfo', ('id', 'symbol', 'precision'))):
+    """ Immutable descriptor of an asset
+
+        The fields are read as attributes (``asset.precision``) or, like
+        :class:`bitshares.asset.Asset`, as keys (``asset['precision']``).
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        return super().__getitem__(key)
+
+    @property
+    def scale(self):
+        """ Number of satoshis in one unit of the asset
+        """
+        return 10 ** self.precision
+
+    def to_amount(self, satoshis):
+        """ Converts an integer amount of satoshis to units of the asset
+        """
+        return int(satoshis) / self.scale
+
+
+class AssetRegistry:
+    """ Process-wide registry of the assets, by id and by symbol
+
+        Ids, symbols and precisions of assets never change on a chain, so
+        the descriptors are fetched once and kept on disk, per chain, for
+        the next runs.
+
+        :param str path: JSON file to persist the descriptors to, None to
+            keep them in memory only
+    """
+
+    def __init__(self, path=ASSETS_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        # Descriptors by chain id, then by asset id and by symbol
+        self.chains = {}
+        self.loaded = False
+
+    def load(self):
+        with self.lock:
+            self._load()
+
+    def _load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as fd:
+                chains = json.load(fd)
+        except (OSError, ValueError):
+            log.warning('Unable to read the asset registry {}, starting afresh'.format(self.path))
+            return
+        for chain_id, assets in chains.items():
+            for asset_id, (symbol, precision) in assets.items():
+                self._add(chain_id, AssetInfo(asset_id, symbol, int(precision)))
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        chains = {
+            chain_id: {asset.id: [asset.symbol, asset.precision] for asset in assets.values()}
+            for chain_id, assets in self.chains.items()
+        }
+        directory = os.path.dirname(self.path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # Replaced at once, so another process never reads half a file
+            fd, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as tmp:
+                json.dump(chains, tmp)
+            os.replace(path, self.path)
+        except OSError:
+            log.warning('Unable to save the asset registry {}'.format(self.path))
+
+    def _add(self, chain_id, asset):
+        assets = self.chains.setdefault(chain_id, {})
+        assets[asset.id] = asset
+        assets[asset.symbol] = asset
+        return asset
+
+    @staticmethod
+    def chain_id(bitshares_instance):
+        return bitshares_instance.rpc.chain_params['chain_id']
+
+    def get(self, asset, bitshares_instance=None):
+        """ Returns the descriptor of an asset
+
+            :param asset: asset id, symbol, :class:`bitshares.asset.Asset`
+                or any dict with the id, symbol and precision of the asset
+            :param bitshares.BitShares bitshares_instance: instance of the
+                chain, to fetch the asset when it isn't registered yet
+            :rtype: AssetInfo
+        """
+        if isinstance(asset, AssetInfo):
+            return asset
+        bitshares_instance = bitshares_instance or shared_bitshares_instance()
+        chain_id = self.chain_id(bitshares_instance)
+
+        with self.lock:
+            self._load()
+            assets = self.chains.get(chain_id, {})
+            if isinstance(asset, str):
+                if asset in assets:
+                    return assets[asset]
+            elif asset['id'] in assets:
+                return assets[asset['id']]
+
+        if isinstance(asset, str):
+            asset = Asset(asset, bitshares_instance=bitshares_instance)
+
+        with self.lock:
+            info = self._add(chain_id, AssetInfo(asset['id'], asset['symbol'], int(asset['precision'])))
+            self._save()
+        return info
+
+
+asset_registry = AssetRegistry()
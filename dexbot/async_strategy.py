@@ -0,0 +1,133 @@
+import asyncio
+import contextvars
+import functools
+import threading
+
+from bitshares.price import FilledOrder, Order, UpdateCallOrder
+
+from .basestrategy import BaseStrategy
+
+# Lane of the dispatcher whose events the current task of the loop handles
+current_lane = contextvars.ContextVar('current_lane', default=None)
+
+
+async def run_in_executor(func, *args):
+    """ Runs a blocking callable on the default executor of the running loop
+
+        The lane being handled takes the thread of the executor meanwhile, so
+        that the callable may remove its own lane without waiting for itself.
+    """
+    lane = current_lane.get()
+
+    def run():
+        if lane is None:
+            return func(*args)
+        previous = lane.thread
+        lane.thread = threading.get_ident()
+        try:
+            return func(*args)
+        finally:
+            lane.thread = previous
+
+    return await asyncio.get_event_loop().run_in_executor(None, run)
+
+
+class AsyncStrategy(BaseStrategy):
+    """ Base of the strategies written for the asyncio runtime, see
+        :class:`dexbot.async_worker.AsyncWorkerInfrastructure`
+
+        Event handlers may be coroutine functions, they run on the event
+        loop and are awaited in turn. Plain handlers, and the blocking calls
+        of the ``async_*`` methods, run on the default executor of the loop.
+
+        The ``async_*`` methods are a facade over the thread pool of the
+        runtime, not a native asynchronous client: each of them blocks a
+        thread of the pool for as long as its call to the node takes, and
+        the calls sharing a node connection are made one at a time.
+        Overlapping the node calls of hundreds of workers is thus out of
+        scope: at most :data:`dexbot.dispatcher.DISPATCH_THREADS` calls are
+        waited on at once, whatever the number of workers.
+
+        The handlers are only awaited by the asyncio runtime, the other ones
+        refuse to run such a worker.
+
+        .. code-block:: python
+
+            class Strategy(AsyncStrategy):
+                def __init__(self, *args, **kwargs):
+                    super().__init__(*args, **kwargs)
+                    self.ontick += self.tick
+
+                async def tick(self, block):
+                    ticker = await self.async_ticker()
+                    ...
+    """
+
+    # The threaded runtimes would call the coroutine handlers without awaiting them
+    needs_coroutines = True
+
+    async def run_sync(self, func, *args, **kwargs):
+        """ Runs a blocking call on the executor of the event loop
+        """
+        return await run_in_executor(functools.partial(func, *args, **kwargs))
+
+    async def fire(self, event, *args):
+        """ Calls the handlers of an event, awaiting the coroutine ones and
+            running the others on the executor
+        """
+        handlers = getattr(self, event)
+        # Error events are often replaced by a plain method
+        for handler in tuple(getattr(handlers, 'targets', [handlers])):
+            if asyncio.iscoroutinefunction(handler):
+                await handler(*args)
+            else:
+                await self.run_sync(handler, *args)
+
+    async def _callbackPlaceFillOrders(self, d):
+        if isinstance(d, FilledOrder):
+            await self.fire('onOrderMatched', d)
+        elif isinstance(d, Order):
+            await self.fire('onOrderPlaced', d)
+        elif isinstance(d, UpdateCallOrder):
+            await self.fire('onUpdateCallOrder', d)
+
+    async def _callbackMarketUpdateBatch(self, updates):
+        for d in updates[:-1]:
+            await self._callbackPlaceFillOrders(d)
+        if updates:
+            await self.fire('onMarketUpdate', updates[-1])
+
+    async def async_ticker(self):
+        """ Returns the ticker of the worker's market, see :func:`ticker`
+        """
+        return await self.run_sync(self.ticker)
+
+    async def async_orderbook(self, limit=25):
+        """ Returns the order book of the worker's market, see :func:`orderbook`
+        """
+        return await self.run_sync(self.orderbook, limit)
+
+    async def async_refresh(self):
+        """ Reloads the worker's account, with its balances and open orders
+        """
+        await self.run_sync(self.account.refresh)
+
+    async def async_open_order_ids(self):
+        """ Returns the ids of the account's open orders, see :func:`get_open_order_ids`
+        """
+        return await self.run_sync(self.get_open_order_ids)
+
+    async def async_place_orders(self, place, cancel=None, **kwargs):
+        """ Cancels and places orders in a single transaction, see :func:`broadcast_orders`
+        """
+        return await self.run_sync(self.broadcast_orders, place, cancel, **kwargs)
+
+    async def async_reconcile_orders(self, desired, orders=None):
+        """ Brings the worker's orders to the desired set, see :func:`reconcile_orders`
+        """
+        return await self.run_sync(self.reconcile_orders, desired, orders)
+
+    async def async_cancel(self, orders):
+        """ Cancels the orders, see :func:`cancel`
+        """
+        await self.run_sync(self.cancel, orders)
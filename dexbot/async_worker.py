@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import threading
+import time
+
+from .async_strategy import AsyncStrategy, current_lane, run_in_executor
+from .dispatcher import Dispatcher
+from .worker import WorkerInfrastructure, ERROR_EVENTS, is_droppable
+
+log = logging.getLogger(__name__)
+
+
+class AsyncDispatcher(Dispatcher):
+    """ Dispatcher running the lanes as tasks of an asyncio event loop
+
+        Coroutine functions are awaited on the loop, other callables run on
+        the thread pool, which is the default executor of the loop. The
+        loop runs in a thread of its own.
+
+        .. note:: The bitshares library is synchronous, so every call to the
+                  node still blocks a thread of the pool while it waits. At
+                  most ``threads`` calls are thus waited on at once, fewer
+                  when the calls share a node connection, which carries one
+                  call at a time.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self.executor)
+        self.thread = threading.Thread(target=self.loop.run_forever, name='dexbot-asyncio', daemon=True)
+        self.thread.start()
+
+    def _schedule(self, lane):
+        self.loop.call_soon_threadsafe(self.loop.create_task, self._run_async(lane))
+
+    async def _run_async(self, lane):
+        current_lane.set(lane)
+        while True:
+            event = lane.pop()
+            if event is None:
+                return
+            func, args, queued, _ = event
+            # Removing the lane from a handler on the loop mustn't wait for it
+            lane.thread = self.thread.ident
+
+            start = time.time()
+            try:
+                if asyncio.iscoroutinefunction(func):
+                    await func(*args)
+                else:
+                    await run_in_executor(func, *args)
+            except Exception:
+                failed = True
+                log.exception('Unhandled error in the events of "{}"'.format(lane.name))
+            else:
+                failed = False
+            lane.record(queued, start, time.time(), failed)
+
+    def shutdown(self, wait=True):
+        super().shutdown(wait=wait)
+        self.loop.call_soon_threadsafe(self._stop)
+
+    def _stop(self):
+        """ Stops the loop once the tasks of the lanes returned, which the
+            closed lanes do as soon as their running event is handled
+        """
+        tasks = asyncio.all_tasks(self.loop)
+        if tasks:
+            asyncio.gather(*tasks, return_exceptions=True).add_done_callback(lambda _: self.loop.stop())
+        else:
+            self.loop.stop()
+
+
+class AsyncWorkerInfrastructure(WorkerInfrastructure):
+    """ Worker runtime handling the events on an asyncio event loop
+
+        Workers based on :class:`dexbot.async_strategy.AsyncStrategy` have
+        their coroutine handlers awaited on the loop. Other strategies run
+        unmodified, each event being handled on the executor of the loop.
+        Either way the events of a worker are handled one at a time and in
+        order.
+
+        The calls to the node are not made any more concurrent than in the
+        threaded runtime, see :class:`AsyncDispatcher`: the loop is a
+        programming model for the strategies, on top of the thread pool.
+    """
+
+    dispatcher_class = AsyncDispatcher
+    runs_coroutines = True
+
+    def dispatch(self, worker_name, event, data):
+        self.dispatcher.submit(worker_name, self.handle_event_async, worker_name, event, data,
+                               droppable=is_droppable(event, data))
+
+    async def handle_event_async(self, worker_name, event, data):
+        worker = self.workers.get(worker_name)
+        if not isinstance(worker, AsyncStrategy):
+            # Synchronous strategies are adapted by running them on the executor
+            await run_in_executor(self.handle_event, worker_name, event, data)
+            return
+
+        if worker.disabled:
+            worker.log.debug('Worker "{}" is disabled'.format(worker_name))
+            return
+        try:
+            await worker.fire(event, data)
+        except Exception as e:
+            worker.log.exception("in {}()".format(event))
+            try:
+                await worker.fire(ERROR_EVENTS[event], e)
+            except Exception:
+                worker.log.exception("in {}()".format(ERROR_EVENTS[event]))
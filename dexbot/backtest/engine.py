@@ -0,0 +1,304 @@
+import importlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from bitshares.account import AccountUpdate
+from bitshares.blockchainobject import BlockchainObject
+from bitshares.instance import SharedInstance, set_shared_bitshares_instance
+from bitshares.price import FilledOrder, Order
+from bitshares.utils import assets_from_string
+
+from dexbot import storage
+from dexbot.assets import asset_registry
+from dexbot.order_state import OrderState
+from dexbot.worker import ERROR_EVENTS
+
+from .exchange import Exchange, BLOCK_INTERVAL, CORE_SYMBOL
+from .node import SimulatedNode, CHAIN_ID
+from .simulated import SimulatedBitShares
+
+log = logging.getLogger(__name__)
+
+
+class BacktestError(Exception):
+    pass
+
+
+def apply_event(exchange, book, event):
+    """ Plays an event of a feed on the book of an exchange, see
+        :class:`dexbot.backtest.feed.Feed`
+    """
+    kind = event['type']
+    if kind == 'ticker':
+        exchange.set_market_book(
+            book,
+            [[event['bid'], None]] if event.get('bid') else [],
+            [[event['ask'], None]] if event.get('ask') else []
+        )
+        if event.get('latest'):
+            book.latest = float(event['latest'])
+    elif kind == 'orderbook':
+        exchange.set_market_book(book, event.get('bids', []), event.get('asks', []))
+    elif kind == 'trade':
+        exchange.market_trade(book, event['price'], event['amount'])
+
+
+class Backtest:
+    """ Runs a worker of the config against recorded market data
+
+        The worker runs unchanged, on a :class:`SimulatedBitShares`
+        instance whose node is an in-memory exchange replaying the feed,
+        see :mod:`dexbot.backtest.exchange`. Time is simulated too: the
+        feed is cut into blocks of ``interval`` seconds, and each block
+        delivers, as :class:`dexbot.worker.WorkerInfrastructure` does, the
+        market updates of the block, the account update when the account
+        changed, then ``ontick``. Strategies reading the time through
+        :meth:`dexbot.basestrategy.BaseStrategy.now` get the time of the
+        block. The open orders of the account are mirrored by an
+        :class:`dexbot.order_state.OrderState` fed by the blocks and the
+        account updates of the exchange, as in the live runs.
+
+        The worker keeps its data in a database of its own, removed
+        afterwards, so the backtests never touch the data of the live
+        workers.
+
+        :param dict config: the config, with the worker in it
+        :param str worker_name: name of the worker to run
+        :param dexbot.backtest.feed.Feed feed: market data of the worker's market
+        :param dict balances: initial balances of the worker's account, by
+            asset symbol
+        :param dict fees: operation fees in units of the core asset, see
+            :data:`dexbot.backtest.exchange.DEFAULT_FEES`
+        :param int interval: seconds between two blocks
+    """
+
+    def __init__(self, config, worker_name, feed, balances, fees=None, interval=BLOCK_INTERVAL):
+        if worker_name not in config.get('workers', {}):
+            raise BacktestError('No worker named {} in the config'.format(worker_name))
+        self.config = config
+        self.worker_name = worker_name
+        self.worker_config = config['workers'][worker_name]
+        self.feed = feed
+        self.balances = balances
+        self.interval = interval
+
+        quote, base = assets_from_string(self.worker_config['market'])
+        if (base, quote) != (feed.base, feed.quote):
+            raise BacktestError('The feed is for {}:{}, not for the market {} of the worker'.format(
+                feed.quote, feed.base, self.worker_config['market']))
+
+        self.exchange = Exchange(fees=fees, start_time=feed.start_time)
+        self.base = self.exchange.add_asset(
+            base, feed.market.get('base_precision', 5), feed.market.get('base_market_fee', 0))
+        self.quote = self.exchange.add_asset(
+            quote, feed.market.get('quote_precision', 5), feed.market.get('quote_market_fee', 0))
+        self.book = self.exchange.add_market(base, quote)
+        for symbol in balances:
+            self.exchange.add_asset(symbol)
+        self.account = self.exchange.add_account(self.worker_config['account'], balances)
+
+        self.node = SimulatedNode(self.exchange)
+        self.bitshares = None
+        self.order_state = None
+        self.worker = None
+
+    def create_worker(self):
+        strategy_class = getattr(importlib.import_module(self.worker_config['module']), 'Strategy')
+        if getattr(strategy_class, 'needs_coroutines', False):
+            raise BacktestError('The strategy of {} needs the asyncio runtime, it can\'t be backtested'.format(
+                self.worker_name))
+        return strategy_class(
+            config=self.config,
+            name=self.worker_name,
+            bitshares_instance=self.bitshares,
+            order_state=self.order_state,
+            clock=self.exchange.now
+        )
+
+    def handle_event(self, event, data):
+        """ Calls the handler of an event of the worker, as
+            :meth:`dexbot.worker.WorkerInfrastructure.handle_event` does
+        """
+        if self.worker.disabled:
+            return
+        try:
+            getattr(self.worker, event)(data)
+        except Exception as e:
+            self.worker.log.exception("in {}()".format(event))
+            try:
+                getattr(self.worker, ERROR_EVENTS[event])(e)
+            except Exception:
+                self.worker.log.exception("in {}()".format(ERROR_EVENTS[event]))
+
+    def apply(self, event):
+        """ Plays an event of the feed on the exchange
+        """
+        apply_event(self.exchange, self.book, event)
+
+    def deliver(self, block_id):
+        """ Sends the notifications of the block to the worker
+        """
+        self.order_state.on_block()
+        notifications, accounts = self.exchange.collect_notifications()
+        updates = []
+        for pair, item in notifications:
+            if pair != self.book.pair:
+                continue
+            if 'pays' in item:
+                updates.append(FilledOrder(item, blockchain_instance=self.bitshares))
+            else:
+                updates.append(Order(item, blockchain_instance=self.bitshares))
+
+        if self.worker.coalesce_market_updates:
+            if updates:
+                self.handle_event('onMarketUpdateBatch', updates)
+        else:
+            for update in updates:
+                self.handle_event('onMarketUpdate', update)
+
+        if self.account['id'] in accounts:
+            statistics = dict(self.exchange.get_object(self.account['statistics']))
+            self.order_state.on_account(statistics)
+            self.handle_event('onAccount', AccountUpdate(statistics, blockchain_instance=self.bitshares))
+
+        self.handle_event('ontick', block_id)
+
+    def price(self):
+        """ Returns the price of the market, the latest one or the middle
+            of the book
+        """
+        if self.book.latest:
+            return self.book.latest
+        bid, ask = self.book.best_bid(), self.book.best_ask()
+        if bid and ask:
+            return (bid * ask) ** 0.5
+        return bid or ask or 0
+
+    def holdings(self):
+        """ Returns the base and quote amounts of the account, its open
+            orders included
+        """
+        amounts = {}
+        for asset in (self.base, self.quote):
+            satoshis = self.exchange.balance(self.account['id'], asset['id'])
+            satoshis += sum(order['for_sale'] for order in self.book.bids + self.book.asks
+                            if order['seller'] == self.account['id'] and
+                            order['sell_price']['base']['asset_id'] == asset['id'])
+            amounts[asset['symbol']] = satoshis / 10 ** asset['precision']
+        return amounts[self.base['symbol']], amounts[self.quote['symbol']]
+
+    def run(self):
+        """ Replays the feed
+
+            :return: dict of the results
+        """
+        previous_instance = SharedInstance.instance
+        previous_storage = storage.db_worker, storage.db_reader, storage.storage_cache
+        previous_registry_path = asset_registry.path
+        data_dir = tempfile.mkdtemp(prefix='dexbot-backtest-')
+        db_worker = storage.use_database(os.path.join(data_dir, storage.storageDatabase))
+        asset_registry.path = None
+        try:
+            self.bitshares = SimulatedBitShares(self.node)
+            self.order_state = OrderState(self.account['name'], self.bitshares)
+            # The strategies fetch their orders through the shared instance
+            set_shared_bitshares_instance(self.bitshares)
+            return self.replay()
+        finally:
+            set_shared_bitshares_instance(previous_instance)
+            BlockchainObject.clear_cache()
+            with asset_registry.lock:
+                asset_registry.chains.pop(CHAIN_ID, None)
+            asset_registry.path = previous_registry_path
+            db_worker.stop()
+            storage.db_worker, storage.db_reader, storage.storage_cache = previous_storage
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    def replay(self):
+        started = time.time()
+        start_base, start_quote = self.holdings()
+        start_price = None
+        blocks = 0
+
+        for block_time, events in self.feed.blocks(self.interval):
+            block_id = self.exchange.produce_block(block_time)
+            for event in events:
+                self.apply(event)
+            blocks += 1
+            if self.worker is None:
+                start_price = self.price()
+                # Created once the market has a price, notifications of the
+                # block before are of no use to it
+                self.worker = self.create_worker()
+                self.exchange.collect_notifications()
+            self.deliver(block_id)
+
+        if self.worker is None:
+            raise BacktestError('The feed has no events')
+
+        end_price = self.price()
+        end_base, end_quote = self.holdings()
+        start_value = start_base + start_quote * start_price
+        end_value = end_base + end_quote * end_price
+        hold_value = start_base + start_quote * end_price
+        wall_time = time.time() - started
+        simulated_time = self.feed.end_time - self.feed.start_time
+        core = self.exchange.core
+        return {
+            'worker': self.worker_name,
+            'market': '{}:{}'.format(self.quote['symbol'], self.base['symbol']),
+            'blocks': blocks,
+            'simulated_time': simulated_time,
+            'wall_time': wall_time,
+            'speedup': simulated_time / wall_time if wall_time else 0,
+            'start_price': start_price,
+            'end_price': end_price,
+            'start_balance': {self.base['symbol']: start_base, self.quote['symbol']: start_quote},
+            'end_balance': {self.base['symbol']: end_base, self.quote['symbol']: end_quote},
+            'start_value': start_value,
+            'end_value': end_value,
+            'hold_value': hold_value,
+            'profit': end_value - start_value,
+            'profit_percent': (end_value / start_value - 1) * 100 if start_value else 0,
+            'fills': len([fill for fill in self.exchange.fills if fill['account_id'] == self.account['id']]),
+            'orders_created': self.exchange.orders_created,
+            'orders_canceled': self.exchange.orders_canceled,
+            'operation_fees': self.exchange.paid_fees[self.account['id']] / 10 ** core['precision'],
+            'market_fees': {
+                self.exchange.get_object(asset_id)['symbol']: amount / 10 ** self.exchange.get_object(
+                    asset_id)['precision']
+                for asset_id, amount in self.exchange.market_fees.items() if amount
+            },
+            'rpc_calls': self.node.calls,
+            'order_state': self.order_state.stats(),
+            'disabled': self.worker.disabled
+        }
+
+
+def format_report(result):
+    """ Returns the results of a backtest as text
+    """
+    base, quote = result['market'].split(':')[1], result['market'].split(':')[0]
+    lines = [
+        'Worker {} on {}'.format(result['worker'], result['market']),
+        'Blocks:          {} ({:.0f} s simulated in {:.2f} s, {:.0f}x)'.format(
+            result['blocks'], result['simulated_time'], result['wall_time'], result['speedup']),
+        'Price:           {:.8g} -> {:.8g}'.format(result['start_price'], result['end_price']),
+        'Balance:         {:.8g} {} + {:.8g} {} -> {:.8g} {} + {:.8g} {}'.format(
+            result['start_balance'][base], base, result['start_balance'][quote], quote,
+            result['end_balance'][base], base, result['end_balance'][quote], quote),
+        'Value:           {:.8g} -> {:.8g} {} (holding: {:.8g})'.format(
+            result['start_value'], result['end_value'], base, result['hold_value']),
+        'Profit:          {:.8g} {} ({:+.2f}%)'.format(result['profit'], base, result['profit_percent']),
+        'Orders:          {} created, {} canceled, {} fills'.format(
+            result['orders_created'], result['orders_canceled'], result['fills']),
+        'Fees:            {:.8g} {}{}'.format(
+            result['operation_fees'], CORE_SYMBOL,
+            ''.join(', {:.8g} {}'.format(amount, symbol) for symbol, amount in result['market_fees'].items())),
+    ]
+    if result['disabled']:
+        lines.append('The worker disabled itself')
+    return '\n'.join(lines)
@@ -0,0 +1,648 @@
+import collections
+import datetime
+import logging
+
+from bitsharesapi.exceptions import UnhandledRPCError
+
+from dexbot.order_state import LIMIT_ORDER_CREATE, LIMIT_ORDER_CANCEL, FILL_ORDER
+
+log = logging.getLogger(__name__)
+
+# Seconds between two blocks of the chain
+BLOCK_INTERVAL = 3
+
+# Symbol and precision of the core asset, the operation fees are paid in it
+CORE_SYMBOL = 'BTS'
+CORE_PRECISION = 5
+
+# Operation fees, in units of the core asset
+DEFAULT_FEES = {
+    'limit_order_create': 0.05,
+    'limit_order_cancel': 0.005
+}
+
+# Name of the account standing for the recorded market in the fills
+MARKET_ACCOUNT = 'market'
+
+# Error messages of the node, some of them are told apart by the strategies
+ORDER_NOT_FOUND = 'Assert Exception: maybe_found != nullptr: Unable to find Object'
+AMOUNT_TO_SELL_ZERO = 'Assert Exception: amount_to_sell.amount > 0'
+MIN_TO_RECEIVE_ZERO = 'Assert Exception: min_to_receive.amount > 0'
+INSUFFICIENT_BALANCE = 'Assert Exception: insufficient_balance: Insufficient Balance: {}, unable to pay {}'
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+class Book:
+    """ Order book of a market, holding the orders of the simulated
+        accounts along with the liquidity of the recorded market
+
+        Prices are in units of the base asset per unit of the quote asset.
+        The levels of the recorded market are ``[price, amount]`` lists,
+        best first, the amount in units of the quote asset or None when the
+        market data tells the price only.
+    """
+
+    def __init__(self, base, quote):
+        self.base = base
+        self.quote = quote
+        # Orders of the simulated accounts, best first
+        self.bids = []
+        self.asks = []
+        self.market_bids = []
+        self.market_asks = []
+        self.latest = None
+        self.base_volume = 0.0
+        self.quote_volume = 0.0
+
+    @property
+    def pair(self):
+        return frozenset((self.base['id'], self.quote['id']))
+
+    def is_bid(self, order):
+        return order['sell_price']['base']['asset_id'] == self.base['id']
+
+    def price(self, order):
+        """ Returns the price of an order in base per quote
+        """
+        sell = order['sell_price']['base']
+        receive = order['sell_price']['quote']
+        if self.is_bid(order):
+            base, quote = sell['amount'], receive['amount']
+        else:
+            base, quote = receive['amount'], sell['amount']
+        return (base / 10 ** self.base['precision']) / (quote / 10 ** self.quote['precision'])
+
+    def insert(self, order):
+        """ Rests an order in the book, behind the orders of the same price
+        """
+        price = self.price(order)
+        if self.is_bid(order):
+            orders = self.bids
+            index = next((i for i, o in enumerate(orders) if self.price(o) < price), len(orders))
+        else:
+            orders = self.asks
+            index = next((i for i, o in enumerate(orders) if self.price(o) > price), len(orders))
+        orders.insert(index, order)
+
+    def remove(self, order):
+        orders = self.bids if self.is_bid(order) else self.asks
+        orders.remove(order)
+
+    def best_bid(self):
+        prices = [self.price(self.bids[0])] if self.bids else []
+        prices += [self.market_bids[0][0]] if self.market_bids else []
+        return max(prices) if prices else None
+
+    def best_ask(self):
+        prices = [self.price(self.asks[0])] if self.asks else []
+        prices += [self.market_asks[0][0]] if self.market_asks else []
+        return min(prices) if prices else None
+
+
+class Exchange:
+    """ In-memory exchange standing in for the chain in backtests
+
+        Holds the assets, accounts, balances and limit orders of a
+        simulated chain, as the objects the node would return, and matches
+        the orders of the simulated accounts against each other and against
+        the recorded market data:
+
+        * an order crossing the book is filled at once, at the prices of
+          the orders and of the recorded levels it takes
+        * a resting order is filled at its own price by the recorded trades
+          at or through its price, and when a recorded level crosses it
+
+        Operation fees are paid in the core asset, market fees are taken
+        from the amounts received. Orders don't expire.
+
+        :param dict fees: operation fees in units of the core asset, see
+            :data:`DEFAULT_FEES`
+        :param float start_time: unix time of the first block
+    """
+
+    def __init__(self, fees=None, start_time=0):
+        self.objects = {}
+        self.next_instance = collections.Counter()
+        self.assets = {}
+        self.accounts = {}
+        self.balances = {}
+        self.books = {}
+        self.fees = dict(DEFAULT_FEES, **(fees or {}))
+
+        self.head_block = 0
+        self.time = start_time
+        self.objects['2.1.0'] = {'id': '2.1.0'}
+        self.update_properties()
+
+        # Changes since the notifications were last collected
+        self.market_notifications = []
+        self.changed_accounts = set()
+
+        self.fills = []
+        self.orders_created = 0
+        self.orders_canceled = 0
+        self.paid_fees = collections.Counter()
+        self.market_fees = collections.Counter()
+
+        self.core = self.add_asset(CORE_SYMBOL, CORE_PRECISION)
+        self.market_account = self.add_account(MARKET_ACCOUNT)
+
+    # Objects
+
+    def new_id(self, space_type):
+        instance = self.next_instance[space_type]
+        self.next_instance[space_type] += 1
+        return '{}.{}'.format(space_type, instance)
+
+    def get_object(self, object_id):
+        return self.objects.get(object_id)
+
+    def add_asset(self, symbol, precision=CORE_PRECISION, market_fee_percent=0):
+        """ Creates an asset, or returns the existing one of the symbol
+
+            :param float market_fee_percent: fee taken from the amounts of
+                the asset received in trades, in percent
+        """
+        if symbol in self.assets:
+            return self.assets[symbol]
+        asset_id = self.new_id('1.3')
+        dynamic_data_id = self.new_id('2.3')
+        asset = {
+            'id': asset_id,
+            'symbol': symbol,
+            'precision': int(precision),
+            'issuer': '1.2.0',
+            'options': {
+                'max_supply': str(10 ** 15),
+                'market_fee_percent': int(market_fee_percent * 100),
+                'max_market_fee': str(10 ** 15),
+                'issuer_permissions': 0,
+                'flags': 0,
+                'core_exchange_rate': {
+                    'base': {'amount': 1, 'asset_id': asset_id},
+                    'quote': {'amount': 1, 'asset_id': '1.3.0'}
+                },
+                'whitelist_authorities': [],
+                'blacklist_authorities': [],
+                'whitelist_markets': [],
+                'blacklist_markets': [],
+                'description': '',
+                'extensions': []
+            },
+            'dynamic_asset_data_id': dynamic_data_id
+        }
+        self.objects[asset_id] = asset
+        self.objects[dynamic_data_id] = {
+            'id': dynamic_data_id, 'current_supply': '0', 'confidential_supply': '0',
+            'accumulated_fees': 0, 'fee_pool': 0
+        }
+        self.assets[symbol] = asset
+        return asset
+
+    def asset(self, asset):
+        """ Returns the asset of an id or a symbol
+        """
+        if asset in self.objects:
+            return self.objects[asset]
+        return self.assets.get(asset)
+
+    def add_account(self, name, balances=None, key=None):
+        """ Creates an account, or returns the existing one of the name
+
+            :param dict balances: amounts of the account, by asset symbol
+            :param str key: public key of the account, for the clients
+                signing their transactions, the signatures aren't checked
+        """
+        if name in self.accounts:
+            account = self.accounts[name]
+        else:
+            account_id = self.new_id('1.2')
+            statistics_id = self.new_id('2.6')
+            key_auths = [[key, 1]] if key else []
+            authority = {'weight_threshold': 1, 'account_auths': [], 'key_auths': key_auths, 'address_auths': []}
+            account = {
+                'id': account_id,
+                'name': name,
+                'membership_expiration_date': '1970-01-01T00:00:00',
+                'registrar': account_id,
+                'referrer': account_id,
+                'lifetime_referrer': account_id,
+                'network_fee_percentage': 2000,
+                'lifetime_referrer_fee_percentage': 3000,
+                'referrer_rewards_percentage': 0,
+                'owner': authority,
+                'active': dict(authority),
+                'options': {
+                    'memo_key': key or 'BTS1111111111111111111111111111111114T1Anm',
+                    'voting_account': '1.2.5',
+                    'num_witness': 0,
+                    'num_committee': 0,
+                    'votes': [],
+                    'extensions': []
+                },
+                'statistics': statistics_id,
+                'whitelisting_accounts': [],
+                'blacklisting_accounts': [],
+                'whitelisted_accounts': [],
+                'blacklisted_accounts': [],
+                'owner_special_authority': [0, {}],
+                'active_special_authority': [0, {}],
+                'top_n_control_flags': 0
+            }
+            self.objects[account_id] = account
+            self.objects[statistics_id] = {
+                'id': statistics_id,
+                'owner': account_id,
+                'most_recent_op': '2.9.0',
+                'total_ops': 0,
+                'removed_ops': 0,
+                'total_core_in_orders': 0,
+                'lifetime_fees_paid': 0,
+                'pending_fees': 0,
+                'pending_vested_fees': 0
+            }
+            self.accounts[name] = account
+            self.balances[account_id] = collections.Counter()
+
+        for symbol, amount in (balances or {}).items():
+            asset = self.asset(symbol)
+            self.balances[account['id']][asset['id']] += int(round(float(amount) * 10 ** asset['precision']))
+        return account
+
+    def account(self, account):
+        """ Returns the account of an id or a name
+        """
+        if account in self.objects:
+            return self.objects[account]
+        return self.accounts.get(account)
+
+    def add_market(self, base, quote):
+        """ Returns the order book of a market, created on first use
+
+            :param base: id or symbol of the base asset
+            :param quote: id or symbol of the quote asset
+        """
+        base = self.asset(base)
+        quote = self.asset(quote)
+        pair = frozenset((base['id'], quote['id']))
+        if pair not in self.books:
+            self.books[pair] = Book(base, quote)
+        return self.books[pair]
+
+    def book(self, asset_a, asset_b):
+        return self.books.get(frozenset((self.asset(asset_a)['id'], self.asset(asset_b)['id'])))
+
+    # Chain
+
+    def now(self):
+        """ Returns the time of the head block as a datetime
+        """
+        return datetime.datetime.utcfromtimestamp(self.time)
+
+    def block_id(self, block_num=None):
+        """ Returns the id of a block, its number comes first as on the chain
+        """
+        return '{:08x}'.format(self.head_block if block_num is None else block_num).ljust(40, '0')
+
+    def update_properties(self):
+        self.objects['2.1.0'].update({
+            'head_block_number': self.head_block,
+            'head_block_id': self.block_id(),
+            'time': self.now().strftime(TIME_FORMAT),
+            'last_irreversible_block_num': self.head_block
+        })
+
+    def produce_block(self, time=None):
+        """ Moves on to the next block, returns its id
+
+            :param float time: unix time of the block, defaults to one
+                :data:`BLOCK_INTERVAL` after the previous one
+        """
+        self.head_block += 1
+        self.time = time if time is not None else self.time + BLOCK_INTERVAL
+        self.update_properties()
+        return self.block_id()
+
+    def collect_notifications(self):
+        """ Returns the market notifications, as pairs of the market and of
+            the order or fill operation, and the ids of the accounts which
+            changed since the last call
+        """
+        notifications, self.market_notifications = self.market_notifications, []
+        accounts, self.changed_accounts = self.changed_accounts, set()
+        return notifications, accounts
+
+    def record_operation(self, op, result, account_ids):
+        """ Adds an operation to the history of the accounts
+        """
+        operation_id = self.new_id('1.11')
+        self.objects[operation_id] = {
+            'id': operation_id,
+            'op': op,
+            'result': result,
+            'block_num': self.head_block,
+            'trx_in_block': 0,
+            'op_in_trx': 0,
+            'virtual_op': 0
+        }
+        for account_id in account_ids:
+            statistics = self.objects[self.objects[account_id]['statistics']]
+            history_id = self.new_id('2.9')
+            self.objects[history_id] = {
+                'id': history_id,
+                'account': account_id,
+                'operation_id': operation_id,
+                'sequence': statistics['total_ops'] + 1,
+                'next': statistics['most_recent_op']
+            }
+            statistics['total_ops'] += 1
+            statistics['most_recent_op'] = history_id
+            self.changed_accounts.add(account_id)
+
+    # Balances
+
+    def balance(self, account_id, asset_id):
+        return self.balances[account_id][asset_id]
+
+    def fee(self, operation):
+        return int(round(self.fees.get(operation, 0) * 10 ** self.core['precision']))
+
+    def pay_fee(self, account_id, operation):
+        fee = self.fee(operation)
+        self.balances[account_id][self.core['id']] -= fee
+        self.paid_fees[account_id] += fee
+        return {'amount': fee, 'asset_id': self.core['id']}
+
+    # Transactions
+
+    def validate(self, operations):
+        """ Checks that the operations of a transaction can be applied
+            all together, raises the error of the node otherwise
+
+            The funds received from the fills of the transaction don't
+            count, the check may only be stricter than the chain's.
+        """
+        spent = collections.Counter()
+        refunded = collections.Counter()
+        canceled = set()
+        for op_type, data in operations:
+            if op_type == LIMIT_ORDER_CREATE:
+                account_id = data['seller']
+                if account_id not in self.balances:
+                    raise UnhandledRPCError('Assert Exception: Unknown account {}'.format(account_id))
+                for key in ('amount_to_sell', 'min_to_receive'):
+                    if self.objects.get(data[key]['asset_id']) is None:
+                        raise UnhandledRPCError('Assert Exception: Unknown asset {}'.format(data[key]['asset_id']))
+                if int(data['amount_to_sell']['amount']) <= 0:
+                    raise UnhandledRPCError(AMOUNT_TO_SELL_ZERO)
+                if int(data['min_to_receive']['amount']) <= 0:
+                    raise UnhandledRPCError(MIN_TO_RECEIVE_ZERO)
+                if data.get('fill_or_kill'):
+                    raise UnhandledRPCError('Assert Exception: fill_or_kill orders are not simulated')
+                spent[account_id, data['amount_to_sell']['asset_id']] += int(data['amount_to_sell']['amount'])
+                spent[account_id, self.core['id']] += self.fee('limit_order_create')
+            elif op_type == LIMIT_ORDER_CANCEL:
+                order = self.objects.get(data['order'])
+                account_id = data['fee_paying_account']
+                if order is None or data['order'] in canceled or order['seller'] != account_id:
+                    raise UnhandledRPCError(ORDER_NOT_FOUND)
+                canceled.add(data['order'])
+                refunded[account_id, order['sell_price']['base']['asset_id']] += order['for_sale']
+                spent[account_id, self.core['id']] += self.fee('limit_order_cancel')
+            else:
+                raise UnhandledRPCError('Assert Exception: Operation {} is not simulated'.format(op_type))
+
+        for (account_id, asset_id), amount in spent.items():
+            available = self.balance(account_id, asset_id) + refunded[account_id, asset_id]
+            if amount > available:
+                asset = self.objects[asset_id]
+                raise UnhandledRPCError(INSUFFICIENT_BALANCE.format(
+                    available / 10 ** asset['precision'], amount / 10 ** asset['precision']))
+
+    def apply_transaction(self, operations):
+        """ Applies the operations of a transaction, all of them or none
+
+            :param list operations: ``[op_type, data]`` operations as in
+                a transaction sent to the node
+            :return: list of the operation results
+        """
+        self.validate(operations)
+        results = []
+        for op_type, data in operations:
+            if op_type == LIMIT_ORDER_CREATE:
+                results.append([1, self.create_order(data)])
+            else:
+                results.append([2, self.cancel_order(data)])
+        return results
+
+    def create_order(self, data):
+        account_id = data['seller']
+        book = self.add_market(data['amount_to_sell']['asset_id'], data['min_to_receive']['asset_id'])
+        order_id = self.new_id('1.7')
+        order = {
+            'id': order_id,
+            'expiration': data.get('expiration', '2106-02-07T06:28:15'),
+            'seller': account_id,
+            'for_sale': int(data['amount_to_sell']['amount']),
+            'sell_price': {
+                'base': {'amount': int(data['amount_to_sell']['amount']),
+                         'asset_id': data['amount_to_sell']['asset_id']},
+                'quote': {'amount': int(data['min_to_receive']['amount']),
+                          'asset_id': data['min_to_receive']['asset_id']}
+            },
+            'deferred_fee': 0
+        }
+        fee = self.pay_fee(account_id, 'limit_order_create')
+        self.balances[account_id][order['sell_price']['base']['asset_id']] -= order['for_sale']
+        self.objects[order_id] = order
+        self.orders_created += 1
+        self.record_operation([LIMIT_ORDER_CREATE, dict(data, fee=fee)], [1, order_id], [account_id])
+
+        self.match(book, order)
+        if order['for_sale'] > 0:
+            book.insert(order)
+            self.market_notifications.append((book.pair, dict(order)))
+        return order_id
+
+    def cancel_order(self, data):
+        order = self.objects[data['order']]
+        account_id = order['seller']
+        fee = self.pay_fee(account_id, 'limit_order_cancel')
+        refund = {'amount': order['for_sale'], 'asset_id': order['sell_price']['base']['asset_id']}
+        self.close_order(order)
+        self.orders_canceled += 1
+        self.record_operation([LIMIT_ORDER_CANCEL, dict(data, fee=fee)], [2, refund], [account_id])
+        return refund
+
+    def close_order(self, order):
+        """ Removes an order from the book, refunding what is left of it
+        """
+        book = self.book(order['sell_price']['base']['asset_id'], order['sell_price']['quote']['asset_id'])
+        if order in book.bids or order in book.asks:
+            book.remove(order)
+        self.balances[order['seller']][order['sell_price']['base']['asset_id']] += max(order['for_sale'], 0)
+        order['for_sale'] = 0
+        self.objects.pop(order['id'], None)
+
+    # Matching
+
+    def quote_amount(self, book, order):
+        """ Returns the amount of quote an order still buys or sells, in units
+        """
+        if book.is_bid(order):
+            return order['for_sale'] / 10 ** book.base['precision'] / book.price(order)
+        return order['for_sale'] / 10 ** book.quote['precision']
+
+    def match(self, book, order):
+        """ Fills a new order against the orders and the market levels it crosses
+        """
+        bid = book.is_bid(order)
+        price = book.price(order)
+        while order['for_sale'] > 0:
+            own = book.asks if bid else book.bids
+            levels = book.market_asks if bid else book.market_bids
+            own_price = book.price(own[0]) if own else None
+            level_price = levels[0][0] if levels else None
+            if own_price is not None and (level_price is None or
+                                          (own_price <= level_price if bid else own_price >= level_price)):
+                maker_price, maker = own_price, own[0]
+            elif level_price is not None:
+                maker_price, maker = level_price, None
+            else:
+                break
+            if (bid and maker_price > price) or (not bid and maker_price < price):
+                break
+
+            if maker is not None:
+                amount = min(self.quote_amount(book, order), self.quote_amount(book, maker))
+            else:
+                amount = self.quote_amount(book, order)
+                if levels[0][1] is not None:
+                    amount = min(amount, levels[0][1])
+            filled = self.fill(book, order, maker_price, amount, is_maker=False)
+            if maker is not None:
+                self.fill(book, maker, maker_price, amount, is_maker=True)
+            elif levels[0][1] is not None:
+                levels[0][1] -= amount
+                if levels[0][1] <= 0:
+                    levels.pop(0)
+            if not filled:
+                break
+
+    def match_market(self, book, price, amount, bids=True, asks=True):
+        """ Fills the resting orders crossed by a trade or a level of the
+            recorded market, at their own prices
+
+            :param float amount: quote amount of the trade or level, None
+                for unlimited
+            :return: quote amount left over
+        """
+        for side, crossed in ((book.bids, lambda p: p >= price), (book.asks, lambda p: p <= price)):
+            if (side is book.bids and not bids) or (side is book.asks and not asks):
+                continue
+            while side and (amount is None or amount > 0):
+                order = side[0]
+                order_price = book.price(order)
+                if not crossed(order_price):
+                    break
+                fill = self.quote_amount(book, order)
+                if amount is not None:
+                    fill = min(fill, amount)
+                if not self.fill(book, order, order_price, fill, is_maker=True):
+                    break
+                if amount is not None:
+                    amount -= fill
+        return amount
+
+    def fill(self, book, order, price, amount, is_maker):
+        """ Fills an order of a simulated account for an amount of quote at a price
+
+            :return: False when the amount is too small to fill anything
+        """
+        bid = book.is_bid(order)
+        quote_amount = int(round(amount * 10 ** book.quote['precision']))
+        base_amount = int(round(amount * price * 10 ** book.base['precision']))
+        if bid:
+            pays, receives = min(base_amount, order['for_sale']), quote_amount
+            pays_asset, receives_asset = book.base, book.quote
+        else:
+            pays, receives = min(quote_amount, order['for_sale']), base_amount
+            pays_asset, receives_asset = book.quote, book.base
+        if pays <= 0 or receives <= 0:
+            # Left with dust, the chain cancels such an order
+            self.close_order(order)
+            return False
+
+        fee = receives * receives_asset['options']['market_fee_percent'] // 10000
+        account_id = order['seller']
+        order['for_sale'] -= pays
+        self.balances[account_id][receives_asset['id']] += receives - fee
+        self.market_fees[receives_asset['id']] += fee
+
+        fill = {
+            'fee': {'amount': fee, 'asset_id': receives_asset['id']},
+            'order_id': order['id'],
+            'account_id': account_id,
+            'pays': {'amount': pays, 'asset_id': pays_asset['id']},
+            'receives': {'amount': receives, 'asset_id': receives_asset['id']},
+            'fill_price': order['sell_price'],
+            'is_maker': is_maker
+        }
+        self.fills.append(dict(fill, block_num=self.head_block, price=price, amount=amount))
+        self.record_operation([FILL_ORDER, fill], [0, {}], [account_id])
+        self.market_notifications.append((book.pair, fill))
+        self.trade(book, price, amount)
+
+        # An order left unable to receive a single satoshi is done with
+        left = self.quote_amount(book, order)
+        if not bid:
+            left *= book.price(order)
+        if order['for_sale'] <= 0 or left * 10 ** receives_asset['precision'] < 1:
+            self.close_order(order)
+        return True
+
+    def trade(self, book, price, amount):
+        book.latest = price
+        book.quote_volume += amount
+        book.base_volume += amount * price
+
+    # Recorded market
+
+    def set_market_book(self, book, bids, asks):
+        """ Replaces the levels of the recorded market, filling the resting
+            orders they cross
+
+            :param list bids: ``[price, amount]`` levels, amount None when unknown
+            :param list asks: same for the asks
+        """
+        book.market_bids = sorted(([float(p), None if a is None else float(a)] for p, a in bids),
+                                  key=lambda level: -level[0])
+        book.market_asks = sorted(([float(p), None if a is None else float(a)] for p, a in asks),
+                                  key=lambda level: level[0])
+        for levels, bids_side in ((book.market_asks, True), (book.market_bids, False)):
+            while levels:
+                price, amount = levels[0]
+                left = self.match_market(book, price, amount, bids=bids_side, asks=not bids_side)
+                if left is None or left > 0:
+                    levels[0][1] = left
+                    break
+                levels.pop(0)
+
+    def market_trade(self, book, price, amount):
+        """ Plays a trade of the recorded market, filling the resting orders
+            at or through its price
+        """
+        price = float(price)
+        amount = float(amount)
+        self.match_market(book, price, amount)
+        self.trade(book, price, amount)
+        market_account = self.market_account['id']
+        self.market_notifications.append((book.pair, {
+            'fee': {'amount': 0, 'asset_id': book.quote['id']},
+            'order_id': None,
+            'account_id': market_account,
+            'pays': {'amount': int(amount * price * 10 ** book.base['precision']), 'asset_id': book.base['id']},
+            'receives': {'amount': int(amount * 10 ** book.quote['precision']), 'asset_id': book.quote['id']},
+            'is_maker': False
+        }))
@@ -0,0 +1,242 @@
+import gzip
+import json
+import os
+
+import numpy
+
+# Types of the events of a feed, their index is their code in the arrays
+EVENT_TYPES = ('block', 'ticker', 'orderbook', 'trade')
+
+# Arrays of a feed stored as columns, see Feed.to_arrays
+ARRAY_NAMES = ('type', 'time', 'a', 'b', 'c', 'levels', 'bids', 'asks', 'level_price', 'level_amount')
+
+
+class FeedError(Exception):
+    pass
+
+
+class Feed:
+    """ Recorded market data of one market, replayed by the backtests
+
+        A feed file holds one JSON object per line, gzip compressed when its
+        name ends with ``.gz``. The first line describes the market::
+
+            {"type": "market", "base": "USD", "quote": "BTS",
+             "base_precision": 4, "quote_precision": 5}
+
+        then come the events, by time, each with its unix ``time``. Prices
+        are in base per quote, amounts in quote:
+
+        * ``{"type": "block"}``: a block with nothing else in it
+        * ``{"type": "ticker", "bid": 0.1, "ask": 0.2, "latest": 0.15}``:
+          best prices of the market, standing for levels of unknown depth
+        * ``{"type": "orderbook", "bids": [[0.1, 500]], "asks": [[0.2, 300]]}``:
+          levels of the market
+        * ``{"type": "trade", "price": 0.15, "amount": 100}``: a trade
+
+        :param dict market: the description of the market
+        :param list events: the events, by time
+    """
+
+    def __init__(self, market, events):
+        for key in ('base', 'quote'):
+            if key not in market:
+                raise FeedError('The market of the feed has no {}'.format(key))
+        self.market = market
+        self.events = events
+
+    @property
+    def base(self):
+        return self.market['base']
+
+    @property
+    def quote(self):
+        return self.market['quote']
+
+    @property
+    def start_time(self):
+        return self.events[0]['time'] if self.events else 0
+
+    @property
+    def end_time(self):
+        return self.events[-1]['time'] if self.events else 0
+
+    @classmethod
+    def load(cls, path):
+        """ Reads a feed file
+        """
+        opener = gzip.open if path.endswith('.gz') else open
+        market = None
+        events = []
+        with opener(path, 'rt') as fd:
+            for number, line in enumerate(fd, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    raise FeedError('{}:{}: not a JSON object'.format(path, number))
+                if market is None:
+                    if event.get('type') != 'market':
+                        raise FeedError('{}: the first line must describe the market'.format(path))
+                    market = event
+                    continue
+                if event.get('type') not in EVENT_TYPES or 'time' not in event:
+                    raise FeedError('{}:{}: unknown event {}'.format(path, number, line[:80]))
+                events.append(event)
+        if market is None:
+            raise FeedError('{}: empty feed'.format(path))
+        events.sort(key=lambda event: event['time'])
+        return cls(market, events)
+
+    def save(self, path):
+        """ Writes the feed to a file
+        """
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'wt') as fd:
+            fd.write(json.dumps(dict(self.market, type='market')) + '\n')
+            for event in self.events:
+                fd.write(json.dumps(event) + '\n')
+
+    def to_arrays(self):
+        """ Returns the events as columns
+
+            Tickers keep bid, ask and latest in ``a``, ``b`` and ``c``, trades
+            their price and amount in ``a`` and ``b``, NaN standing for
+            missing values. The levels of the order books are stored one
+            after the other in ``level_price`` and ``level_amount``, the bids
+            first, from the index ``levels`` of the event.
+
+            :return: dict of numpy arrays, see :data:`ARRAY_NAMES`
+        """
+        count = len(self.events)
+        nan = float('nan')
+        arrays = {
+            'type': numpy.zeros(count, dtype='i1'),
+            'time': numpy.zeros(count, dtype='f8'),
+            'a': numpy.full(count, nan),
+            'b': numpy.full(count, nan),
+            'c': numpy.full(count, nan),
+            'levels': numpy.zeros(count, dtype='i8'),
+            'bids': numpy.zeros(count, dtype='i4'),
+            'asks': numpy.zeros(count, dtype='i4')
+        }
+        prices = []
+        amounts = []
+        for index, event in enumerate(self.events):
+            kind = event['type']
+            arrays['type'][index] = EVENT_TYPES.index(kind)
+            arrays['time'][index] = event['time']
+            if kind == 'ticker':
+                values = (event.get('bid'), event.get('ask'), event.get('latest'))
+            elif kind == 'trade':
+                values = (event['price'], event['amount'], None)
+            else:
+                values = (None, None, None)
+            for column, value in zip('abc', values):
+                if value is not None:
+                    arrays[column][index] = value
+            if kind == 'orderbook':
+                bids, asks = event.get('bids', []), event.get('asks', [])
+                arrays['levels'][index] = len(prices)
+                arrays['bids'][index] = len(bids)
+                arrays['asks'][index] = len(asks)
+                for price, amount in bids + asks:
+                    prices.append(price)
+                    amounts.append(nan if amount is None else amount)
+        arrays['level_price'] = numpy.array(prices, dtype='f8')
+        arrays['level_amount'] = numpy.array(amounts, dtype='f8')
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, market, arrays):
+        """ Returns a feed reading its events from columns, see :meth:`to_arrays`
+        """
+        return cls(market, EventArrays(arrays))
+
+    def save_arrays(self, directory):
+        """ Writes the feed as one numpy file per column, to be memory-mapped
+            by :meth:`load_arrays`
+        """
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'market.json'), 'w') as fd:
+            json.dump(self.market, fd)
+        for name, array in self.to_arrays().items():
+            numpy.save(os.path.join(directory, name + '.npy'), array)
+
+    @classmethod
+    def load_arrays(cls, directory):
+        """ Reads a feed written by :meth:`save_arrays`, its columns mapped
+            read-only into memory, so that the processes reading the same
+            feed share its pages
+        """
+        with open(os.path.join(directory, 'market.json')) as fd:
+            market = json.load(fd)
+        arrays = {name: numpy.load(os.path.join(directory, name + '.npy'), mmap_mode='r') for name in ARRAY_NAMES}
+        return cls.from_arrays(market, arrays)
+
+    def blocks(self, interval):
+        """ Groups the events into blocks, one every interval seconds from the
+            first event, empty blocks included
+
+            :return: generator of the block times and of the events of the blocks
+        """
+        if not self.events:
+            return
+        time = self.start_time
+        events = []
+        for event in self.events:
+            while event['time'] >= time + interval:
+                yield time, events
+                events = []
+                time += interval
+            events.append(event)
+        yield time, events
+
+
+class EventArrays:
+    """ Sequence of the events of a feed stored as columns, each event is
+        built when accessed
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+
+    def __len__(self):
+        return len(self.arrays['type'])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+
+        arrays = self.arrays
+        kind = EVENT_TYPES[arrays['type'][index]]
+        event = {'type': kind, 'time': float(arrays['time'][index])}
+        if kind == 'ticker':
+            for key, column in (('bid', 'a'), ('ask', 'b'), ('latest', 'c')):
+                value = float(arrays[column][index])
+                if value == value:
+                    event[key] = value
+        elif kind == 'trade':
+            event['price'] = float(arrays['a'][index])
+            event['amount'] = float(arrays['b'][index])
+        elif kind == 'orderbook':
+            start = int(arrays['levels'][index])
+            middle = start + int(arrays['bids'][index])
+            end = middle + int(arrays['asks'][index])
+            levels = [
+                [float(price), None if amount != amount else float(amount)]
+                for price, amount in zip(arrays['level_price'][start:end], arrays['level_amount'][start:end])
+            ]
+            event['bids'] = levels[:middle - start]
+            event['asks'] = levels[middle - start:]
+        return event
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
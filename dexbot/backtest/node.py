@@ -0,0 +1,209 @@
+import hashlib
+
+from bitsharesapi.exceptions import UnhandledRPCError
+
+from dexbot.helper import copy_object
+
+from .exchange import CORE_SYMBOL, LIMIT_ORDER_CREATE
+
+# Identifies the simulated chain, unknown to the bitshares library on purpose
+CHAIN_ID = hashlib.sha256(b'dexbot backtest').hexdigest()
+
+
+class SimulatedNode:
+    """ Answers the calls the strategies make to a node from an
+        :class:`dexbot.backtest.exchange.Exchange`
+
+        Stands in for :class:`bitsharesapi.bitsharesnoderpc.BitSharesNodeRPC`
+        as ``bitshares.rpc``. Objects of the exchange are returned as copies
+        in the format of the node, amounts and prices of the market calls as
+        strings. The results built for a call are returned as they are.
+    """
+
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.chain_params = {'chain_id': CHAIN_ID, 'prefix': 'BTS', 'core_symbol': CORE_SYMBOL}
+        self.url = 'backtest'
+        self.calls = 0
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        raise UnhandledRPCError('No method with name {} in the simulated node'.format(name))
+
+    def _result(self, result):
+        self.calls += 1
+        return result
+
+    def _objects(self, result):
+        # The callers may change what they get, the exchange must not see it
+        return self._result(copy_object(result))
+
+    # Objects
+
+    def get_objects(self, ids, **kwargs):
+        return self._objects([self.exchange.get_object(object_id) for object_id in ids])
+
+    def get_object(self, object_id, **kwargs):
+        return self.get_objects([object_id])[0]
+
+    def get_chain_properties(self, **kwargs):
+        return self._result({'id': '2.11.0', 'chain_id': CHAIN_ID})
+
+    def get_dynamic_global_properties(self, **kwargs):
+        return self._objects(self.exchange.get_object('2.1.0'))
+
+    def get_block_header(self, block_num, **kwargs):
+        return self._result({'previous': self.exchange.block_id(block_num - 1),
+                             'timestamp': self.exchange.get_object('2.1.0')['time']})
+
+    # Assets
+
+    def lookup_asset_symbols(self, symbols, **kwargs):
+        return self._objects([self.exchange.asset(symbol) for symbol in symbols])
+
+    def get_asset(self, name, **kwargs):
+        return self.lookup_asset_symbols([name])[0]
+
+    # Accounts
+
+    def lookup_account_names(self, names, **kwargs):
+        return self._objects([self.exchange.account(name) for name in names])
+
+    def get_account_by_name(self, name, **kwargs):
+        return self.lookup_account_names([name])[0]
+
+    def get_account(self, name, **kwargs):
+        return self.lookup_account_names([name])[0]
+
+    def get_full_accounts(self, names, subscribe=False, **kwargs):
+        result = []
+        for name in names:
+            account = self.exchange.account(name)
+            if account is None:
+                continue
+            result.append([name, {
+                'account': account,
+                'statistics': self.exchange.get_object(account['statistics']),
+                'registrar_name': account['name'],
+                'referrer_name': account['name'],
+                'lifetime_referrer_name': account['name'],
+                'votes': [],
+                'balances': [
+                    {'owner': account['id'], 'asset_type': asset_id, 'balance': amount}
+                    for asset_id, amount in self._balances(account['id'])
+                ],
+                'vesting_balances': [],
+                'limit_orders': self._account_orders(account['id']),
+                'call_orders': [],
+                'settle_orders': [],
+                'proposals': [],
+                'assets': [],
+                'withdraws': []
+            }])
+        return self._objects(result)
+
+    def get_account_balances(self, account_id, assets, **kwargs):
+        account = self.exchange.account(account_id)
+        if account is None:
+            raise UnhandledRPCError('Assert Exception: Unknown account {}'.format(account_id))
+        balances = self._balances(account['id'])
+        if assets:
+            assets = [self.exchange.asset(asset)['id'] for asset in assets]
+            balances = [(asset_id, self.exchange.balance(account['id'], asset_id)) for asset_id in assets]
+        return self._result([{'amount': amount, 'asset_id': asset_id} for asset_id, amount in balances])
+
+    def _balances(self, account_id):
+        return sorted((asset_id, amount) for asset_id, amount in self.exchange.balances[account_id].items() if amount)
+
+    def _account_orders(self, account_id):
+        orders = [
+            order for book in self.exchange.books.values() for order in book.bids + book.asks
+            if order['seller'] == account_id
+        ]
+        return sorted(orders, key=lambda order: int(order['id'].split('.')[2]))
+
+    # Markets
+
+    def _book(self, base, quote):
+        base = self.exchange.asset(base)
+        quote = self.exchange.asset(quote)
+        if base is None or quote is None:
+            raise UnhandledRPCError('Assert Exception: Unknown asset')
+        book = self.exchange.add_market(base['id'], quote['id'])
+        return book, book.base['id'] != base['id']
+
+    def get_ticker(self, base, quote, **kwargs):
+        book, inverted = self._book(base, quote)
+        bid, ask, latest = book.best_bid(), book.best_ask(), book.latest
+        base_volume, quote_volume = book.base_volume, book.quote_volume
+        if inverted:
+            bid, ask = (1 / ask if ask else None), (1 / bid if bid else None)
+            latest = 1 / latest if latest else None
+            base_volume, quote_volume = quote_volume, base_volume
+        return self._result({
+            'time': self.exchange.get_object('2.1.0')['time'],
+            'base': base,
+            'quote': quote,
+            'latest': repr(latest or 0),
+            'lowest_ask': repr(ask or 0),
+            'highest_bid': repr(bid or 0),
+            'percent_change': '0',
+            'base_volume': repr(base_volume),
+            'quote_volume': repr(quote_volume)
+        })
+
+    def get_24_volume(self, base, quote, **kwargs):
+        ticker = self.get_ticker(base, quote)
+        return {key: ticker[key] for key in ('time', 'base', 'quote', 'base_volume', 'quote_volume')}
+
+    def get_order_book(self, base, quote, limit=50, **kwargs):
+        """ Returns the levels of the simulated accounts and of the recorded
+            market, leaving out the recorded levels of unknown depth
+        """
+        book, inverted = self._book(base, quote)
+        bids = [(book.price(order), self.exchange.quote_amount(book, order)) for order in book.bids]
+        bids += [tuple(level) for level in book.market_bids if level[1] is not None]
+        asks = [(book.price(order), self.exchange.quote_amount(book, order)) for order in book.asks]
+        asks += [tuple(level) for level in book.market_asks if level[1] is not None]
+
+        def levels(entries, best_first):
+            entries = sorted(entries, key=lambda entry: entry[0], reverse=best_first)[:limit]
+            if inverted:
+                # Same amounts, base and quote swapped
+                return [{'price': repr(1 / price), 'quote': repr(amount * price), 'base': repr(amount)}
+                        for price, amount in entries]
+            return [{'price': repr(price), 'quote': repr(amount), 'base': repr(amount * price)}
+                    for price, amount in entries]
+
+        if inverted:
+            return self._result({'base': base, 'quote': quote,
+                                 'bids': levels(asks, False), 'asks': levels(bids, True)})
+        return self._result({'base': base, 'quote': quote, 'bids': levels(bids, True), 'asks': levels(asks, False)})
+
+    def get_limit_orders(self, asset_a, asset_b, limit, **kwargs):
+        book = self.exchange.book(asset_a, asset_b)
+        if book is None:
+            return []
+        return self._objects(book.bids[:limit] + book.asks[:limit])
+
+    # Transactions
+
+    def get_required_fees(self, ops, asset_id='1.3.0', **kwargs):
+        fees = []
+        for op_type, _ in ops:
+            operation = 'limit_order_create' if op_type == LIMIT_ORDER_CREATE else 'limit_order_cancel'
+            fees.append({'amount': self.exchange.fee(operation), 'asset_id': self.exchange.core['id']})
+        return self._result(fees)
+
+    def broadcast_transaction_synchronous(self, tx, **kwargs):
+        """ Applies the operations of a transaction in the head block
+        """
+        results = self.exchange.apply_transaction(tx['operations'])
+        trx = dict(tx, operation_results=results)
+        return self._result({'id': self.exchange.block_id()[:40], 'block_num': self.exchange.head_block,
+                             'trx_num': 0, 'trx': trx})
+
+    def broadcast_transaction(self, tx, **kwargs):
+        self.exchange.apply_transaction(tx['operations'])
+        self.calls += 1
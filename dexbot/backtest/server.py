@@ -0,0 +1,427 @@
+import base64
+import hashlib
+import json
+import logging
+import random
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from bitsharesbase.chains import known_chains
+
+from .engine import apply_event
+from .exchange import BLOCK_INTERVAL, CORE_SYMBOL
+from .node import SimulatedNode, CHAIN_ID
+
+log = logging.getLogger(__name__)
+
+# Appended to the key of the handshake of a websocket, see RFC 6455
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# Opcodes of the websocket frames
+OPCODE_TEXT = 0x1
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+# Largest message taken from a client, transactions are far smaller
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+# Ids of the APIs of the node, returned by the calls named after them
+API_IDS = {'database': 2, 'history': 3, 'network_broadcast': 4, 'crypto': 5, 'asset': 6, 'orders': 7}
+
+# Name of the simulated chain among the chains known to the bitshares library
+CHAIN_NAME = 'DEXBOT_BACKTEST'
+
+
+def register_chain():
+    """ Makes the simulated chain known to the bitshares library, which
+        refuses to connect to unknown chains
+    """
+    known_chains.setdefault(CHAIN_NAME, {'chain_id': CHAIN_ID, 'core_symbol': CORE_SYMBOL, 'prefix': 'BTS'})
+
+
+class WebsocketClosed(Exception):
+    pass
+
+
+class Connection(socketserver.BaseRequestHandler):
+    """ Websocket connection of a client of the :class:`NodeServer`
+
+        Keeps the subscriptions of the client, the notices of a block are
+        sent by the thread producing the blocks.
+    """
+
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.request.makefile('rb')
+        # The replies and the notices are sent from different threads
+        self.send_lock = threading.Lock()
+        self.object_callback = None
+        self.block_callback = None
+        self.market_callbacks = {}
+        self.accounts = set()
+
+    def handle(self):
+        try:
+            self.handshake()
+        except (OSError, ValueError, WebsocketClosed) as e:
+            log.debug('Handshake of {} failed: {}'.format(self.client_address, e))
+            return
+        self.server.add_connection(self)
+        try:
+            while True:
+                message = self.receive()
+                if self.server.latency:
+                    time.sleep(self.server.latency)
+                reply = self.server.call(self, message)
+                if reply is not None:
+                    self.send(reply)
+        except (OSError, WebsocketClosed):
+            pass
+        except Exception:
+            log.exception('Connection of {} failed'.format(self.client_address))
+        finally:
+            self.server.remove_connection(self)
+
+    def handshake(self):
+        headers = {}
+        request_line = self.reader.readline()
+        if not request_line.startswith(b'GET'):
+            raise ValueError('not a websocket handshake')
+        while True:
+            line = self.reader.readline()
+            if not line:
+                raise WebsocketClosed()
+            if line in (b'\r\n', b'\n'):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if 'sec-websocket-key' not in headers:
+            raise ValueError('no websocket key')
+        accept = base64.b64encode(
+            hashlib.sha1((headers['sec-websocket-key'] + WEBSOCKET_GUID).encode()).digest()).decode()
+        self.request.sendall((
+            'HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            'Sec-WebSocket-Accept: {}\r\n\r\n'.format(accept)).encode())
+
+    def read(self, size):
+        data = self.reader.read(size)
+        if len(data) < size:
+            raise WebsocketClosed()
+        return data
+
+    def receive(self):
+        """ Returns the next text message of the client, answering the pings
+        """
+        fragments = []
+        while True:
+            first, second = self.read(2)
+            final, opcode = first & 0x80, first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length, = struct.unpack('>H', self.read(2))
+            elif length == 127:
+                length, = struct.unpack('>Q', self.read(8))
+            if length > MAX_MESSAGE_SIZE:
+                raise WebsocketClosed()
+            mask = self.read(4) if second & 0x80 else None
+            payload = self.read(length)
+            if mask:
+                payload = bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+
+            if opcode == OPCODE_CLOSE:
+                self.send_frame(OPCODE_CLOSE, payload[:2])
+                raise WebsocketClosed()
+            if opcode == OPCODE_PING:
+                self.send_frame(OPCODE_PONG, payload)
+                continue
+            if opcode == OPCODE_PONG:
+                continue
+            fragments.append(payload)
+            if final:
+                return b''.join(fragments).decode('utf-8')
+
+    def send_frame(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('>BB', 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+        with self.send_lock:
+            self.request.sendall(header + payload)
+
+    def send(self, message):
+        self.send_frame(OPCODE_TEXT, json.dumps(message).encode('utf-8'))
+
+    def notice(self, callback, items):
+        self.send({'method': 'notice', 'params': [callback, items]})
+
+
+class NodeServer(socketserver.ThreadingTCPServer):
+    """ BitShares node on localhost, serving an in-memory exchange
+
+        Stands in for a node of the network for the integration and load
+        tests: the clients connect to :attr:`url` with the bitshares library
+        as to any node, call the database API, broadcast transactions and
+        subscribe to blocks, markets and accounts, which are sent their
+        notices as a node does. The calls are answered by a
+        :class:`dexbot.backtest.node.SimulatedNode`, the orders are matched
+        by its :class:`dexbot.backtest.exchange.Exchange`.
+
+        A block is produced every ``block_interval`` seconds, of real time.
+        The markets of the exchange are moved by ``markets``, callables
+        given the exchange at each block, such as :class:`RandomMarket` or
+        :class:`FeedMarket`: they decide how the orders of the clients are
+        matched. Transactions are applied at once, their notices are sent
+        with the next block.
+
+        The transactions aren't checked against the keys of the accounts,
+        for the clients signing them, see
+        :meth:`dexbot.backtest.exchange.Exchange.add_account`.
+
+        :param dexbot.backtest.exchange.Exchange exchange: the chain
+        :param str host: address to listen on
+        :param int port: port to listen on, any free one when 0
+        :param float latency: seconds added before answering each call
+        :param float block_interval: seconds between two blocks, none are
+            produced when 0, see :meth:`produce_block`
+        :param list markets: callables moving the markets at each block
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, exchange, host='127.0.0.1', port=0, latency=0, block_interval=BLOCK_INTERVAL,
+                 markets=None):
+        super().__init__((host, port), Connection)
+        register_chain()
+        self.exchange = exchange
+        self.node = SimulatedNode(exchange)
+        self.latency = latency
+        self.block_interval = block_interval
+        self.markets = list(markets or [])
+        # The exchange is used by the connections and by the block producer
+        self.lock = threading.RLock()
+        self.connections = set()
+        self.connections_lock = threading.Lock()
+        self.running = threading.Event()
+        self.threads = []
+
+    @property
+    def url(self):
+        return 'ws://{}:{}'.format(*self.server_address)
+
+    def start(self):
+        """ Serves the clients and produces the blocks in the background,
+            from a first block giving the markets their prices
+        """
+        self.produce_block()
+        self.running.set()
+        self.threads = [threading.Thread(target=self.serve_forever, name='node-server', daemon=True)]
+        if self.block_interval:
+            self.threads.append(threading.Thread(target=self.produce_blocks, name='node-blocks', daemon=True))
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.running.clear()
+        self.shutdown()
+        with self.connections_lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for thread in self.threads:
+            thread.join()
+        self.server_close()
+
+    def add_connection(self, connection):
+        with self.connections_lock:
+            self.connections.add(connection)
+
+    def remove_connection(self, connection):
+        with self.connections_lock:
+            self.connections.discard(connection)
+
+    def produce_blocks(self):
+        next_block = time.time() + self.block_interval
+        while self.running.is_set():
+            delay = next_block - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            next_block += self.block_interval
+            if not self.running.is_set():
+                break
+            try:
+                self.produce_block()
+            except Exception:
+                log.exception('Producing a block')
+
+    def produce_block(self):
+        """ Produces a block, moves the markets and sends the notices of the
+            block to the subscribed clients
+
+            :return: id of the block
+        """
+        with self.lock:
+            block_id = self.exchange.produce_block(time.time())
+            for market in self.markets:
+                market(self.exchange)
+            notifications, accounts = self.exchange.collect_notifications()
+            statistics = {
+                account_id: self.exchange.get_object(self.exchange.get_object(account_id)['statistics'])
+                for account_id in accounts
+            }
+
+        with self.connections_lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                self.send_notices(connection, block_id, notifications, statistics)
+            except OSError:
+                pass
+        return block_id
+
+    @staticmethod
+    def send_notices(connection, block_id, notifications, statistics):
+        markets = {}
+        for pair, item in notifications:
+            if pair in connection.market_callbacks:
+                markets.setdefault(pair, []).append(item)
+        for pair, items in markets.items():
+            connection.notice(connection.market_callbacks[pair], [items])
+
+        if connection.object_callback is not None:
+            objects = [statistics[account_id] for account_id in statistics if account_id in connection.accounts]
+            if objects:
+                connection.notice(connection.object_callback, [objects])
+
+        if connection.block_callback is not None:
+            connection.notice(connection.block_callback, [block_id])
+
+    def call(self, connection, message):
+        """ Answers a call of a client
+        """
+        try:
+            request = json.loads(message)
+            request_id = request.get('id')
+            _, name, args = request['params']
+        except (ValueError, KeyError, TypeError):
+            return {'id': None, 'jsonrpc': '2.0', 'error': {'message': 'Invalid request'}}
+        try:
+            with self.lock:
+                result = self.dispatch(connection, name, args)
+        except Exception as e:
+            log.debug('Call {} failed: {}'.format(name, e))
+            return {'id': request_id, 'jsonrpc': '2.0', 'error': {'message': str(e)}}
+        return {'id': request_id, 'jsonrpc': '2.0', 'result': result}
+
+    def dispatch(self, connection, name, args):
+        if name == 'login':
+            return True
+        if name in API_IDS:
+            return API_IDS[name]
+        if name == 'set_subscribe_callback':
+            connection.object_callback = args[0]
+            return None
+        if name == 'set_block_applied_callback':
+            connection.block_callback = args[0]
+            return None
+        if name == 'set_pending_transaction_callback':
+            return None
+        if name == 'cancel_all_subscriptions':
+            connection.object_callback = None
+            connection.block_callback = None
+            connection.market_callbacks = {}
+            connection.accounts = set()
+            return None
+        if name == 'subscribe_to_market':
+            callback, asset_a, asset_b = args
+            connection.market_callbacks[frozenset((asset_a, asset_b))] = callback
+            return None
+        if name == 'unsubscribe_from_market':
+            connection.market_callbacks.pop(frozenset(args[:2]), None)
+            return None
+        if name == 'get_full_accounts':
+            result = self.node.get_full_accounts(*args)
+            if len(args) > 1 and args[1]:
+                connection.accounts.update(account['account']['id'] for _, account in result)
+            return result
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.node, name)(*args)
+
+
+class RandomMarket:
+    """ Market moving at random, a callable of the ``markets`` of a
+        :class:`NodeServer`
+
+        At each block the price takes a step of a random walk, the best
+        bid and ask are set around it, of unknown depth, and market trades
+        are made on either side, filling the orders of the clients they
+        reach.
+
+        :param str base: symbol of the base asset
+        :param str quote: symbol of the quote asset
+        :param float price: initial price, in base per quote
+        :param float volatility: standard deviation of the relative steps of
+            the price
+        :param float spread: relative difference between the best ask and bid
+        :param float trade_amount: largest amount of quote of a trade
+        :param float trade_probability: chance of a trade at each block
+        :param int seed: seed of the random generator
+    """
+
+    def __init__(self, base, quote, price, volatility=0.002, spread=0.01, trade_amount=10,
+                 trade_probability=0.5, seed=None):
+        self.base = base
+        self.quote = quote
+        self.price = price
+        self.volatility = volatility
+        self.spread = spread
+        self.trade_amount = trade_amount
+        self.trade_probability = trade_probability
+        self.random = random.Random(seed)
+
+    def __call__(self, exchange):
+        book = exchange.add_market(self.base, self.quote)
+        self.price *= 1 + self.random.gauss(0, self.volatility)
+        bid, ask = self.price * (1 - self.spread / 2), self.price * (1 + self.spread / 2)
+        if self.random.random() < self.trade_probability:
+            # A trade through the spread, as a market order reaching a bit further
+            price = self.random.choice((bid, ask)) * (1 + self.random.uniform(-self.spread, self.spread))
+            exchange.market_trade(book, price, self.random.uniform(0, self.trade_amount))
+        exchange.set_market_book(book, [[bid, None]], [[ask, None]])
+        book.latest = self.price
+
+
+class FeedMarket:
+    """ Market replaying recorded market data, a callable of the ``markets``
+        of a :class:`NodeServer`
+
+        Plays at each block the events of the next ``interval`` seconds of
+        the feed, so the recorded day runs as fast as the blocks are
+        produced. Once at the end of the feed, the market stays as it is.
+
+        :param dexbot.backtest.feed.Feed feed: the market data
+        :param int interval: seconds of the feed played at each block
+    """
+
+    def __init__(self, feed, interval=BLOCK_INTERVAL):
+        self.feed = feed
+        self.blocks = feed.blocks(interval)
+
+    def __call__(self, exchange):
+        book = exchange.add_market(self.feed.base, self.feed.quote)
+        for event in next(self.blocks, (None, []))[1]:
+            apply_event(exchange, book, event)
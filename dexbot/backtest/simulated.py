@@ -0,0 +1,52 @@
+from bitshares import BitShares
+from bitshares.transactionbuilder import TransactionBuilder
+from bitsharesbase.objects import Operation
+
+
+class SimulatedTransactionBuilder(TransactionBuilder):
+    """ Transaction builder sending the operations to a
+        :class:`dexbot.backtest.node.SimulatedNode`, unsigned
+    """
+
+    def appendSigner(self, account, permission):
+        if account not in self.signing_accounts:
+            self.signing_accounts.append(account)
+
+    def sign(self):
+        pass
+
+    def json(self):
+        return {'operations': [Operation(op).json() for op in self.ops]}
+
+    def broadcast(self):
+        if not self.ops:
+            return
+        ret = self.json()
+        if self.blockchain.blocking:
+            ret = self.blockchain.rpc.broadcast_transaction_synchronous(ret)
+            ret.update(**ret['trx'])
+        else:
+            self.blockchain.rpc.broadcast_transaction(ret)
+        self.clear()
+        return ret
+
+
+class SimulatedBitShares(BitShares):
+    """ BitShares instance talking to a simulated node, with an empty
+        wallet since the simulated node takes the transactions unsigned
+
+        :param dexbot.backtest.node.SimulatedNode node: the node
+    """
+
+    def __init__(self, node, **kwargs):
+        self.node = node
+        kwargs.setdefault('keys', [])
+        super().__init__(node='backtest', **kwargs)
+
+    def connect(self, node='', rpcuser='', rpcpassword='', **kwargs):
+        self.rpc = self.node
+
+    def new_tx(self, *args, **kwargs):
+        builder = SimulatedTransactionBuilder(*args, blockchain_instance=self, **kwargs)
+        self._txbuffers.append(builder)
+        return builder
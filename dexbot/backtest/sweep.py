@@ -0,0 +1,286 @@
+import copy
+import importlib
+import itertools
+import logging
+import multiprocessing
+import re
+import shutil
+import tempfile
+
+from .engine import Backtest
+from .exchange import BLOCK_INTERVAL
+from .feed import Feed
+
+log = logging.getLogger(__name__)
+
+# Most backtests a sweep runs, against grids made too large by mistake
+MAX_JOBS = 10000
+
+# Digits the values of a range are rounded to, against the float steps adding up errors
+RANGE_DIGITS = 10
+
+# Key of the results ranking the parameter sets by default
+DEFAULT_SORT = 'profit_percent'
+
+# Feed of the backtests of a pool process, see load_shared_feed
+shared_feed = None
+
+
+class SweepError(Exception):
+    pass
+
+
+def parse_value(element, text):
+    """ Converts the text of a value to the type of a config element, and
+        checks it against the limits of the element
+    """
+    text = text.strip()
+    if element.type in ('int', 'float'):
+        try:
+            value = int(text) if element.type == 'int' else float(text)
+        except ValueError:
+            raise SweepError('{}: {} is not a valid {}'.format(element.key, text, element.type))
+        if element.extra:
+            if element.extra[0] is not None and value < element.extra[0]:
+                raise SweepError('{}: {} is below {}'.format(element.key, text, element.extra[0]))
+            if element.extra[1] and value > element.extra[1]:
+                raise SweepError('{}: {} is above {}'.format(element.key, text, element.extra[1]))
+        return value
+    if element.type == 'bool':
+        if text.lower() in ('1', 'true', 'yes', 'on'):
+            return True
+        if text.lower() in ('0', 'false', 'no', 'off'):
+            return False
+        raise SweepError('{}: {} is not a boolean'.format(element.key, text))
+    if element.type == 'choice':
+        tags = [tag for tag, _ in element.extra]
+        if text not in tags:
+            raise SweepError('{}: {} is not one of {}'.format(element.key, text, ', '.join(tags)))
+        return text
+    if element.extra and not re.match(element.extra, text):
+        raise SweepError('{}: {} is not valid'.format(element.key, text))
+    return text
+
+
+def parse_range(element, text):
+    """ Returns the values of a parameter to sweep
+
+        :param ConfigElement element: the config element of the parameter
+        :param str text: ``start:stop:step``, stop included, for numbers,
+            a list of values separated by commas, or a single value
+        :return: list of values, typed as the config element
+    """
+    if text.count(':') == 2 and element.type in ('int', 'float'):
+        start, stop, step = (parse_number(element, part) for part in text.split(':'))
+        if step <= 0:
+            raise SweepError('{}: the step of {} must be positive'.format(element.key, text))
+        if stop < start:
+            raise SweepError('{}: {} ends before it starts'.format(element.key, text))
+        count = int(round((stop - start) / step, RANGE_DIGITS)) + 1
+        return [parse_value(element, repr(round(start + index * step, RANGE_DIGITS)))
+                for index in range(count)]
+    return [parse_value(element, value) for value in text.split(',') if value.strip()]
+
+
+def parse_number(element, text):
+    try:
+        return int(text) if element.type == 'int' else float(text)
+    except ValueError:
+        raise SweepError('{}: {} is not a valid {}'.format(element.key, text, element.type))
+
+
+def parameter_grid(elements, ranges):
+    """ Returns every combination of the values of the parameters to sweep
+
+        :param list elements: ConfigElements of the strategy, see
+            :meth:`dexbot.basestrategy.BaseStrategy.configure`
+        :param dict ranges: text of the values of each parameter, see
+            :func:`parse_range`
+        :return: list of dicts of the parameters
+    """
+    by_key = {element.key: element for element in elements}
+    keys = sorted(ranges)
+    values = []
+    for key in keys:
+        if key not in by_key:
+            raise SweepError('The strategy has no setting {}'.format(key))
+        if key in ('account', 'market', 'module'):
+            raise SweepError('{} cannot be swept'.format(key))
+        values.append(parse_range(by_key[key], ranges[key]))
+        if not values[-1]:
+            raise SweepError('{}: no values'.format(key))
+
+    count = 1
+    for item in values:
+        count *= len(item)
+    if count > MAX_JOBS:
+        raise SweepError('{} parameter sets, more than the {} a sweep runs'.format(count, MAX_JOBS))
+    return [dict(zip(keys, combination)) for combination in itertools.product(*values)]
+
+
+def load_shared_feed(directory):
+    """ Initializer of the pool processes, maps the feed written by the sweep
+    """
+    global shared_feed
+    shared_feed = Feed.load_arrays(directory)
+
+
+def run_job(job):
+    """ Runs the backtest of one parameter set, in a pool process
+
+        :param tuple job: config, worker name, balances, fees, interval and
+            parameters of the backtest
+        :return: dict of the parameters, and of the results or of the error
+    """
+    config, worker_name, balances, fees, interval, params = job
+    config = copy.deepcopy(config)
+    config['workers'][worker_name].update(params)
+    try:
+        result = Backtest(config, worker_name, shared_feed, balances, fees=fees, interval=interval).run()
+    except Exception as e:
+        log.debug('Backtest of {} failed'.format(params), exc_info=True)
+        return {'params': params, 'result': None, 'error': '{}: {}'.format(type(e).__name__, e)}
+    return {'params': params, 'result': result, 'error': None}
+
+
+class Sweep:
+    """ Backtests a worker with every combination of a set of parameters
+
+        The backtests run in a pool of processes. The feed is loaded once:
+        its events are written as numpy arrays to a temporary directory,
+        which every process of the pool maps read-only, so that all of them
+        share the same pages of memory instead of each holding a copy.
+
+        :param dict config: the config, with the worker in it
+        :param str worker_name: name of the worker to backtest
+        :param dexbot.backtest.feed.Feed feed: market data of the worker's market
+        :param dict balances: initial balances of the worker's account, by
+            asset symbol
+        :param dict ranges: values of each parameter to sweep, by key of
+            the worker's config, see :func:`parse_range`
+        :param int processes: processes of the pool, one per CPU when None,
+            1 runs the backtests in this process
+        :param dict fees: operation fees, see :class:`dexbot.backtest.engine.Backtest`
+        :param int interval: seconds between two blocks
+    """
+
+    def __init__(self, config, worker_name, feed, balances, ranges, processes=None, fees=None,
+                 interval=BLOCK_INTERVAL):
+        worker_config = config.get('workers', {}).get(worker_name)
+        if worker_config is None:
+            raise SweepError('No worker named {} in the config'.format(worker_name))
+        strategy_class = getattr(importlib.import_module(worker_config['module']), 'Strategy')
+        self.grid = parameter_grid(strategy_class.configure(), ranges)
+        self.config = config
+        self.worker_name = worker_name
+        self.feed = feed
+        self.balances = balances
+        self.processes = processes or multiprocessing.cpu_count()
+        self.fees = fees
+        self.interval = interval
+
+    def jobs(self):
+        for params in self.grid:
+            yield self.config, self.worker_name, self.balances, self.fees, self.interval, params
+
+    def run(self, sort=DEFAULT_SORT, progress=None):
+        """ Runs the backtests
+
+            :param str sort: key of the results to rank the parameter sets by,
+                best first
+            :param progress: callable getting the number of backtests done
+                and to do after each one
+            :return: list of the outcomes of :func:`run_job`, ranked
+        """
+        outcomes = []
+        if self.processes == 1 or len(self.grid) == 1:
+            global shared_feed
+            previous_feed, shared_feed = shared_feed, self.feed
+            try:
+                for job in self.jobs():
+                    outcomes.append(run_job(job))
+                    if progress:
+                        progress(len(outcomes), len(self.grid))
+            finally:
+                shared_feed = previous_feed
+            return rank(outcomes, sort)
+
+        directory = tempfile.mkdtemp(prefix='dexbot-sweep-')
+        try:
+            self.feed.save_arrays(directory)
+            # Spawned as the shards are, the workers don't inherit threads
+            context = multiprocessing.get_context('spawn')
+            pool = context.Pool(min(self.processes, len(self.grid)), load_shared_feed, (directory,))
+            try:
+                for outcome in pool.imap_unordered(run_job, self.jobs()):
+                    outcomes.append(outcome)
+                    if progress:
+                        progress(len(outcomes), len(self.grid))
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        return rank(outcomes, sort)
+
+
+def rank(outcomes, sort=DEFAULT_SORT):
+    """ Sorts the outcomes of a sweep by a key of their results, best first,
+        the failed backtests last
+    """
+    for outcome in outcomes:
+        if outcome['result'] is not None and not isinstance(outcome['result'].get(sort), (int, float)):
+            raise SweepError('No numeric result named {}'.format(sort))
+
+    def key(outcome):
+        if outcome['result'] is None:
+            return 1, 0
+        return 0, -outcome['result'][sort]
+
+    return sorted(outcomes, key=key)
+
+
+def format_table(outcomes, top=None):
+    """ Returns the ranked outcomes of a sweep as a table
+    """
+    if top:
+        outcomes = outcomes[:top]
+    if not outcomes:
+        return ''
+    keys = sorted(outcomes[0]['params'])
+    header = ['#'] + keys + ['profit %', 'end value', 'vs hold %', 'fills', 'orders', 'fees']
+    rows = []
+    for number, outcome in enumerate(outcomes, 1):
+        row = [str(number)] + [format_param(outcome['params'][key]) for key in keys]
+        result = outcome['result']
+        if result is None:
+            row.append(outcome['error'])
+        else:
+            vs_hold = (result['end_value'] / result['hold_value'] - 1) * 100 if result['hold_value'] else 0
+            row += [
+                '{:+.2f}'.format(result['profit_percent']),
+                '{:.8g}'.format(result['end_value']),
+                '{:+.2f}'.format(vs_hold),
+                str(result['fills']),
+                str(result['orders_created']),
+                '{:.8g}'.format(result['operation_fees'])
+            ]
+        rows.append(row)
+
+    # The errors take the place of the results, unaligned
+    widths = [max(len(row[index]) for row in [header] + rows if len(row) == len(header))
+              for index in range(len(header))]
+    lines = []
+    for row in [header] + rows:
+        if len(row) < len(header):
+            cells = [cell.rjust(width) for cell, width in zip(row[:-1], widths)] + [row[-1]]
+        else:
+            cells = [cell.rjust(width) for cell, width in zip(row, widths)]
+        lines.append('  '.join(cells))
+    return '\n'.join(lines)
+
+
+def format_param(value):
+    if isinstance(value, float):
+        return '{:.8g}'.format(value)
+    return str(value)
@@ -1,9 +1,11 @@
+import copy
 import datetime
 import logging
 import collections
 import time
 import math
 
+from .assets import asset_registry
 from .storage import Storage
 from .statemachine import StateMachine
 from .config import Config
@@ -13,13 +15,13 @@ import bitsharesapi
 import bitsharesapi.exceptions
 import bitshares.exceptions
 from bitshares.amount import Amount
+from bitshares.asset import Asset
 from bitshares.market import Market
 from bitshares.account import Account
 from bitshares.price import FilledOrder, Order, UpdateCallOrder
 from bitshares.instance import shared_bitshares_instance
 from .storage import Storage
 from .statemachine import StateMachine
-from . import graph
 
 
 ConfigElement = collections.namedtuple('ConfigElement', 'key type default description extra')
@@ -41,6 +43,14 @@ ConfigElement = collections.namedtuple('ConfigElement', 'key type default descri
 
 MAX_TRIES = 3
 
+# Relative difference under which a live order is considered the same as a
+# desired one, covers the rounding of the amounts to the asset precision
+ORDER_TOLERANCE = 0.001
+
+# Maximum number of operations bundled in a transaction, keeps the
+# transactions well below the maximum transaction size of the chain
+MAX_TRANSACTION_OPERATIONS = 50
+
 
 class BaseStrategy(Storage, StateMachine, Events):
     """ Base Strategy and methods available in all Sub Classes that
@@ -61,6 +71,8 @@ class BaseStrategy(Storage, StateMachine, Events):
          * ``basestrategy.account``: The Account object of this worker
          * ``basestrategy.market``: The market used by this worker
          * ``basestrategy.orders``: List of open orders of the worker's account in the worker's market
+         * ``basestrategy.ticker()``: Ticker of the worker's market, shared with other workers per block
+         * ``basestrategy.orderbook()``: Order book of the worker's market, shared with other workers per block
          * ``basestrategy.balance``: List of assets and amounts available in the worker's account
          * ``basestrategy.log``: a per-worker logger (actually LoggerAdapter) adds worker-specific context:
             worker name & account (Because some UIs might want to display per-worker logs)
@@ -81,6 +93,7 @@ class BaseStrategy(Storage, StateMachine, Events):
     __events__ = [
         'ontick',
         'onMarketUpdate',
+        'onMarketUpdateBatch',
         'onAccount',
         'error_ontick',
         'error_onMarketUpdate',
@@ -90,6 +103,9 @@ class BaseStrategy(Storage, StateMachine, Events):
         'onUpdateCallOrder',
     ]
 
+    # Deliver the market updates once per block, see onMarketUpdateBatch
+    coalesce_market_updates = False
+
     @classmethod
     def configure(cls):
         """
@@ -120,14 +136,29 @@ class BaseStrategy(Storage, StateMachine, Events):
         onUpdateCallOrder=None,
         ontick=None,
         bitshares_instance=None,
+        market_cache=None,
+        order_state=None,
+        account=None,
+        market=None,
+        clock=None,
         *args,
         **kwargs
     ):
         # BitShares instance
         self.bitshares = bitshares_instance or shared_bitshares_instance()
 
-        # Storage
+        # Market data cache shared between the workers, see dexbot.market_cache
+        self.market_cache = market_cache
+
+        # Open orders of the account shared between its workers, see dexbot.order_state
+        self.order_state = order_state
+
+        # Source of the current time, the simulated one in backtests
+        self.clock = clock or datetime.datetime.now
+
+        # Storage, with the worker's keys loaded into memory at once
         Storage.__init__(self, name)
+        self.load()
 
         # Statemachine
         StateMachine.__init__(self, name)
@@ -150,6 +181,7 @@ class BaseStrategy(Storage, StateMachine, Events):
 
         # Redirect this event to also call order placed and order matched
         self.onMarketUpdate += self._callbackPlaceFillOrders
+        self.onMarketUpdateBatch += self._callbackMarketUpdateBatch
 
         if config:
             self.config = config
@@ -157,15 +189,35 @@ class BaseStrategy(Storage, StateMachine, Events):
             self.config = config = Config.get_worker_config_file(name)
 
         self.worker = config["workers"][name]
-        self._account = Account(
-            self.worker["account"],
-            full=True,
-            bitshares_instance=self.bitshares
-        )
-        self._market = Market(
-            config["workers"][name]["market"],
-            bitshares_instance=self.bitshares
-        )
+
+        # The account and market may be fetched beforehand, see
+        # WorkerInfrastructure.prefetch, the worker gets copies of its own
+        if account is not None:
+            self._account = Account(copy.deepcopy(dict(account)), full=True, bitshares_instance=self.bitshares)
+        else:
+            self._account = Account(
+                self.worker["account"],
+                full=True,
+                bitshares_instance=self.bitshares
+            )
+        if market is not None:
+            self._market = Market(
+                base=Asset(copy.deepcopy(dict(market['base'])), bitshares_instance=self.bitshares),
+                quote=Asset(copy.deepcopy(dict(market['quote'])), bitshares_instance=self.bitshares),
+                bitshares_instance=self.bitshares
+            )
+        else:
+            self._market = Market(
+                config["workers"][name]["market"],
+                bitshares_instance=self.bitshares
+            )
+
+        # Descriptors of the assets of the market, see dexbot.assets
+        self.base_asset = asset_registry.get(self._market['base'], self.bitshares)
+        self.quote_asset = asset_registry.get(self._market['quote'], self.bitshares)
+
+        # Markets converting other assets to the base asset, by asset symbol
+        self.conversion_markets = {}
 
         # Recheck flag - Tell the strategy to check for updated orders
         self.recheck_orders = False
@@ -173,6 +225,10 @@ class BaseStrategy(Storage, StateMachine, Events):
         # Settings for bitshares instance
         self.bitshares.bundle = bool(self.worker.get("bundle", False))
 
+        # The worker config may turn the coalescing of market updates on or off
+        self.coalesce_market_updates = bool(
+            self.worker.get("coalesce_market_updates", self.coalesce_market_updates))
+
         # Disabled flag - this flag can be flipped to True by a worker and
         # will be reset to False after reset only
         self.disabled = False
@@ -190,8 +246,14 @@ class BaseStrategy(Storage, StateMachine, Events):
             logging.getLogger('dexbot.orders_log'), {}
         )
 
+    def now(self):
+        """ Returns the current time as a datetime, strategies throttling
+            their work should use it rather than ``datetime.now()``
+        """
+        return self.clock()
+
     def _calculate_center_price(self, suppress_errors=False):
-        ticker = self.market.ticker()
+        ticker = self.ticker()
         highest_bid = ticker.get("highestBid")
         lowest_ask = ticker.get("lowestAsk")
         if not float(highest_bid):
@@ -258,8 +320,28 @@ class BaseStrategy(Storage, StateMachine, Events):
     def orders(self):
         """ Return the worker's open accounts in the current market
         """
+        orders = [Order(o, bitshares_instance=self.bitshares) for o in self.get_limit_orders()]
+        return [o for o in orders if self.worker["market"] == o.market]
+
+    def get_limit_orders(self):
+        """ Returns the account's open orders as raw limit order objects
+
+            Read from the order state mirror when the worker runs inside
+            :class:`dexbot.worker.WorkerInfrastructure`, otherwise from a
+            fresh copy of the account
+        """
+        if self.order_state:
+            return self.order_state.limit_orders()
         self.account.refresh()
-        return [o for o in self.account.openorders if self.worker["market"] == o.market and self.account.openorders]
+        self.account.ensure_full()
+        return self.account['limit_orders']
+
+    def orders_changed(self):
+        """ Called after broadcasting operations that may have placed or
+            canceled orders of the account
+        """
+        if self.order_state:
+            self.order_state.expect_operations()
 
     @staticmethod
     def get_order(order_id, return_none=True):
@@ -279,6 +361,12 @@ class BaseStrategy(Storage, StateMachine, Events):
             return None
         return order
 
+    def get_open_order_ids(self):
+        """ Returns the set of the ids of the account's open orders, fetched
+            in a single call whatever their number
+        """
+        return {order['id'] for order in self.get_limit_orders()}
+
     def get_updated_order(self, order):
         """ Tries to get the updated order from the API
             returns None if the order doesn't exist
@@ -298,10 +386,10 @@ class BaseStrategy(Storage, StateMachine, Events):
         Returns updated open Orders.
         account.openorders doesn't return updated values for the order so we calculate the values manually
         """
-        self.account.refresh()
-        self.account.ensure_full()
-
-        limit_orders = self.account['limit_orders'][:]
+        limit_orders = self.get_limit_orders()
+        if not self.order_state:
+            # Don't alter the orders held by the account object
+            limit_orders = copy.deepcopy(limit_orders)
         for o in limit_orders:
             base_amount = float(o['for_sale'])
             price = float(o['sell_price']['base']['amount']) / float(o['sell_price']['quote']['amount'])
@@ -322,6 +410,26 @@ class BaseStrategy(Storage, StateMachine, Events):
         """
         return self._market
 
+    def ticker(self):
+        """ Return the ticker of the worker's market
+
+            Served from the shared market cache when the worker runs inside
+            :class:`dexbot.worker.WorkerInfrastructure`
+        """
+        if self.market_cache:
+            return self.market_cache.ticker(self.market)
+        return self.market.ticker()
+
+    def orderbook(self, limit=25):
+        """ Return the order book of the worker's market
+
+            Served from the shared market cache when the worker runs inside
+            :class:`dexbot.worker.WorkerInfrastructure`
+        """
+        if self.market_cache:
+            return self.market_cache.orderbook(self.market, limit)
+        return self.market.orderbook(limit=limit)
+
     @property
     def account(self):
         """ Return the full account as :class:`bitshares.account.Account` object!
@@ -339,15 +447,16 @@ class BaseStrategy(Storage, StateMachine, Events):
         """
         Returns asset amount converted to base asset amount
         """
-        base_asset = self.market['base']
-        quote_asset = Asset(asset['symbol'], bitshares_instance=self.bitshares)
-        if base_asset['symbol'] == quote_asset['symbol']:
+        symbol = asset['symbol']
+        if symbol == self.base_asset.symbol:
             return asset['amount']
         else:
-            market = Market(
-                base=base_asset,
-                quote=quote_asset,
-                bitshares_instance=self.bitshares)
+            market = self.conversion_markets.get(symbol)
+            if market is None:
+                market = self.conversion_markets[symbol] = Market(
+                    base=self.market['base'],
+                    quote=Asset(symbol, bitshares_instance=self.bitshares),
+                    bitshares_instance=self.bitshares)
             return market.ticker()['latest']['price'] * asset['amount']
 
     @property
@@ -373,17 +482,31 @@ class BaseStrategy(Storage, StateMachine, Events):
         else:
             pass
 
+    def _callbackMarketUpdateBatch(self, updates):
+        """ Passes a block's worth of market updates on as a single
+            onMarketUpdate call for the last one, while order placed and
+            order matched are still called for each of them
+        """
+        for d in updates[:-1]:
+            self._callbackPlaceFillOrders(d)
+        if updates:
+            self.onMarketUpdate(updates[-1])
+
     def execute(self):
         """ Execute a bundle of operations
         """
         self.bitshares.blocking = "head"
-        r = self.bitshares.txbuffer.broadcast()
-        self.bitshares.blocking = False
+        try:
+            r = self.bitshares.txbuffer.broadcast()
+        finally:
+            self.bitshares.blocking = False
+            self.orders_changed()
         return r
 
     def _cancel(self, orders):
         try:
             self.retry_action(self.bitshares.cancel, orders, account=self.account)
+            self.orders_changed()
         except bitsharesapi.exceptions.UnhandledRPCError as e:
             if str(e) == 'Assert Exception: maybe_found != nullptr: Unable to find Object':
                 # The order(s) we tried to cancel doesn't exist
@@ -426,8 +549,8 @@ class BaseStrategy(Storage, StateMachine, Events):
         self.clear_orders()
 
     def market_buy(self, amount, price, return_none=False, *args, **kwargs):
-        symbol = self.market['base']['symbol']
-        precision = self.market['base']['precision']
+        symbol = self.base_asset.symbol
+        precision = self.base_asset.precision
         base_amount = self.truncate(price * amount, precision)
 
         # Make sure we have enough balance for the order
@@ -454,6 +577,7 @@ class BaseStrategy(Storage, StateMachine, Events):
             *args,
             **kwargs
         )
+        self.orders_changed()
         buy_order = self.get_order(buy_transaction['orderid'], return_none=return_none)
         if buy_order and buy_order['deleted']:
             # The API doesn't return data on orders that don't exist
@@ -464,8 +588,8 @@ class BaseStrategy(Storage, StateMachine, Events):
         return buy_order
 
     def market_sell(self, amount, price, return_none=False, *args, **kwargs):
-        symbol = self.market['quote']['symbol']
-        precision = self.market['quote']['precision']
+        symbol = self.quote_asset.symbol
+        precision = self.quote_asset.precision
         quote_amount = self.truncate(amount, precision)
 
         # Make sure we have enough balance for the order
@@ -492,6 +616,7 @@ class BaseStrategy(Storage, StateMachine, Events):
             *args,
             **kwargs
         )
+        self.orders_changed()
         sell_order = self.get_order(sell_transaction['orderid'], return_none=return_none)
         if sell_order and sell_order['deleted']:
             # The API doesn't return data on orders that don't exist
@@ -502,17 +627,209 @@ class BaseStrategy(Storage, StateMachine, Events):
 
         return sell_order
 
+    def get_order_terms(self, order):
+        """ Returns the side, quote amount and price of an order in the
+            worker's market, as taken by :func:`market_buy` and :func:`market_sell`
+
+            :param order: Order object of a live order
+            :return: tuple ('buy' or 'sell', amount, price)
+        """
+        if order['base']['asset']['id'] == self.base_asset.id:
+            side = 'buy'
+            base_amount = order['base']['amount']
+            quote_amount = order['quote']['amount']
+        else:
+            side = 'sell'
+            base_amount = order['quote']['amount']
+            quote_amount = order['base']['amount']
+        price = base_amount / quote_amount if quote_amount else 0
+        return side, quote_amount, price
+
+    @staticmethod
+    def is_close(a, b):
+        return abs(a - b) <= ORDER_TOLERANCE * max(abs(a), abs(b))
+
+    def reconcile_orders(self, desired, orders=None):
+        """ Brings the worker's orders in the market to the desired set
+
+            Live orders matching a desired order are kept, the others are
+            canceled and the desired orders left over are placed, all of it
+            in a single transaction.
+
+            :param list desired: ('buy' or 'sell', amount, price) tuples,
+                amounts are in the quote asset, as for :func:`market_buy`
+            :param list orders: live orders, defaults to :attr:`updated_open_orders`
+            :return: tuple of the kept and of the placed orders
+        """
+        if orders is None:
+            orders = self.updated_open_orders
+
+        kept = []
+        cancel = []
+        place = list(desired)
+        for order in orders:
+            side, amount, price = self.get_order_terms(order)
+            for terms in place:
+                if side == terms[0] and self.is_close(amount, terms[1]) and self.is_close(price, terms[2]):
+                    kept.append(order)
+                    place.remove(terms)
+                    break
+            else:
+                cancel.append(order)
+
+        if cancel or place:
+            self.log.info('Keeping {} order(s), canceling {} and placing {}'.format(
+                len(kept), len(cancel), len(place)))
+            placed = self.broadcast_orders(place, cancel)
+        else:
+            placed = []
+        return kept, placed
+
+    def bulk_place_orders(self, place, batch_size=MAX_TRANSACTION_OPERATIONS, **kwargs):
+        """ Places many orders in as few transactions as possible, and saves
+            the orders of each transaction to the database in a single write
+            as soon as it is broadcast, so that a failing transaction leaves
+            none of the orders placed before it untracked
+
+            :param list place: ('buy' or 'sell', amount, price) tuples of
+                the orders to place, amounts are in the quote asset
+            :param int batch_size: maximum number of orders per transaction
+            :param kwargs: passed on to :func:`bitshares.market.Market.buy`
+                and :func:`bitshares.market.Market.sell`, e.g. ``expiration``
+            :return: list of the placed orders, the ones filled at once are
+                marked as deleted
+        """
+        orders = []
+        for i in range(0, len(place), batch_size):
+            placed = self.broadcast_orders(place[i:i + batch_size], **kwargs)
+            if placed:
+                self.save_orders(placed)
+            orders += placed
+        return orders
+
+    def broadcast_orders(self, place, cancel=None, **kwargs):
+        """ Cancels and places orders in a single transaction
+
+            Orders the account can't afford, counting in the funds of the
+            canceled orders, are left out and the worker is disabled.
+
+            :param list place: ('buy' or 'sell', amount, price) tuples of
+                the orders to place
+            :param list cancel: orders to cancel
+            :return: list of the placed orders, the ones filled at once are
+                marked as deleted
+        """
+        cancel_orders = cancel or []
+        cancel = [order['id'] for order in cancel_orders if 'id' in order]
+        place = self._affordable_orders(place, cancel_orders)
+        if not place and not cancel:
+            return []
+
+        try:
+            order_ids = self.retry_action(self._broadcast_orders, place, cancel, **kwargs)
+        except bitsharesapi.exceptions.UnhandledRPCError as e:
+            if str(e) != 'Assert Exception: maybe_found != nullptr: Unable to find Object':
+                raise
+            # One of the orders is gone already, cancel the rest on their own
+            self.cancel([{'id': order_id} for order_id in cancel])
+            if not place:
+                return []
+            order_ids = self.retry_action(self._broadcast_orders, place, [], **kwargs)
+
+        return self._placed_orders(order_ids, place)
+
+    def _affordable_orders(self, place, cancel_orders):
+        available = {
+            self.quote_asset.id: float(self.balance(self.quote_asset.symbol)),
+            self.base_asset.id: float(self.balance(self.base_asset.symbol))
+        }
+        for order in cancel_orders:
+            # Funds of the canceled orders are released before the new ones are placed
+            if order.get('base') and order['base']['asset']['id'] in available:
+                available[order['base']['asset']['id']] += order['base']['amount']
+
+        affordable = []
+        for side, amount, price in place:
+            if side == 'buy':
+                asset = self.base_asset
+                needed = self.truncate(price * amount, asset.precision)
+            else:
+                asset = self.quote_asset
+                needed = self.truncate(amount, asset.precision)
+
+            if available[asset.id] < needed:
+                self.log.critical(
+                    "Insufficient {} balance, needed {} {}".format(side, needed, asset.symbol)
+                )
+                self.disabled = True
+                continue
+
+            available[asset.id] -= needed
+            affordable.append((side, amount, price))
+            self.log.info(
+                'Placing a {} order for {} {} @ {}'.format(side, needed, asset.symbol, round(price, 8))
+            )
+        return affordable
+
+    def _broadcast_orders(self, place, cancel, **kwargs):
+        """ Bundles the operations in the txbuffer and broadcasts them,
+            returns the ids of the placed orders
+        """
+        bundle = self.bitshares.bundle
+        self.bitshares.bundle = True
+        try:
+            offset = len(self.bitshares.txbuffer.ops)
+            if cancel:
+                self.bitshares.cancel(cancel, account=self.account)
+            for side, amount, price in place:
+                action = self.market.buy if side == 'buy' else self.market.sell
+                action(price, Amount(amount=amount, asset=self.market['quote']), account=self.account.name, **kwargs)
+            result = self.execute()
+        except Exception:
+            self.bitshares.txbuffer.clear()
+            raise
+        finally:
+            self.bitshares.bundle = bundle
+
+        return [op_result[1] for op_result in result['operation_results'][offset + len(cancel):]]
+
+    def _placed_orders(self, order_ids, place):
+        """ Fetches the placed orders in one call
+        """
+        orders = []
+        objects = self.bitshares.rpc.get_objects(order_ids)
+        for order_id, data, (side, amount, price) in zip(order_ids, objects, place):
+            if data:
+                order = Order(data, bitshares_instance=self.bitshares)
+                order['deleted'] = False
+                orders.append(order)
+                continue
+
+            # The API doesn't return data on orders that don't exist
+            # We need to calculate the data on our own
+            quote = Amount(amount, self.market['quote'])
+            base = Amount(amount * price, self.market['base'])
+            if side == 'buy':
+                order = Order(quote, base)
+            else:
+                order = Order(base, quote)
+            order['id'] = order_id
+            order['deleted'] = True
+            orders.append(order)
+            self.recheck_orders = True
+        return orders
+
     def record_balances(self, baseprice):
         self.save_journal([('price', baseprice),
-                           (self.market['quote']['symbol'],
-                            self.balance(self.market['quote'])),
-                           (self.market['base']['symbol'], self.balance(self.market['base']))])
+                           (self.quote_asset.symbol,
+                            self.balance(self.quote_asset.symbol)),
+                           (self.base_asset.symbol, self.balance(self.base_asset.symbol))])
 
     def calculate_order_data(self, order, amount, price):
-        quote_asset = Amount(amount, self.market['quote']['symbol'])
+        quote_asset = Amount(amount, self.market['quote'])
         order['quote'] = quote_asset
         order['price'] = price
-        base_asset = Amount(amount * price, self.market['base']['symbol'])
+        base_asset = Amount(amount * price, self.market['base'])
         order['base'] = base_asset
         return order
 
@@ -529,13 +846,16 @@ class BaseStrategy(Storage, StateMachine, Events):
         More complex workers (arbitrage, etc) may need to override to provide
         meaningful graphs
         """
+        # Imported on first use, matplotlib takes long to load
+        from . import graph
+
         data = graph.query_to_dicts(self.query_journal(start, end_))
         if len(data) < 2:
             # not enough data to graph
             return None
         data = graph.rebase_data(data,
-                                 self.market['quote']['symbol'],
-                                 self.market['base']['symbol'])
+                                 self.quote_asset.symbol,
+                                 self.base_asset.symbol)
         return graph.do_graph(data)
 
     @staticmethod
@@ -560,8 +880,8 @@ class BaseStrategy(Storage, StateMachine, Events):
         """
         quote = 0
         base = 0
-        quote_asset = self.market['quote']['id']
-        base_asset = self.market['base']['id']
+        quote_asset = self.quote_asset.id
+        base_asset = self.base_asset.id
 
         for balance in self.balances:
             if balance.asset['id'] == quote_asset:
@@ -587,8 +907,8 @@ class BaseStrategy(Storage, StateMachine, Events):
 
         quote = 0
         base = 0
-        quote_asset = self.market['quote']['id']
-        base_asset = self.market['base']['id']
+        quote_asset = self.quote_asset.id
+        base_asset = self.base_asset.id
 
         for order_id in order_ids:
             order = self.get_updated_order(order_id)
@@ -646,7 +966,7 @@ class BaseStrategy(Storage, StateMachine, Events):
     def write_order_log(self, worker_name, order):
         operation_type = 'TRADE'
 
-        if order['base']['symbol'] == self.market['base']['symbol']:
+        if order['base']['symbol'] == self.base_asset.symbol:
             base_symbol = order['base']['symbol']
             base_amount = -order['base']['amount']
             quote_symbol = order['quote']['symbol']
@@ -5,6 +5,7 @@ import os.path
 import signal
 import sys
 
+from ruamel import yaml
 from dexbot.config import Config, DEFAULT_CONFIG_FILE
 from dexbot.helper import initialize_orders_log
 from dexbot.ui import (
@@ -14,6 +15,8 @@ from dexbot.ui import (
     configfile
 )
 from .worker import WorkerInfrastructure
+from .async_worker import AsyncWorkerInfrastructure
+from .shards import ShardSupervisor
 from .cli_conf import configure_dexbot, dexbot_service_running
 from . import errors
 from . import helper
@@ -66,19 +69,40 @@ def main(ctx, **kwargs):
 
 
 @main.command()
+@click.option(
+    '--asyncio',
+    'use_asyncio',
+    is_flag=True,
+    default=False,
+    help='Handle the events of the workers on an asyncio event loop')
+@click.option(
+    '--shards',
+    type=int,
+    default=1,
+    help='Number of processes to run the workers in, workers of an account share a process')
 @click.pass_context
 @configfile
 @chain
 @unlock
 @verbose
-def run(ctx):
+def run(ctx, use_asyncio, shards):
     """ Continuously run the worker
     """
     if ctx.obj['pidfile']:
         with open(ctx.obj['pidfile'], 'w') as fd:
             fd.write(str(os.getpid()))
+    if shards > 1:
+        try:
+            run_shards(ctx, shards, use_asyncio)
+        finally:
+            if ctx.obj['pidfile']:
+                helper.remove(ctx.obj['pidfile'])
+        return
     try:
-        worker = WorkerInfrastructure(ctx.config)
+        if use_asyncio:
+            worker = AsyncWorkerInfrastructure(ctx.config)
+        else:
+            worker = WorkerInfrastructure(ctx.config)
         # Set up signalling. do it here as of no relevance to GUI
         kill_workers = worker_job(worker, lambda: worker.stop(pause=True))
         # These first two UNIX & Windows
@@ -87,9 +111,8 @@ def run(ctx):
         try:
             # These signals are UNIX-only territory, will ValueError here on Windows
             signal.signal(signal.SIGHUP, kill_workers)
-            # TODO: reload config on SIGUSR1
-            # signal.signal(signal.SIGUSR1, lambda x, y: worker.do_next_tick(worker.reread_config))
-        except ValueError:
+            signal.signal(signal.SIGUSR1, worker_job(worker, lambda: reload_config(ctx, worker)))
+        except (ValueError, AttributeError):
             log.debug("Cannot set all signals -- not available on this platform")
         if ctx.obj['systemd']:
             try:
@@ -107,6 +130,31 @@ def run(ctx):
             helper.remove(ctx.obj['pidfile'])
 
 
+def run_shards(ctx, shards, use_asyncio=False):
+    """ Run the workers in several processes, under a supervisor
+    """
+    supervisor = ShardSupervisor(ctx.config, shards, masterpassword=ctx.bitshares.wallet.masterpassword,
+                                 use_asyncio=use_asyncio)
+    stop = lambda x, y: supervisor.stop()  # noqa: E731
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        signal.signal(signal.SIGHUP, stop)
+        signal.signal(signal.SIGUSR1, worker_job(supervisor, lambda: reload_config(ctx, supervisor)))
+    except (ValueError, AttributeError):
+        log.debug("Cannot set all signals -- not available on this platform")
+    if ctx.obj['systemd']:
+        try:
+            import sdnotify
+            sdnotify.SystemdNotifier().notify("READY=1")
+        except BaseException:
+            log.debug("sdnotify not available")
+    try:
+        supervisor.run()
+    except errors.NoWorkersAvailable:
+        sys.exit(70)
+
+
 @main.command()
 @click.pass_context
 def configure(ctx):
@@ -126,6 +174,93 @@ def configure(ctx):
         click.echo("New configuration saved")
 
 
+@main.command()
+@click.argument('worker_name')
+@click.argument('feed_file', type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    '--balance',
+    '-b',
+    multiple=True,
+    help='Initial balance of the account, as SYMBOL=AMOUNT, repeated for each asset')
+@click.pass_context
+@configfile
+@verbose
+def backtest(ctx, worker_name, feed_file, balance):
+    """ Run a worker of the config against recorded market data
+    """
+    from .backtest.engine import Backtest, BacktestError, format_report
+    from .backtest.feed import Feed, FeedError
+
+    balances = parse_balances(balance)
+    try:
+        result = Backtest(ctx.config, worker_name, Feed.load(feed_file), balances).run()
+    except (BacktestError, FeedError) as e:
+        click.echo(str(e), err=True)
+        sys.exit(65)  # 'data format error' in sysexits.h
+    click.echo(format_report(result))
+
+
+@main.command()
+@click.argument('worker_name')
+@click.argument('feed_file', type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    '--balance',
+    '-b',
+    multiple=True,
+    help='Initial balance of the account, as SYMBOL=AMOUNT, repeated for each asset')
+@click.option(
+    '--param',
+    '-p',
+    multiple=True,
+    help='Values of a setting of the worker, as KEY=START:STOP:STEP or KEY=A,B,C, repeated for each setting')
+@click.option('--processes', type=int, default=None, help='Backtests run at once, one per CPU by default')
+@click.option('--sort', default='profit_percent', help='Result ranking the settings, profit_percent by default')
+@click.option('--top', type=int, default=20, help='Settings shown, 0 for all')
+@click.pass_context
+@configfile
+@verbose
+def sweep(ctx, worker_name, feed_file, balance, param, processes, sort, top):
+    """ Backtest a worker of the config with every combination of settings
+    """
+    from .backtest.engine import BacktestError
+    from .backtest.feed import Feed, FeedError
+    from .backtest.sweep import Sweep, SweepError, format_table
+
+    balances = parse_balances(balance)
+    ranges = {}
+    for item in param:
+        key, _, values = item.partition('=')
+        if not values:
+            raise click.BadParameter('{} is not KEY=VALUES'.format(item), param_hint='--param')
+        ranges[key.strip()] = values
+    if not ranges:
+        raise click.BadParameter('no setting to sweep', param_hint='--param')
+
+    def progress(done, total):
+        log.info('{}/{} backtests done'.format(done, total))
+
+    try:
+        outcomes = Sweep(ctx.config, worker_name, Feed.load(feed_file), balances, ranges,
+                         processes=processes).run(sort=sort, progress=progress)
+    except (BacktestError, FeedError, SweepError) as e:
+        click.echo(str(e), err=True)
+        sys.exit(65)  # 'data format error' in sysexits.h
+    click.echo(format_table(outcomes, top))
+
+
+def parse_balances(balance):
+    """ Returns the balances given as SYMBOL=AMOUNT on the command line
+    """
+    balances = {}
+    for item in balance:
+        symbol, _, amount = item.partition('=')
+        try:
+            balances[symbol.strip().upper()] = float(amount)
+        except ValueError:
+            raise click.BadParameter('{} is not SYMBOL=AMOUNT'.format(item), param_hint='--balance')
+    return balances
+
+
 def shell():
     """ Run dexbot as a shell
     """
@@ -143,6 +278,17 @@ def shell():
                 os.system("systemctl --user start dexbot")
 
 
+def reload_config(ctx, worker):
+    """ Reread the config file and apply it to the running workers
+    """
+    try:
+        config = yaml.safe_load(open(ctx.obj['configfile']))
+    except Exception:
+        log.exception("Cannot reload the config, keeping the current one")
+        return
+    worker.reload_config(config)
+
+
 def worker_job(worker, job):
     return lambda x, y: worker.do_next_tick(job)
 
@@ -0,0 +1,236 @@
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Number of threads running the event handlers of the workers
+DISPATCH_THREADS = 8
+
+# Maximum number of events waiting per worker, the oldest block and market
+# events are dropped when a worker falls behind
+DISPATCH_QUEUE_SIZE = 100
+
+
+class Lane:
+    """ Queue of the events of a single worker, handled one at a time and
+        in order, along with its metrics
+    """
+
+    def __init__(self, name, queue_size):
+        self.name = name
+        self.queue = collections.deque()
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        # True while a pool thread is handling the events of the lane
+        self.running = False
+        # Set while no event of the lane is being handled
+        self.idle = threading.Event()
+        self.idle.set()
+        # Thread handling the events of the lane, None while idle
+        self.thread = None
+        self.closed = False
+
+        self.handled = 0
+        self.failed = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def pop(self):
+        """ Returns the next event of the lane, or None once it is drained
+        """
+        with self.lock:
+            if not self.queue or self.closed:
+                self.stop_running()
+                return None
+            return self.queue.popleft()
+
+    def start_running(self):
+        self.running = True
+        self.idle.clear()
+
+    def stop_running(self):
+        self.running = False
+        self.thread = None
+        self.idle.set()
+
+    def make_room(self):
+        """ Drops the oldest droppable event once the lane is full, events
+            which may not be dropped are kept beyond the size of the queue
+        """
+        if len(self.queue) < self.queue_size:
+            return
+        for index, event in enumerate(self.queue):
+            if event[3]:
+                del self.queue[index]
+                self.dropped += 1
+                if self.dropped == 1 or self.dropped % 100 == 0:
+                    log.warning('Worker "{}" is falling behind, {} event(s) dropped so far'.format(
+                        self.name, self.dropped))
+                return
+        if len(self.queue) % self.queue_size == 0:
+            log.warning('Worker "{}" is falling behind, {} event(s) waiting'.format(self.name, len(self.queue)))
+
+    def record(self, queued, start, end, failed):
+        with self.lock:
+            self.handled += 1
+            self.failed += failed
+            self.total_wait += start - queued
+            self.total_latency += end - start
+            self.max_latency = max(self.max_latency, end - start)
+
+    def metrics(self):
+        with self.lock:
+            return {
+                'depth': len(self.queue),
+                'max_depth': self.max_depth,
+                'handled': self.handled,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'wait_avg': self.total_wait / self.handled if self.handled else 0.0,
+                'latency_avg': self.total_latency / self.handled if self.handled else 0.0,
+                'latency_max': self.max_latency
+            }
+
+
+class Dispatcher:
+    """ Runs event handlers on a thread pool, with one serialized lane per
+        worker
+
+        The events of a worker are handled one at a time and in the order
+        they were submitted, while the lanes of different workers run in
+        parallel. A slow worker therefore only delays its own events. When
+        a lane holds ``queue_size`` events, the oldest droppable one is
+        dropped to make room for the new one and counted in the lane
+        metrics. Events which may not be dropped are always kept.
+
+        :param int threads: number of threads of the pool
+        :param int queue_size: maximum number of events waiting per lane
+    """
+
+    def __init__(self, threads=DISPATCH_THREADS, queue_size=DISPATCH_QUEUE_SIZE):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self.queue_size = max(int(queue_size), 1)
+        self.lock = threading.Lock()
+        self.lanes = {}
+        self.closed = False
+
+    def submit(self, name, func, *args, droppable=False):
+        """ Queues ``func(*args)`` on the lane of the given name
+
+            :param bool droppable: whether the event may be dropped when the
+                worker falls behind, i.e. a later event of the same kind
+                supersedes it
+        """
+        with self.lock:
+            if self.closed:
+                return
+            lane = self.lanes.get(name)
+            if lane is None:
+                lane = self.lanes[name] = Lane(name, self.queue_size)
+
+        with lane.lock:
+            if lane.closed:
+                return
+            lane.make_room()
+            lane.queue.append((func, args, time.time(), droppable))
+            lane.max_depth = max(lane.max_depth, len(lane.queue))
+            if lane.running:
+                return
+            lane.start_running()
+        self._schedule(lane)
+
+    def _schedule(self, lane):
+        """ Gets the lane handled, it has events waiting and isn't running
+        """
+        self.executor.submit(self._run, lane)
+
+    def _run(self, lane):
+        """ Handles the next event of the lane, then yields the thread to the
+            other lanes
+        """
+        event = lane.pop()
+        if event is None:
+            # The lane was removed meanwhile
+            return
+        func, args, queued, _ = event
+
+        lane.thread = threading.get_ident()
+        start = time.time()
+        try:
+            func(*args)
+        except Exception:
+            failed = True
+            log.exception('Unhandled error in the events of "{}"'.format(lane.name))
+        else:
+            failed = False
+        lane.record(queued, start, time.time(), failed)
+
+        with lane.lock:
+            if not lane.queue or lane.closed:
+                lane.stop_running()
+                return
+        # Requeue at the back of the pool, so that busy lanes take turns
+        self._schedule(lane)
+
+    def remove(self, name, wait=False):
+        """ Drops the lane and its pending events, the running event is let finish
+
+            :param bool wait: wait for the running event to be handled, so
+                that nothing runs on behalf of the worker anymore. A handler
+                removing its own lane doesn't wait for itself.
+        """
+        with self.lock:
+            lane = self.lanes.pop(name, None)
+        if lane:
+            with lane.lock:
+                lane.closed = True
+                lane.queue.clear()
+            if wait and lane.thread != threading.get_ident():
+                lane.idle.wait()
+
+    def metrics(self):
+        """ Returns the metrics of each lane, by lane name
+        """
+        with self.lock:
+            lanes = list(self.lanes.values())
+        return {lane.name: lane.metrics() for lane in lanes}
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            self.closed = True
+            lanes = list(self.lanes.values())
+            self.lanes = {}
+        for lane in lanes:
+            with lane.lock:
+                lane.closed = True
+                lane.queue.clear()
+        self.executor.shutdown(wait=wait)
+
+
+class LockedRPC:
+    """ Proxy serializing the calls to an RPC connection, as a websocket
+        connection can only carry one call at a time
+    """
+
+    def __init__(self, rpc):
+        self.__dict__['_rpc'] = rpc
+        self.__dict__['_lock'] = threading.RLock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._rpc, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self._rpc, name, value)
@@ -1,10 +1,10 @@
 import sys
 
 from PyQt5 import Qt
-from bitshares import BitShares
 
 from dexbot.config import Config
 from dexbot.controllers.main_controller import MainController
+from dexbot.node_pool import create_bitshares
 from dexbot.views.worker_list import MainView
 from dexbot.controllers.wallet_controller import WalletController
 from dexbot.views.unlock_wallet import UnlockWalletView
@@ -16,7 +16,7 @@ class App(Qt.QApplication):
         super(App, self).__init__(sys_argv)
 
         config = Config()
-        bitshares_instance = BitShares(config['node'])
+        bitshares_instance = create_bitshares(config['node'])
 
         # Wallet unlock
         unlock_ctrl = WalletController(bitshares_instance)
@@ -0,0 +1,117 @@
+"""
+Order ladders of the staggered strategies, computed in closed form
+
+A ladder is a geometric series of prices running from a starting price up
+to, excluding, a bound, with a geometric series of amounts alongside it.
+The number of rungs is derived from logarithms and the rungs are computed
+at once as numpy arrays, instead of stepping through them one by one.
+"""
+
+import math
+
+import numpy
+
+# Smallest positive price, bounds a ladder that runs down towards zero
+MIN_PRICE = float(numpy.nextafter(0, 1))
+
+
+def ladder_length(start, ratio, bound):
+    """ Returns the number of terms of ``start * ratio ** k`` (k = 0, 1, ...)
+        lying before the bound, i.e. above it when the ratio is below 1 and
+        below it otherwise
+    """
+    if ratio <= 0 or ratio == 1:
+        raise ValueError("The ratio of a ladder must be positive and not 1, got {}".format(ratio))
+
+    if ratio < 1:
+        bound = max(bound, MIN_PRICE)
+
+        def inside(k):
+            return start * ratio ** k > bound
+    else:
+        def inside(k):
+            return start * ratio ** k < bound
+
+    if not inside(0):
+        return 0
+
+    length = max(int(math.ceil(math.log(bound / start) / math.log(ratio))), 1)
+    # The rounding of the logarithms may be off by one either way
+    while length > 1 and not inside(length - 1):
+        length -= 1
+    while inside(length):
+        length += 1
+    return length
+
+
+def geometric_series(start, ratio, count):
+    """ Returns the array of the first ``count`` terms of ``start * ratio ** k``
+    """
+    return start * ratio ** numpy.arange(count, dtype=float)
+
+
+def geometric_sum(start, ratio, count):
+    """ Returns the sum of the first ``count`` terms of ``start * ratio ** k``
+    """
+    if ratio == 1:
+        return start * count
+    log_ratio = math.log(ratio)
+    # expm1 keeps the precision for ratios close to 1, i.e. tiny increments
+    return start * math.expm1(count * log_ratio) / math.expm1(log_ratio)
+
+
+def geometric_ladder(start, ratio, bound):
+    """ Returns the array of the terms of ``start * ratio ** k`` lying before the bound
+    """
+    return geometric_series(start, ratio, ladder_length(start, ratio, bound))
+
+
+def staggered_ladder(center_price, amount, spread, increment, lower_bound, upper_bound):
+    """ Returns the buy and sell sides of a Staggered Orders ladder
+
+        Buy prices step down by ``1 + increment`` from below the center
+        price to the lower bound, their amounts growing by the square root
+        of it. Sell prices step up from above the center price to the upper
+        bound, their amounts shrinking likewise.
+
+        :return: tuple of (buy prices, buy amounts, sell prices, sell amounts)
+            numpy arrays, amounts are in the quote asset
+    """
+    half_step = math.sqrt(1 + increment)
+    offset = math.sqrt(1 + increment + spread)
+
+    buy_prices = geometric_ladder(center_price / offset, 1 / (1 + increment), lower_bound)
+    sell_prices = geometric_ladder(center_price * offset, 1 + increment, upper_bound)
+    buy_amounts = geometric_series(amount, half_step, len(buy_prices))
+    sell_amounts = geometric_series(amount * offset, 1 / half_step, len(sell_prices))
+    return buy_prices, buy_amounts, sell_prices, sell_amounts
+
+
+def staggered_required_assets(center_price, amount, spread, increment, lower_bound, upper_bound):
+    """ Returns the base and quote amounts needed for a Staggered Orders
+        ladder, without building it
+
+        :return: tuple of (base asset amount, quote asset amount)
+    """
+    half_step = math.sqrt(1 + increment)
+    offset = math.sqrt(1 + increment + spread)
+
+    buy_count = ladder_length(center_price / offset, 1 / (1 + increment), lower_bound)
+    sell_count = ladder_length(center_price * offset, 1 + increment, upper_bound)
+
+    # Each buy rung costs its amount times its price, both geometric series
+    needed_base = geometric_sum(amount * center_price / offset, 1 / half_step, buy_count)
+    needed_quote = geometric_sum(amount * offset, 1 / half_step, sell_count)
+    return needed_base, needed_quote
+
+
+def ataxia_ladder(size, spread, increment, upper_bound, lower_bound):
+    """ Returns the Ataxia ladder, prices stepping down by ``1 - increment``
+        from the upper bound to the lower bound, sizes shrinking by
+        ``sqrt(1 + spread + increment)``
+
+        :return: tuple of (prices, sizes) numpy arrays
+    """
+    prices = geometric_ladder(upper_bound, 1 - increment, lower_bound)
+    sizes = geometric_series(size, 1 / math.sqrt(1 + spread + increment), len(prices))
+    return prices, sizes
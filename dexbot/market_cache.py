@@ -0,0 +1,112 @@
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class MarketCache:
+    """ Block-height keyed cache of market tickers and order books
+
+        One instance is owned by :class:`dexbot.worker.WorkerInfrastructure`
+        and shared by all of its workers, so that any number of workers
+        operating on the same market cause a single RPC round-trip per
+        block instead of one per worker.
+
+        The whole cache is dropped on every new block, and the entries of a
+        market are dropped whenever a market notification arrives for it.
+
+        .. note:: Cached tickers and order books are shared between the
+                  workers, treat them as read-only!
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.block_num = None
+        self.entries = {}
+        # Bumped on every invalidation, guards against storing data that was
+        # fetched while the cache was invalidated
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def block_number(block_id):
+        """ Returns the block number encoded in the first 4 bytes of a block id
+        """
+        try:
+            return int(block_id[:8], 16)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def market_key(market):
+        return market['quote']['id'], market['base']['id']
+
+    def on_block(self, block_id):
+        """ Invalidate everything on a new block
+        """
+        with self.lock:
+            self.block_num = self.block_number(block_id)
+            self.entries.clear()
+            self.generation += 1
+
+    def on_market(self, data):
+        """ Invalidate the cached data of the market the notification belongs to
+        """
+        try:
+            pair = {data['base']['asset']['id'], data['quote']['asset']['id']}
+        except (KeyError, TypeError):
+            # Not able to tell which market changed, drop everything
+            self.invalidate()
+            return
+
+        with self.lock:
+            for key in [key for key in self.entries if set(key[-2:]) == pair]:
+                del self.entries[key]
+            self.generation += 1
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+    def ticker(self, market):
+        """ Returns the ticker of the market, see :func:`bitshares.market.Market.ticker`
+        """
+        return self._get(('ticker',) + self.market_key(market), market.ticker)
+
+    def orderbook(self, market, limit=25):
+        """ Returns the order book of the market, see :func:`bitshares.market.Market.orderbook`
+        """
+        return self._get(
+            ('orderbook', limit) + self.market_key(market),
+            lambda: market.orderbook(limit=limit)
+        )
+
+    def _get(self, key, fetch):
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            generation = self.generation
+
+        # Fetch outside of the lock so that other markets aren't blocked
+        value = fetch()
+
+        with self.lock:
+            if generation == self.generation:
+                self.entries[key] = value
+        return value
+
+    def stats(self):
+        """ Returns the hit/miss counters of the cache
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'block_num': self.block_num,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,285 @@
+import concurrent.futures
+import logging
+import re
+import threading
+import time
+
+import websocket
+from bitshares import BitShares
+from bitsharesapi.bitsharesnoderpc import BitSharesNodeRPC
+from grapheneapi.exceptions import NumRetriesReached
+
+log = logging.getLogger(__name__)
+
+# Seconds between two measurements of the nodes
+PROBE_INTERVAL = 10
+
+# Blocks a node may lag behind the most advanced one and still be used
+MAX_BLOCK_LAG = 3
+
+# Weight of the latest measurement in the round-trip time average
+RTT_SMOOTHING = 0.3
+
+# A healthy node is only replaced by one this much faster, to avoid flapping
+SWITCH_MARGIN = 0.2
+
+# Errors telling the connection to the node is lost, rather than the call failed
+CONNECTION_ERRORS = (NumRetriesReached, OSError, websocket.WebSocketException)
+
+# Calls which are never sent to another node when the connection is lost: the
+# node may have accepted the transaction before, it would be applied twice
+BROADCAST_CALLS = ('broadcast_transaction', 'broadcast_transaction_synchronous',
+                   'broadcast_transaction_with_callback')
+
+
+def node_list(node):
+    """ Returns the node URLs of the ``node`` config entry, a URL, a list of
+        them or a string of them separated by commas
+    """
+    if isinstance(node, str):
+        return [url.strip() for url in re.split(r",|;", node) if url.strip()]
+    return list(node)
+
+
+def create_bitshares(node, **kwargs):
+    """ Returns a BitShares instance connected to the ``node`` config entry,
+        through a :class:`NodePool` when it lists several nodes
+    """
+    urls = node_list(node)
+    if len(urls) > 1:
+        return PooledBitShares(urls, **kwargs)
+    return BitShares(urls[0] if urls else node, **kwargs)
+
+
+class Node:
+    """ Persistent connection to a node, along with its measurements
+    """
+
+    def __init__(self, url, user="", password="", **kwargs):
+        self.url = url
+        self.user = user
+        self.password = password
+        kwargs.pop('num_retries', None)
+        self.kwargs = kwargs
+        self.rpc = None
+        # A websocket connection carries one call at a time
+        self.lock = threading.RLock()
+        self.rtt = None
+        self.head_block = None
+        self.healthy = False
+        self.error = None
+        self.probing = None
+
+    def connect(self):
+        with self.lock:
+            if self.rpc is None:
+                self.rpc = BitSharesNodeRPC(self.url, self.user, self.password, num_retries=0, **self.kwargs)
+            return self.rpc
+
+    def disconnect(self, error=None):
+        with self.lock:
+            if self.rpc is not None:
+                try:
+                    self.rpc.connection.disconnect()
+                except Exception:
+                    pass
+            self.rpc = None
+            self.rtt = None
+            self.healthy = False
+            self.error = error
+
+    def call(self, name, *args, **kwargs):
+        with self.lock:
+            try:
+                return getattr(self.connect(), name)(*args, **kwargs)
+            except CONNECTION_ERRORS as e:
+                # The connection is of no use past its retries, start over next time
+                self.disconnect(e)
+                raise
+            except ValueError as e:
+                # A websocket closed by the node returns an empty response
+                if self.connected():
+                    raise
+                self.disconnect(e)
+                raise NumRetriesReached('Lost the connection to {}'.format(self.url))
+
+    def connected(self):
+        websocket = getattr(getattr(self.rpc, 'connection', None), 'ws', None)
+        return websocket is None or websocket.connected
+
+    def probe(self):
+        """ Measures the round-trip time and head block of the node
+        """
+        with self.lock:
+            self.connect()
+            start = time.time()
+            properties = self.call('get_dynamic_global_properties')
+            rtt = time.time() - start
+            self.rtt = rtt if self.rtt is None else self.rtt + RTT_SMOOTHING * (rtt - self.rtt)
+            self.head_block = properties['head_block_number']
+            self.error = None
+
+
+class NodePool:
+    """ RPC connection spread over several nodes
+
+        Keeps a connection to each node and measures their round-trip time
+        and head block every :data:`PROBE_INTERVAL` seconds. Calls go to the
+        fastest node among the ones lagging at most :data:`MAX_BLOCK_LAG`
+        blocks behind the others. When a node drops the connection the call
+        is retried on the next one, so the workers keep running through a
+        node failure. Broadcasts are the exception, see :data:`BROADCAST_CALLS`,
+        their error is raised for the worker to check its orders.
+
+        The pool stands in for the ``rpc`` of a BitShares instance, see
+        :class:`PooledBitShares`.
+
+        :param list urls: websocket URLs of the nodes
+        :param float probe_interval: seconds between two measurements
+        :param int max_lag: blocks a node may lag behind and still be used
+    """
+
+    def __init__(self, urls, user="", password="", probe_interval=PROBE_INTERVAL, max_lag=MAX_BLOCK_LAG,
+                 **kwargs):
+        self.user = user
+        self.password = password
+        self.nodes = [Node(url, user, password, **kwargs) for url in node_list(urls)]
+        self.probe_interval = probe_interval
+        self.max_lag = max_lag
+        self.lock = threading.Lock()
+        self.active = None
+        self.closed = threading.Event()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.nodes))
+
+        self.probe()
+        if self.active is None:
+            raise NumRetriesReached('None of the nodes is reachable: {}'.format(', '.join(self.urls)))
+
+        self.thread = threading.Thread(target=self.run, name='dexbot-node-pool', daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return self.active.url
+
+    @property
+    def urls(self):
+        """ URLs of the nodes, the best one first
+        """
+        return [node.url for node in self.candidates()]
+
+    def run(self):
+        while not self.closed.wait(self.probe_interval):
+            self.probe()
+
+    def close(self):
+        self.closed.set()
+        self.executor.shutdown(wait=False)
+        for node in self.nodes:
+            node.disconnect()
+
+    def probe(self):
+        """ Measures all the nodes at once, then picks the one to use
+        """
+        for node in self.nodes:
+            # A node still busy with the previous probe is left alone
+            if node.probing is None or node.probing.done():
+                node.probing = self.executor.submit(node.probe)
+        concurrent.futures.wait([node.probing for node in self.nodes], timeout=self.probe_interval)
+
+        for node in self.nodes:
+            if not node.probing.done():
+                node.healthy = False
+            elif node.probing.exception() is not None:
+                node.error = node.probing.exception()
+                node.healthy = False
+
+        heads = [node.head_block for node in self.nodes if node.error is None and node.head_block is not None]
+        head = max(heads) if heads else 0
+        for node in self.nodes:
+            if node.probing.done() and node.error is None and node.rtt is not None:
+                node.healthy = node.head_block >= head - self.max_lag
+        self.select()
+
+    @staticmethod
+    def rank(node):
+        return not node.healthy, node.rtt if node.rtt is not None else float('inf')
+
+    def select(self):
+        """ Makes the fastest healthy node the active one
+        """
+        with self.lock:
+            best = min(self.nodes, key=self.rank)
+            active = self.active
+            if not best.healthy:
+                return
+            if active is not None and active.healthy and active.rtt is not None:
+                if best is active or best.rtt > active.rtt * (1 - SWITCH_MARGIN):
+                    return
+            self.active = best
+
+        if active is not None:
+            log.info('Switching from node {} to {} ({:.0f}ms)'.format(active.url, best.url, best.rtt * 1000))
+        else:
+            log.info('Using node {} ({:.0f}ms)'.format(best.url, best.rtt * 1000))
+
+    def candidates(self):
+        """ Returns the nodes in the order to try them, the active one first
+        """
+        with self.lock:
+            active = self.active
+        others = sorted((node for node in self.nodes if node is not active), key=self.rank)
+        return ([active] if active is not None else []) + others
+
+    def call(self, name, *args, **kwargs):
+        """ Calls the RPC method on the active node, failing over to the
+            next nodes when the connection is lost
+        """
+        error = None
+        candidates = self.candidates()
+        if name in BROADCAST_CALLS:
+            candidates = candidates[:1]
+        for node in candidates:
+            try:
+                return node.call(name, *args, **kwargs)
+            except CONNECTION_ERRORS as e:
+                log.warning('Node {} failed: {}'.format(node.url, e))
+                error = e
+                self.select()
+        raise error
+
+    def status(self):
+        """ Returns the measurements of the nodes, the active one first
+        """
+        with self.lock:
+            active = self.active
+        return [
+            {
+                'url': node.url,
+                'active': node is active,
+                'healthy': node.healthy,
+                'rtt': node.rtt,
+                'head_block': node.head_block,
+                'error': str(node.error) if node.error else None
+            }
+            for node in self.candidates()
+        ]
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name in ('nodes', 'active'):
+            raise AttributeError(name)
+        attr = getattr(self.active.connect(), name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+        return call
+
+
+class PooledBitShares(BitShares):
+    """ BitShares instance talking to the nodes of a :class:`NodePool`
+    """
+
+    def connect(self, node="", rpcuser="", rpcpassword="", **kwargs):
+        self.rpc = NodePool(node, rpcuser, rpcpassword, **kwargs)
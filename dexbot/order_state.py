@@ -0,0 +1,234 @@
+import logging
+import threading
+
+from dexbot.helper import copy_object
+
+log = logging.getLogger(__name__)
+
+# Blocks after which the mirror is fetched again as a whole, as a safety net
+RESYNC_BLOCKS = 100
+
+# Most operations replayed from the account history, beyond that a single
+# full fetch is cheaper
+MAX_REPLAY_OPERATIONS = 5
+
+# Operation ids, see bitsharesbase.operationids
+LIMIT_ORDER_CREATE = 1
+LIMIT_ORDER_CANCEL = 2
+FILL_ORDER = 4
+
+
+class OrderState:
+    """ In-process mirror of the open orders of an account
+
+        One instance per account is owned by
+        :class:`dexbot.worker.WorkerInfrastructure` and shared by the
+        workers of the account. The orders are fetched once, then kept up
+        to date from the account notifications: each one tells how many
+        operations the account has, and the new operations are replayed
+        from the account history on the next read. Orders created, canceled
+        (expired ones included, the node records a cancel for them) and
+        filled update the mirror, the other operations leave it as it is.
+        Reads with nothing new cost no RPC call at all.
+
+        The mirror is fetched again as a whole every :data:`RESYNC_BLOCKS`
+        blocks, whenever more than :data:`MAX_REPLAY_OPERATIONS` new
+        operations are found, and when the replay fails.
+
+        :param str account_name: name of the account
+        :param bitshares.BitShares bitshares_instance: instance to talk to the node
+        :param int resync_blocks: blocks between two full fetches
+    """
+
+    def __init__(self, account_name, bitshares_instance, resync_blocks=RESYNC_BLOCKS):
+        self.account_name = account_name
+        self.bitshares = bitshares_instance
+        self.resync_blocks = resync_blocks
+        # Guards the state of the mirror, held only while it is read or updated
+        self.lock = threading.RLock()
+        # Taken by the reads bringing the mirror up to date, one at a time
+        self.sync_lock = threading.RLock()
+
+        self.account_id = None
+        self.orders = {}
+        # Operation count of the account the orders are up to date with
+        self.total_ops = None
+        # Latest operation count and operation known from the notifications
+        self.latest_ops = None
+        self.latest_op = None
+        self.stale = True
+        self.check_statistics = False
+        self.blocks = 0
+
+        self.reads = 0
+        self.avoided = 0
+        self.resyncs = 0
+        self.replayed = 0
+
+    @property
+    def statistics_id(self):
+        return '2.6.{}'.format(self.account_id.split('.')[2])
+
+    def on_block(self):
+        with self.lock:
+            self.blocks += 1
+            if self.blocks >= self.resync_blocks:
+                self.stale = True
+
+    def on_account(self, statistics):
+        """ Notes the latest operation of the account, from its
+            statistics object (2.6.x) as sent in the account notifications
+        """
+        with self.lock:
+            if self.latest_ops is None or int(statistics['total_ops']) >= self.latest_ops:
+                self.latest_ops = int(statistics['total_ops'])
+                self.latest_op = statistics['most_recent_op']
+
+    def expect_operations(self):
+        """ Tells the mirror that the account just broadcast operations,
+            so the next read checks for them even before the notification
+        """
+        with self.lock:
+            self.check_statistics = True
+
+    def invalidate(self):
+        with self.lock:
+            self.stale = True
+
+    def limit_orders(self):
+        """ Returns the open orders of the account, in the format of the
+            ``limit_orders`` of a full account
+        """
+        with self.sync_lock:
+            with self.lock:
+                self.reads += 1
+            self.sync()
+            with self.lock:
+                return copy_object(list(self.orders.values()))
+
+    def sync(self):
+        """ Brings the mirror up to date, the RPC calls are made outside of
+            :attr:`lock` so the notifications are never held up by a read
+        """
+        with self.sync_lock:
+            with self.lock:
+                stale = self.stale
+                check_statistics = self.check_statistics
+                self.check_statistics = False
+            if stale:
+                self.resync()
+                return
+
+            if check_statistics:
+                try:
+                    statistics = self.bitshares.rpc.get_objects([self.statistics_id])[0]
+                except Exception:
+                    self.expect_operations()
+                    raise
+                self.on_account(statistics)
+
+            with self.lock:
+                latest_ops, latest_op = self.latest_ops, self.latest_op
+            new_ops = latest_ops - self.total_ops if latest_ops is not None else 0
+            if new_ops > MAX_REPLAY_OPERATIONS:
+                self.resync()
+                return
+            if new_ops > 0:
+                try:
+                    self.replay(latest_op, new_ops)
+                except Exception:
+                    log.exception('Unable to replay the operations of {}, fetching its orders'.format(
+                        self.account_name))
+                    self.resync()
+                return
+
+            if not check_statistics:
+                with self.lock:
+                    self.avoided += 1
+
+    def resync(self):
+        """ Fetches the orders and the operation count of the account
+        """
+        with self.sync_lock:
+            # Marked up to date first, an invalidation during the fetch holds
+            with self.lock:
+                self.stale = False
+                self.check_statistics = False
+                self.blocks = 0
+            try:
+                full_account = self.bitshares.rpc.get_full_accounts([self.account_name], False)[0][1]
+            except Exception:
+                self.invalidate()
+                raise
+            total_ops = int(full_account['statistics']['total_ops'])
+            with self.lock:
+                self.account_id = full_account['account']['id']
+                self.orders = {order['id']: order for order in full_account['limit_orders']}
+                self.total_ops = total_ops
+                if self.latest_ops is None or total_ops >= self.latest_ops:
+                    self.latest_ops = total_ops
+                    self.latest_op = full_account['statistics']['most_recent_op']
+                self.resyncs += 1
+
+    def replay(self, history_id, count):
+        """ Applies the latest operations of the account, walking its
+            history back from the most recent one
+
+            :param str history_id: id of the most recent history entry
+            :param int count: operations to apply
+        """
+        with self.sync_lock:
+            operation_ids = []
+            while len(operation_ids) < count:
+                entry = self.bitshares.rpc.get_objects([history_id])[0]
+                operation_ids.append(entry['operation_id'])
+                history_id = entry['next']
+
+            operations = self.bitshares.rpc.get_objects(operation_ids[::-1])
+            with self.lock:
+                for operation in operations:
+                    self.apply(operation['op'], operation['result'])
+                self.total_ops += len(operations)
+                self.replayed += len(operations)
+
+    def apply(self, op, result):
+        """ Updates the orders from an operation of the account history
+        """
+        op_type, data = op
+        if op_type == LIMIT_ORDER_CREATE:
+            order_id = result[1]
+            if data['seller'] != self.account_id or order_id in self.orders:
+                return
+            self.orders[order_id] = {
+                'id': order_id,
+                'expiration': data['expiration'],
+                'seller': data['seller'],
+                'for_sale': int(data['amount_to_sell']['amount']),
+                'sell_price': {
+                    'base': copy_object(data['amount_to_sell']),
+                    'quote': copy_object(data['min_to_receive'])
+                },
+                'deferred_fee': 0
+            }
+        elif op_type == LIMIT_ORDER_CANCEL:
+            self.orders.pop(data['order'], None)
+        elif op_type == FILL_ORDER:
+            order = self.orders.get(data['order_id'])
+            if order is None:
+                # A call or settle order of the account
+                return
+            order['for_sale'] = int(order['for_sale']) - int(data['pays']['amount'])
+            if order['for_sale'] <= 0:
+                del self.orders[data['order_id']]
+
+    def stats(self):
+        """ Returns the read counters of the mirror
+        """
+        with self.lock:
+            return {
+                'orders': len(self.orders),
+                'reads': self.reads,
+                'avoided_rpcs': self.avoided,
+                'resyncs': self.resyncs,
+                'replayed_operations': self.replayed
+            }
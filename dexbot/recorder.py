@@ -0,0 +1,599 @@
+""" Recording of the market data the workers receive, for replay and analytics
+
+The data is kept in append-only files of compressed columnar chunks, one
+file per market per day (UTC), in a directory per market::
+
+    market_data/
+        BTS_USD/
+            market.json
+            2018-06-01.dxm
+            2018-06-02.dxm
+        accounts/
+            2018-06-01.dxm
+
+The processes of a sharded run each write files of their own, suffixed
+with the index of the shard, e.g. ``2018-06-01.s1.dxm``.
+
+Every chunk holds rows of a single table, see :data:`TABLES`, as one
+array per column, compressed as a whole. A chunk is only ever appended at
+the end of a file, and a chunk cut short by a crash is dropped before the
+next one is written.
+"""
+import datetime
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+import numpy
+from appdirs import user_data_dir
+
+from dexbot import APP_NAME, AUTHOR
+
+log = logging.getLogger(__name__)
+
+# Directory the market data is recorded to
+RECORDER_DIR = os.path.join(user_data_dir(APP_NAME, AUTHOR), 'market_data')
+
+# Rows buffered per table before they are written as a chunk
+CHUNK_ROWS = 4096
+
+# Seconds after which the buffered rows are written anyway
+FLUSH_INTERVAL = 60
+
+# Blocks between two ticker snapshots of the recorded markets
+TICKER_INTERVAL = 20
+
+# Stream of the account updates, not tied to a market
+ACCOUNTS_STREAM = 'accounts'
+
+FILE_SUFFIX = '.dxm'
+MARKET_FILE = 'market.json'
+
+# Columns of the tables, times are unix times, prices in base per quote and
+# amounts in quote. Sides are 1 for buying the quote asset, -1 for selling
+# it. A trade is filled on both sides, maker is 1 for the fill of the maker,
+# 0 for the one of the taker, -1 when the node doesn't tell. Ids of orders
+# and accounts are kept as their instance number.
+TABLES = {
+    'block': (('time', 'f8'), ('block_num', 'i8')),
+    'ticker': (('time', 'f8'), ('bid', 'f8'), ('ask', 'f8'), ('latest', 'f8'),
+               ('base_volume', 'f8'), ('quote_volume', 'f8')),
+    'trade': (('time', 'f8'), ('price', 'f8'), ('amount', 'f8'), ('side', 'i1'), ('maker', 'i1'),
+              ('order', 'i8'), ('account', 'i8')),
+    'order': (('time', 'f8'), ('price', 'f8'), ('amount', 'f8'), ('side', 'i1'),
+              ('order', 'i8'), ('account', 'i8')),
+    'account': (('time', 'f8'), ('account', 'i8'), ('total_ops', 'i8'), ('most_recent_op', 'i8'))
+}
+
+# Ids of the tables in the chunk headers, never to be reordered
+TABLE_IDS = ('block', 'ticker', 'trade', 'order', 'account')
+
+FORMAT_VERSION = 1
+
+# Magic, format version, table id, rows, raw size, compressed size, time of
+# the first and of the last row
+CHUNK_HEADER = struct.Struct('<4sBBxxIIIdd')
+CHUNK_MAGIC = b'DXMC'
+
+
+def stream_name(quote, base):
+    """ Returns the directory name of the stream of a market
+    """
+    return '{}_{}'.format(quote, base)
+
+
+def instance(object_id):
+    """ Returns the instance number of an object id, -1 when unknown
+    """
+    try:
+        return int(object_id.split('.')[2])
+    except (AttributeError, IndexError, ValueError):
+        return -1
+
+
+def market_key(market):
+    """ Returns the symbols of a market string QUOTE:BASE, as a set
+    """
+    return frozenset(market.replace('/', ':').split(':'))
+
+
+def day_of(timestamp):
+    return datetime.datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d')
+
+
+def encode_chunk(table, columns):
+    """ Returns a chunk of the table as bytes
+
+        :param dict columns: arrays of the columns, by name, of the same length
+    """
+    arrays = [numpy.ascontiguousarray(columns[name], dtype=dtype) for name, dtype in TABLES[table]]
+    raw = b''.join(array.tobytes() for array in arrays)
+    payload = zlib.compress(raw)
+    times = arrays[0]
+    header = CHUNK_HEADER.pack(CHUNK_MAGIC, FORMAT_VERSION, TABLE_IDS.index(table), len(times), len(raw),
+                               len(payload), times.min(), times.max())
+    return header + payload
+
+
+def scan_chunks(buffer):
+    """ Walks the chunks of a file
+
+        :return: list of (table, rows, offset of the payload, compressed
+            size, raw size, first time, last time) and the length of the
+            file up to the last complete chunk
+    """
+    chunks = []
+    offset = 0
+    while offset + CHUNK_HEADER.size <= len(buffer):
+        magic, version, table_id, rows, raw_size, size, start, end = CHUNK_HEADER.unpack_from(buffer, offset)
+        if magic != CHUNK_MAGIC or version != FORMAT_VERSION or table_id >= len(TABLE_IDS):
+            break
+        if offset + CHUNK_HEADER.size + size > len(buffer):
+            break
+        chunks.append((TABLE_IDS[table_id], rows, offset + CHUNK_HEADER.size, size, raw_size, start, end))
+        offset += CHUNK_HEADER.size + size
+    return chunks, offset
+
+
+def unique_trades(trades, block_times):
+    """ Returns the mask of the fills keeping each trade once, from the fill
+        of its maker
+
+        The fills the node didn't tell the maker of are paired, within a
+        block, with a fill of the other side for the same amount. The maker
+        placed its order first, the fill of the order with the lower id is
+        kept. A fill whose other side wasn't recorded is kept as it is.
+
+        :param dict trades: columns of the trade table
+        :param block_times: times of the blocks the fills were recorded in
+    """
+    keep = trades['maker'] == 1
+    blocks = numpy.searchsorted(block_times, trades['time'], side='right').tolist()
+    unpaired = {}
+    for index in numpy.flatnonzero(trades['maker'] == -1).tolist():
+        side = int(trades['side'][index])
+        key = (blocks[index], float(trades['amount'][index]))
+        others = unpaired.get(key + (-side,))
+        if others:
+            other = others.pop(0)
+            keep[min(other, index, key=lambda fill: trades['order'][fill])] = True
+        else:
+            unpaired.setdefault(key + (side,), []).append(index)
+    for indexes in unpaired.values():
+        keep[indexes] = True
+    return keep
+
+
+class MarketDataWriter:
+    """ Buffers rows and appends them to the files as chunks
+
+        :param str path: directory of the market data
+        :param int chunk_rows: rows buffered per table before writing a chunk
+        :param int shard: index of the shard of the process, if sharded
+    """
+
+    def __init__(self, path=RECORDER_DIR, chunk_rows=CHUNK_ROWS, shard=None):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.suffix = FILE_SUFFIX if shard is None else '.s{}{}'.format(shard, FILE_SUFFIX)
+        self.lock = threading.Lock()
+        # Rows by (stream, day, table)
+        self.buffers = {}
+        # Files checked for a chunk cut short, by path
+        self.checked = set()
+        self.chunks = 0
+        self.bytes = 0
+
+    def file_path(self, stream, day):
+        return os.path.join(self.path, stream, day + self.suffix)
+
+    def set_market(self, stream, market):
+        """ Saves the description of a market next to its files
+        """
+        directory = os.path.join(self.path, stream)
+        path = os.path.join(directory, MARKET_FILE)
+        if os.path.exists(path):
+            return
+        os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as fd:
+            json.dump(market, fd)
+
+    def append(self, stream, table, row):
+        """ Buffers a row of a table, as a tuple of the values of the columns
+        """
+        key = (stream, day_of(row[0]), table)
+        with self.lock:
+            rows = self.buffers.setdefault(key, [])
+            rows.append(row)
+            if len(rows) >= self.chunk_rows:
+                self._write(key, self.buffers.pop(key))
+
+    def flush(self):
+        """ Writes all the buffered rows
+        """
+        with self.lock:
+            buffers, self.buffers = self.buffers, {}
+            for key, rows in sorted(buffers.items()):
+                self._write(key, rows)
+
+    def _write(self, key, rows):
+        stream, day, table = key
+        columns = {name: [row[index] for row in rows] for index, (name, _) in enumerate(TABLES[table])}
+        chunk = encode_chunk(table, columns)
+        path = self.file_path(stream, day)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if path not in self.checked:
+                self.truncate_partial(path)
+                self.checked.add(path)
+            with open(path, 'ab') as fd:
+                fd.write(chunk)
+        except OSError:
+            log.exception('Unable to record {} rows of {} to {}'.format(len(rows), table, path))
+            return
+        self.chunks += 1
+        self.bytes += len(chunk)
+
+    @staticmethod
+    def truncate_partial(path):
+        """ Drops a chunk cut short at the end of a file, if any
+        """
+        if not os.path.exists(path):
+            return
+        with open(path, 'r+b') as fd:
+            data = fd.read()
+            _, length = scan_chunks(data)
+            if length < len(data):
+                log.warning('Dropping {} bytes of an incomplete chunk at the end of {}'.format(
+                    len(data) - length, path))
+                fd.truncate(length)
+
+
+class MarketRecorder:
+    """ Records the market data received by
+        :class:`dexbot.worker.WorkerInfrastructure`
+
+        Records the blocks, the orders placed and filled in the markets of
+        the workers, the account updates, and every ``ticker_interval``
+        blocks a ticker snapshot of each market. Rows are timed by the
+        clock when received, the notifications carry no time.
+
+        Enabled by the ``recorder`` section of the config::
+
+            recorder:
+                path: /var/lib/dexbot/market_data
+                ticker_interval: 20
+                flush_interval: 60
+
+        :param str path: directory of the market data
+        :param int ticker_interval: blocks between two ticker snapshots
+        :param float flush_interval: seconds after which buffered rows are written
+        :param int chunk_rows: rows buffered per table before writing a chunk
+        :param list markets: market strings of the markets to record, all
+            the markets of the workers when None
+        :param int shard: index of the shard of the process, if sharded
+        :param clock: callable returning the current unix time
+    """
+
+    def __init__(self, path=RECORDER_DIR, ticker_interval=TICKER_INTERVAL, flush_interval=FLUSH_INTERVAL,
+                 chunk_rows=CHUNK_ROWS, markets=None, shard=None, clock=time.time):
+        self.writer = MarketDataWriter(path, chunk_rows, shard)
+        self.only_markets = None if markets is None else {market_key(market) for market in markets}
+        self.ticker_interval = ticker_interval
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        # Markets by the set of their asset symbols, oriented as the workers trade them
+        self.markets = {}
+        self.blocks = 0
+        self.last_flush = clock()
+
+    @classmethod
+    def from_config(cls, config):
+        """ Returns a recorder set up from the ``recorder`` section of the config
+        """
+        if not isinstance(config, dict):
+            config = {}
+        return cls(
+            path=config.get('path', RECORDER_DIR),
+            ticker_interval=int(config.get('ticker_interval', TICKER_INTERVAL)),
+            flush_interval=float(config.get('flush_interval', FLUSH_INTERVAL)),
+            chunk_rows=int(config.get('chunk_rows', CHUNK_ROWS)),
+            markets=config.get('markets'),
+            shard=config.get('shard')
+        )
+
+    def set_markets(self, markets):
+        """ Sets the markets to record
+
+            :param list markets: :class:`bitshares.market.Market` objects
+        """
+        recorded = {}
+        for market in markets:
+            quote, base = market['quote'], market['base']
+            key = frozenset((quote['symbol'], base['symbol']))
+            if self.only_markets is not None and key not in self.only_markets:
+                continue
+            recorded[key] = market
+            try:
+                self.writer.set_market(stream_name(quote['symbol'], base['symbol']), {
+                    'base': base['symbol'], 'quote': quote['symbol'],
+                    'base_precision': int(base['precision']), 'quote_precision': int(quote['precision'])
+                })
+            except OSError:
+                log.exception('Unable to save the description of the market {}'.format(market))
+        with self.lock:
+            self.markets = recorded
+
+    def stream(self, symbols):
+        """ Returns the market of a pair of asset symbols and its stream, or
+            None when it isn't recorded
+        """
+        market = self.markets.get(frozenset(symbols))
+        if market is None:
+            return None, None
+        return market, stream_name(market['quote']['symbol'], market['base']['symbol'])
+
+    def on_block(self, block_id, market_cache):
+        """ Records the block, and the tickers of the markets every
+            ``ticker_interval`` blocks
+
+            :param dexbot.market_cache.MarketCache market_cache: cache the
+                tickers are read through, shared with the workers
+        """
+        now = self.clock()
+        with self.lock:
+            markets = list(self.markets.values())
+            self.blocks += 1
+            snapshot = self.blocks % self.ticker_interval == 1 or self.ticker_interval == 1
+        block_num = market_cache.block_number(block_id)
+        for market in markets:
+            stream = stream_name(market['quote']['symbol'], market['base']['symbol'])
+            self.writer.append(stream, 'block', (now, block_num if block_num is not None else -1))
+            if snapshot:
+                try:
+                    self.record_ticker(stream, now, market_cache.ticker(market))
+                except Exception:
+                    log.exception('Unable to record the ticker of {}'.format(stream))
+
+        if now - self.last_flush >= self.flush_interval:
+            self.last_flush = now
+            self.writer.flush()
+
+    def record_ticker(self, stream, now, ticker):
+        def price(key):
+            value = ticker.get(key)
+            return float(value['price']) if value else 0.0
+
+        self.writer.append(stream, 'ticker', (
+            now, price('highestBid'), price('lowestAsk'), price('latest'),
+            float(ticker.get('baseVolume', 0)), float(ticker.get('quoteVolume', 0))
+        ))
+
+    def on_market(self, data):
+        """ Records an order placed or filled, as
+            :class:`bitshares.price.Order` or :class:`bitshares.price.FilledOrder`
+        """
+        if 'pays' in data:
+            table = 'trade'
+            order_id, account_id = data.get('order_id'), data.get('account_id')
+        elif 'for_sale' in data:
+            table = 'order'
+            order_id, account_id = data.get('id'), data.get('seller')
+        else:
+            return
+
+        base, quote = data['base'], data['quote']
+        market, stream = self.stream((base['symbol'], quote['symbol']))
+        if market is None:
+            return
+
+        price = float(data['price'])
+        if base['symbol'] == market['base']['symbol']:
+            # Pays, or sells, the base asset: buys the quote asset
+            side, amount = 1, float(quote['amount'])
+        else:
+            side, amount = -1, float(base['amount'])
+            price = 1 / price if price else 0.0
+        now = self.clock()
+        if table == 'trade':
+            # The fills are oriented the other way round, by what they receive
+            maker = int(data['is_maker']) if 'is_maker' in data else -1
+            self.writer.append(stream, table, (
+                now, price, amount, -side, maker, instance(order_id), instance(account_id)))
+        else:
+            self.writer.append(stream, table, (now, price, amount, side, instance(order_id), instance(account_id)))
+
+    def on_account(self, statistics):
+        """ Records an account update, the statistics object of the account
+        """
+        self.writer.append(ACCOUNTS_STREAM, 'account', (
+            self.clock(), instance(statistics.get('owner')),
+            int(statistics.get('total_ops', 0)), instance(statistics.get('most_recent_op'))
+        ))
+
+    def close(self):
+        self.writer.flush()
+
+    def stats(self):
+        return {'chunks': self.writer.chunks, 'bytes': self.writer.bytes, 'blocks': self.blocks}
+
+
+class MarketDataFile:
+    """ Memory-mapped reader of a market data file
+
+        Only the chunk headers are read when opening, the chunks of a table
+        are decompressed when it is read.
+
+        :param str path: the file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file can't be mapped
+            self.map = b''
+        self.chunks, self.length = scan_chunks(self.map)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.fd.close()
+
+    def tables(self):
+        return sorted({chunk[0] for chunk in self.chunks})
+
+    def rows(self, table):
+        return sum(chunk[1] for chunk in self.chunks if chunk[0] == table)
+
+    def read(self, table, start=None, end=None):
+        """ Returns the rows of a table, as an array per column
+
+            :param float start: earliest time of the rows, included
+            :param float end: latest time of the rows, excluded
+            :return: dict of numpy arrays by column name
+        """
+        columns = TABLES[table]
+        parts = {name: [] for name, _ in columns}
+        for name, rows, offset, size, raw_size, first, last in self.chunks:
+            if name != table:
+                continue
+            if (start is not None and last < start) or (end is not None and first >= end):
+                continue
+            raw = zlib.decompress(self.map[offset:offset + size])
+            position = 0
+            for column, dtype in columns:
+                array = numpy.frombuffer(raw, dtype=dtype, count=rows, offset=position)
+                parts[column].append(array)
+                position += array.nbytes
+
+        result = {
+            name: numpy.concatenate(parts[name]) if parts[name] else numpy.empty(0, dtype=dtype)
+            for name, dtype in columns
+        }
+        if start is not None or end is not None:
+            times = result['time']
+            keep = numpy.ones(len(times), dtype=bool)
+            if start is not None:
+                keep &= times >= start
+            if end is not None:
+                keep &= times < end
+            result = {name: array[keep] for name, array in result.items()}
+        return result
+
+
+class MarketData:
+    """ Reader of the market data recorded to a directory
+
+        :param str path: directory of the market data
+    """
+
+    def __init__(self, path=RECORDER_DIR):
+        self.path = path
+
+    def streams(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name for name in os.listdir(self.path) if os.path.isdir(os.path.join(self.path, name)))
+
+    def markets(self):
+        """ Returns the recorded markets, as market strings QUOTE:BASE
+        """
+        return [market.replace('_', ':', 1) for market in self.streams() if market != ACCOUNTS_STREAM]
+
+    def market(self, market):
+        """ Returns the description of a recorded market
+
+            :param str market: market string QUOTE:BASE
+        """
+        with open(os.path.join(self.path, self.stream(market), MARKET_FILE)) as fd:
+            return json.load(fd)
+
+    @staticmethod
+    def stream(market):
+        if market == ACCOUNTS_STREAM:
+            return market
+        quote, base = market.replace('/', ':').split(':')
+        return stream_name(quote, base)
+
+    def files(self, market):
+        """ Returns the days of the files of a market and their paths, by day
+        """
+        directory = os.path.join(self.path, self.stream(market))
+        if not os.path.isdir(directory):
+            return []
+        return sorted(
+            (name.split('.')[0], os.path.join(directory, name))
+            for name in os.listdir(directory) if name.endswith(FILE_SUFFIX)
+        )
+
+    def days(self, market):
+        return sorted({day for day, _ in self.files(market)})
+
+    def read(self, market, table, start=None, end=None):
+        """ Returns the rows of a table of a market, across the days
+
+            :param str market: market string QUOTE:BASE, or ``accounts``
+            :param str table: name of the table, see :data:`TABLES`
+            :param float start: earliest unix time of the rows, included
+            :param float end: latest unix time of the rows, excluded
+            :return: dict of numpy arrays by column name
+        """
+        parts = []
+        for day, path in self.files(market):
+            if start is not None and day < day_of(start):
+                continue
+            if end is not None and day > day_of(end):
+                continue
+            with MarketDataFile(path) as data:
+                parts.append(data.read(table, start, end))
+        result = {
+            name: numpy.concatenate([part[name] for part in parts]) if parts else numpy.empty(0, dtype=dtype)
+            for name, dtype in TABLES[table]
+        }
+        if len(parts) > 1:
+            # The files of the shards of a day are interleaved
+            order = numpy.argsort(result['time'], kind='stable')
+            result = {name: array[order] for name, array in result.items()}
+        return result
+
+    def events(self, market, start=None, end=None):
+        """ Returns the blocks, tickers and trades of a market as events of
+            a backtest feed, by time, see :class:`dexbot.backtest.feed.Feed`
+        """
+        events = []
+        blocks = self.read(market, 'block', start, end)
+        for time_ in blocks['time'].tolist():
+            events.append({'type': 'block', 'time': time_})
+        tickers = self.read(market, 'ticker', start, end)
+        for time_, bid, ask, latest in zip(*(tickers[name].tolist() for name in ('time', 'bid', 'ask', 'latest'))):
+            events.append({'type': 'ticker', 'time': time_, 'bid': bid, 'ask': ask, 'latest': latest})
+        trades = self.read(market, 'trade', start, end)
+        # A trade once, from the fill of its maker
+        keep = unique_trades(trades, blocks['time'])
+        trades = {name: array[keep] for name, array in trades.items()}
+        for time_, price, amount in zip(*(trades[name].tolist() for name in ('time', 'price', 'amount'))):
+            events.append({'type': 'trade', 'time': time_, 'price': price, 'amount': amount})
+        # Stable, so the events of a time keep the order above
+        events.sort(key=lambda event: event['time'])
+        return events
+
+    def feed(self, market, start=None, end=None):
+        """ Returns the recorded data of a market as a backtest feed
+        """
+        from dexbot.backtest.feed import Feed
+        return Feed(dict(self.market(market), type='market'), self.events(market, start, end))
@@ -0,0 +1,365 @@
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+
+import dexbot.errors as errors
+
+log = logging.getLogger(__name__)
+log_workers = logging.getLogger('dexbot.per_worker')
+
+# Seconds between two metrics reports of a shard
+METRICS_INTERVAL = 60
+
+# Delay before restarting a crashed shard, doubled on every crash in a row
+RESTART_DELAY = 5
+MAX_RESTART_DELAY = 300
+
+# Seconds given to the shards to stop their workers before they are killed
+SHUTDOWN_TIMEOUT = 30
+
+# Exit code of a shard without any worker able to run, see dexbot.cli
+NO_WORKERS_EXIT_CODE = 70
+
+
+def partition_workers(config, shards):
+    """ Splits the workers of the config among a number of shards
+
+        The workers of an account always go to the same shard, so that two
+        processes never sign transactions for the same account. Accounts
+        are spread so that the shards get about as many workers each.
+
+        :param dict config: dexbot config
+        :param int shards: maximum number of shards
+        :return: list of configs, one per shard holding at least one worker
+    """
+    accounts = {}
+    for worker_name, worker in sorted(config['workers'].items()):
+        accounts.setdefault(worker.get('account'), []).append(worker_name)
+
+    loads = [[] for _ in range(max(int(shards), 1))]
+    # Biggest accounts first, each one to the least loaded shard
+    for account in sorted(accounts, key=lambda a: (-len(accounts[a]), str(a))):
+        min(loads, key=len).extend(accounts[account])
+
+    configs = []
+    recorded = set()
+    for worker_names in loads:
+        if worker_names:
+            shard_config = dict(config)
+            shard_config['workers'] = {name: config['workers'][name] for name in worker_names}
+            if config.get('recorder'):
+                # Each market recorded by a single shard, to files of its own
+                markets = []
+                for name in worker_names:
+                    market = config['workers'][name].get('market')
+                    if market and market_key(market) not in recorded:
+                        recorded.add(market_key(market))
+                        markets.append(market)
+                recorder = config['recorder'] if isinstance(config['recorder'], dict) else {}
+                shard_config['recorder'] = dict(recorder, markets=markets, shard=len(configs))
+            configs.append(shard_config)
+    return configs
+
+
+def market_key(market):
+    return frozenset(market.replace('/', ':').split(':'))
+
+
+class ShardLogHandler(logging.handlers.QueueHandler):
+    """ Forwards the log records of a shard to the supervisor
+    """
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        # Callables don't cross process boundaries, send the value instead
+        is_disabled = getattr(record, 'is_disabled', None)
+        if callable(is_disabled):
+            record.is_disabled = bool(is_disabled())
+        return ('log', record)
+
+
+def run_shard(index, config, masterpassword, events, level, use_asyncio=False, commands=None):
+    """ Runs the workers of a shard, in a process of its own
+
+        :param int index: number of the shard
+        :param dict config: dexbot config holding the workers of the shard
+        :param str masterpassword: key of the unlocked wallet, or None
+        :param multiprocessing.Queue events: queue to the supervisor
+        :param int level: logging level of the dexbot loggers
+        :param bool use_asyncio: handle the events on an asyncio event loop,
+            see :class:`dexbot.async_worker.AsyncWorkerInfrastructure`
+        :param multiprocessing.Queue commands: queue from the supervisor,
+            with the configs to reload
+    """
+    from bitshares.instance import set_shared_bitshares_instance
+    from dexbot.node_pool import create_bitshares
+    if use_asyncio:
+        from dexbot.async_worker import AsyncWorkerInfrastructure as WorkerInfrastructure
+    else:
+        from dexbot.worker import WorkerInfrastructure
+
+    # Stopping the workers and reloading the config are left to the supervisor
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    except (ValueError, AttributeError):
+        pass
+
+    root = logging.getLogger()
+    root.handlers = [ShardLogHandler(events)]
+    logging.getLogger('dexbot').setLevel(level)
+    logging.getLogger('dexbot.orders_log').setLevel(logging.INFO)
+
+    bitshares = create_bitshares(config['node'])
+    if masterpassword:
+        bitshares.wallet.masterpassword = masterpassword
+    set_shared_bitshares_instance(bitshares)
+
+    worker = WorkerInfrastructure(config, bitshares_instance=bitshares)
+    signal.signal(signal.SIGTERM, lambda x, y: worker.do_next_tick(lambda: worker.stop(pause=True)))
+
+    def report_metrics():
+        while True:
+            time.sleep(METRICS_INTERVAL)
+            events.put(('metrics', index, worker.metrics()))
+
+    threading.Thread(target=report_metrics, daemon=True).start()
+
+    def handle_commands():
+        while True:
+            command, data = commands.get()
+            if command == 'reload':
+                worker.do_next_tick(lambda config=data: worker.reload_config(config))
+
+    if commands is not None:
+        threading.Thread(target=handle_commands, daemon=True).start()
+
+    try:
+        worker.run()
+    except errors.NoWorkersAvailable:
+        worker.shutdown()
+        sys.exit(NO_WORKERS_EXIT_CODE)
+
+
+class Shard:
+    """ Process running a part of the workers
+    """
+
+    def __init__(self, index, config):
+        self.index = index
+        self.config = config
+        self.process = None
+        # Queue of the commands to the process
+        self.commands = None
+        self.started = None
+        self.restart_at = None
+        self.restart_delay = RESTART_DELAY
+        # False once the shard exited for good
+        self.enabled = True
+
+
+class ShardSupervisor:
+    """ Runs the workers in several processes, so they don't share one GIL
+        and one node connection
+
+        The workers are partitioned by account, see :func:`partition_workers`.
+        Crashed shards are restarted after a growing delay. The log records
+        of the shards are handled by the loggers of the supervisor, and the
+        shards report the metrics of their workers to the
+        ``dexbot.per_worker`` logger every :data:`METRICS_INTERVAL` seconds.
+        A new config is applied by :meth:`reload_config`.
+
+        :param dict config: dexbot config
+        :param int shards: number of processes
+        :param str masterpassword: key of the unlocked wallet, passed on to the shards
+        :param bool use_asyncio: run the shards on the asyncio runtime
+    """
+
+    def __init__(self, config, shards, masterpassword=None, use_asyncio=False):
+        self.config = config
+        self.use_asyncio = use_asyncio
+        # Spawned rather than forked, a fork would not carry the threads of
+        # the modules, e.g. the database worker
+        self.context = multiprocessing.get_context('spawn')
+        self.events = self.context.Queue()
+        self.masterpassword = masterpassword
+        self.shards = [Shard(index, shard_config)
+                       for index, shard_config in enumerate(partition_workers(config, shards))]
+        self.stopping = False
+        self.jobs = []
+
+    def do_next_tick(self, job):
+        """ Add a callable to be run by the supervisor loop, safe to call
+            from a signal handler
+        """
+        self.jobs.append(job)
+
+    def start_shard(self, shard):
+        shard.commands = self.context.Queue()
+        shard.process = self.context.Process(
+            target=run_shard,
+            name='dexbot-shard-{}'.format(shard.index),
+            args=(shard.index, shard.config, self.masterpassword, self.events,
+                  logging.getLogger('dexbot').getEffectiveLevel(), self.use_asyncio, shard.commands)
+        )
+        shard.process.start()
+        shard.started = time.time()
+        shard.restart_at = None
+        log.info('Shard {} started with workers: {}'.format(
+            shard.index, ', '.join(shard.config['workers'])))
+
+    def check_shard(self, shard):
+        """ Restarts the shard once it has been down long enough
+        """
+        if not shard.enabled:
+            return
+        if shard.restart_at is not None:
+            if time.time() >= shard.restart_at:
+                self.start_shard(shard)
+            return
+        if shard.process.is_alive():
+            return
+
+        exitcode = shard.process.exitcode
+        if exitcode == 0:
+            log.info('Shard {} stopped'.format(shard.index))
+            shard.enabled = False
+        elif exitcode == NO_WORKERS_EXIT_CODE:
+            log.error('Shard {} has no worker able to run'.format(shard.index))
+            shard.enabled = False
+        else:
+            if time.time() - shard.started > MAX_RESTART_DELAY:
+                # It ran fine for a while, this is a new series of crashes
+                shard.restart_delay = RESTART_DELAY
+            log.error('Shard {} exited with code {}, restarting it in {} seconds'.format(
+                shard.index, exitcode, shard.restart_delay))
+            shard.restart_at = time.time() + shard.restart_delay
+            shard.restart_delay = min(shard.restart_delay * 2, MAX_RESTART_DELAY)
+
+    def handle_event(self, event):
+        kind = event[0]
+        if kind == 'log':
+            record = event[1]
+            if isinstance(getattr(record, 'is_disabled', None), bool):
+                value = record.is_disabled
+                record.is_disabled = lambda: value
+            logging.getLogger(record.name).handle(record)
+        elif kind == 'metrics':
+            self.log_metrics(event[1], event[2])
+
+    def log_metrics(self, index, metrics):
+        for worker_name, worker_metrics in metrics['workers'].items():
+            worker = self.config['workers'].get(worker_name, {})
+            log_workers.info(
+                'Shard {}: {handled} events handled, {depth} waiting, {dropped} dropped, '
+                '{latency_avg:.3f}s average latency'.format(index, **worker_metrics),
+                extra={'worker_name': worker_name, 'account': worker.get('account', 'unknown'),
+                       'market': worker.get('market', 'unknown'), 'is_disabled': (lambda: False)}
+            )
+
+    def reload_config(self, config):
+        """ Applies a new config to the shards, each one reloading the
+            workers of its part, see
+            :meth:`dexbot.worker.WorkerInfrastructure.reload_config`
+
+            The accounts stay in their shard, so that two processes never
+            sign transactions for the same account, the workers of new
+            accounts go to the shards with the fewest workers. A shard left
+            without workers is stopped, a stopped one given workers is
+            started again.
+
+            :param dict config: the new dexbot config
+        """
+        if not config.get('workers'):
+            log.critical("The new config has no workers, keeping the current one")
+            return
+        if not self.shards:
+            return
+
+        account_shards = {}
+        for shard in self.shards:
+            for worker in shard.config['workers'].values():
+                account_shards[worker.get('account')] = shard
+        parts = {shard.index: {} for shard in self.shards}
+        new_accounts = {}
+        for worker_name, worker in sorted(config['workers'].items()):
+            shard = account_shards.get(worker.get('account'))
+            if shard is not None:
+                parts[shard.index][worker_name] = worker
+            else:
+                new_accounts.setdefault(worker.get('account'), {})[worker_name] = worker
+        for account in sorted(new_accounts, key=lambda a: (-len(new_accounts[a]), str(a))):
+            min(parts.values(), key=len).update(new_accounts[account])
+
+        self.config = config
+        for shard in self.shards:
+            shard_config = dict(config)
+            shard_config['workers'] = parts[shard.index]
+            if 'recorder' in shard.config:
+                shard_config['recorder'] = shard.config['recorder']
+            shard.config = shard_config
+            running = shard.process is not None and shard.process.is_alive()
+            if not shard_config['workers']:
+                if running:
+                    log.info('Shard {} has no workers left, stopping it'.format(shard.index))
+                    shard.process.terminate()
+                shard.enabled = False
+                shard.restart_at = None
+            elif running:
+                shard.commands.put(('reload', shard_config))
+            elif not shard.enabled:
+                shard.enabled = True
+                shard.restart_delay = RESTART_DELAY
+                shard.restart_at = time.time()
+            # A shard waiting for its restart starts with the new config
+
+    def run(self):
+        if not self.shards:
+            raise errors.NoWorkersAvailable()
+        for shard in self.shards:
+            self.start_shard(shard)
+
+        while not self.stopping and any(shard.enabled for shard in self.shards):
+            try:
+                self.handle_event(self.events.get(timeout=1))
+            except queue.Empty:
+                pass
+            if self.jobs:
+                jobs, self.jobs = self.jobs, []
+                for job in jobs:
+                    job()
+            for shard in self.shards:
+                self.check_shard(shard)
+
+        self.shutdown()
+
+    def stop(self):
+        """ Stops the shards, safe to call from a signal handler
+        """
+        self.stopping = True
+
+    def shutdown(self):
+        processes = [shard.process for shard in self.shards
+                     if shard.process is not None and shard.process.is_alive()]
+        for process in processes:
+            process.terminate()
+
+        deadline = time.time() + SHUTDOWN_TIMEOUT
+        while any(process.is_alive() for process in processes) and time.time() < deadline:
+            # Keep forwarding the logs of the workers being stopped
+            try:
+                self.handle_event(self.events.get(timeout=0.5))
+            except queue.Empty:
+                pass
+
+        for process in processes:
+            if process.is_alive():
+                log.warning('Shard process {} did not stop, killing it'.format(process.name))
+                os.kill(process.pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+            process.join()
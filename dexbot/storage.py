@@ -2,29 +2,61 @@ import os
 import json
 import threading
 import queue
-import uuid
 import time
 import datetime
 import re
 import logging
+import atexit
+import sqlite3
+import concurrent.futures
+from urllib.request import pathname2url
 from appdirs import user_data_dir
 
 from . import helper
 from dexbot import APP_NAME, AUTHOR
 
 import sqlalchemy
-from sqlalchemy import create_engine, Table, Column, String, Integer, MetaData, DateTime, Float
+from sqlalchemy import create_engine, event, Table, Column, String, Integer, MetaData, DateTime, Float, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+log = logging.getLogger(__name__)
 
 Base = declarative_base()
 
 # For dexbot.sqlite file
 storageDatabase = "dexbot.sqlite"
 
+# Write-behind defaults: writes are committed in batches of at most
+# WRITE_BATCH_SIZE operations, and no later than WRITE_BATCH_LATENCY seconds
+# after the first write of the batch. A batch size of 1 commits every write.
+WRITE_BATCH_SIZE = 100
+WRITE_BATCH_LATENCY = 0.05
+
+# Version of the database schema, stored in the sqlite user_version pragma
+SCHEMA_VERSION = 1
+
+# INSERT ... ON CONFLICT DO UPDATE is available since SQLite 3.24
+UPSERT_SUPPORTED = sqlite3.sqlite_version_info >= (3, 24, 0)
+
+# Pragmas applied to every connection to the database, can be overridden by
+# the 'database' section of the config file. In WAL mode readers on other
+# connections don't block the writer thread, nor does it block them.
+DATABASE_DEFAULTS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -8192,  # negative means KiB, so 8 MiB of page cache
+    'mmap_size': 64 * 1024 * 1024
+}
+database_config = dict(DATABASE_DEFAULTS)
+
 
 class Config(Base):
     __tablename__ = 'config'
+    __table_args__ = (
+        Index('ix_config_category_key', 'category', 'key', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     category = Column(String)
@@ -39,6 +71,9 @@ class Config(Base):
 
 class Journal(Base):
     __tablename__ = 'journal'
+    __table_args__ = (
+        Index('ix_journal_category_stamp', 'category', 'stamp'),
+    )
     id = Column(Integer, primary_key=True)
     category = Column(String)
     key = Column(String)
@@ -48,6 +83,9 @@ class Journal(Base):
 
 class Log(Base):
     __tablename__ = 'log'
+    __table_args__ = (
+        Index('ix_log_category_stamp', 'category', 'stamp'),
+    )
     id = Column(Integer, primary_key=True)
     category = Column(String)
     severity = Column(Integer)
@@ -57,6 +95,9 @@ class Log(Base):
 
 class Orders(Base):
     __tablename__ = 'orders'
+    __table_args__ = (
+        Index('ix_orders_worker_order_id', 'worker', 'order_id', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     worker = Column(String)
@@ -69,9 +110,269 @@ class Orders(Base):
         self.order = order
 
 
+def pragma_settings(config):
+    """ Validates the pragmas of the 'database' config section
+
+        :param dict config: pragma names and values
+        :return: dict of the known pragmas, unknown keys are ignored
+    """
+    settings = {}
+    for name, value in config.items():
+        if name not in DATABASE_DEFAULTS:
+            log.warning("Unknown database setting: {}".format(name))
+        elif isinstance(DATABASE_DEFAULTS[name], int):
+            settings[name] = int(value)
+        elif re.match(r'^\w+$', str(value)):
+            settings[name] = str(value).lower()
+        else:
+            raise ValueError("Invalid value for database setting {}: {}".format(name, value))
+    return settings
+
+
+def configure(config):
+    """ Applies the 'database' section of the config file
+
+        New connections are opened with the given pragmas, and the
+        connection of the database thread is updated at once.
+    """
+    settings = pragma_settings(config or {})
+    database_config.update(settings)
+    if settings:
+        db_worker.configure(settings)
+
+
+def apply_pragmas(dbapi_connection, settings, read_only=False):
+    cursor = dbapi_connection.cursor()
+    for name, value in settings.items():
+        # The journal mode is persistent and can only be changed by a writer
+        if read_only and name == 'journal_mode':
+            continue
+        cursor.execute('PRAGMA {} = {}'.format(name, value))
+    cursor.close()
+
+
+def database_engine(path=None, read_only=False):
+    """ Creates an engine for the sqlite database, with the configured pragmas
+        applied to each of its connections
+
+        :param str path: sqlite database file, defaults to ``dexbot.sqlite``
+            in the user data directory
+        :param bool read_only: open the database in read-only mode, each
+            session gets a connection of its own
+    """
+    path = path or sqlDataBaseFile
+    if read_only:
+        engine = create_engine(
+            'sqlite:///file:{}?mode=ro&uri=true'.format(pathname2url(path)), echo=False)
+    else:
+        # The writer keeps a single connection, so the page cache survives commits
+        engine = create_engine(
+            'sqlite:///%s' % path, echo=False, poolclass=StaticPool,
+            connect_args={'check_same_thread': False})
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, database_config, read_only)
+        if not read_only:
+            # pysqlite opens and commits transactions on its own, which
+            # breaks savepoints, they are begun by the 'begin' event instead
+            dbapi_connection.isolation_level = None
+
+    if not read_only:
+        @event.listens_for(engine, 'begin')
+        def on_begin(connection):
+            connection.execute('BEGIN')
+
+    return engine
+
+
+def migrate(engine):
+    """ Brings a database created by an older version up to the current schema
+
+        ``create_all()`` only creates missing tables, so the indexes of the
+        tables which already exist are added here.
+    """
+    with engine.begin() as conn:
+        version = conn.execute(text('PRAGMA user_version')).scalar()
+        if version >= SCHEMA_VERSION:
+            return
+
+        log.info("Migrating database schema from version {} to {}".format(version, SCHEMA_VERSION))
+        if version < 1:
+            # Unique indexes can't be created over duplicate rows. The former
+            # lookups read and updated the first row they found, the one
+            # with the lowest id, so that is the one kept
+            conn.execute(text(
+                'DELETE FROM config WHERE id NOT IN (SELECT MIN(id) FROM config GROUP BY category, key)'))
+            conn.execute(text(
+                'DELETE FROM orders WHERE id NOT IN (SELECT MIN(id) FROM orders GROUP BY worker, order_id)'))
+            inspector = sqlalchemy.inspect(conn)
+            for table in Base.metadata.sorted_tables:
+                existing = {index['name'] for index in inspector.get_indexes(table.name)}
+                for index in table.indexes:
+                    if index.name not in existing:
+                        index.create(conn)
+
+        conn.execute(text('PRAGMA user_version = {:d}'.format(SCHEMA_VERSION)))
+
+
+def parse_start(start):
+    """ Turns a period like "4d" or "2w" into the datetime it started at
+    """
+    if isinstance(start, str):
+        m = re.match("(\\d+)([dw])", start)
+        if m:
+            n = int(m.group(1))
+            start = datetime.datetime.now()
+            if m.group(2) == 'w':
+                n *= 7
+            start -= datetime.timedelta(days=n)
+    return start
+
+
+def query_journal(session, category, start, end_=None):
+    """Query this bots journal
+    start: datetime of start time
+    end_: datetime of end (None means up to now)
+    """
+    r = session.query(Journal).filter(Journal.category == category)
+    start = parse_start(start)
+    if end_:
+        r = r.filter(Journal.stamp > start, Journal.stamp < end_)
+    else:
+        r = r.filter(Journal.stamp > start)
+    return r.all()
+
+
+def query_log(session, category, start, end_=None):
+    """Query this bots log
+    start: datetime of start time
+    end_: datetime of end (None means up to now)
+    """
+    r = session.query(Log).filter(Log.category == category)
+    start = parse_start(start)
+    if end_:
+        r = r.filter(Log.stamp > start, Log.stamp < end_)
+    else:
+        r = r.filter(Log.stamp > start)
+    r = r.order_by(Log.stamp)
+    return r.all()
+
+
+class DatabaseReader:
+    """ Read-only access to the database for consumers such as the graphs
+        and the reporters
+
+        Every query runs on a read-only connection of its own, in the
+        calling thread, so it never blocks the writes of the database
+        thread. The writes still queued in the database thread (see
+        :data:`WRITE_BATCH_LATENCY`) are committed first, so the callers
+        see their own writes.
+
+        :param str path: sqlite database file, defaults to ``dexbot.sqlite``
+            in the user data directory
+        :param LazyDatabaseWorker worker: the worker writing to the database
+    """
+
+    def __init__(self, path=None, worker=None):
+        self.path = path
+        self.worker = worker
+        self.lock = threading.Lock()
+        self.Session = None
+
+    def session(self):
+        with self.lock:
+            if self.Session is None:
+                self.Session = sessionmaker(bind=database_engine(self.path, read_only=True))
+        return self.Session()
+
+    def query(self, func, *args):
+        if self.worker is not None:
+            # Started if need be, a new database is only created by its worker
+            self.worker.get().flush()
+        session = self.session()
+        try:
+            # Closing the session detaches the returned rows
+            return func(session, *args)
+        finally:
+            session.close()
+
+    def query_journal(self, category, start, end_=None):
+        return self.query(query_journal, category, start, end_)
+
+    def query_log(self, category, start, end_=None):
+        return self.query(query_log, category, start, end_)
+
+
+class StorageCache:
+    """ Write-through cache of the config table, per category
+
+        Values are kept JSON encoded, exactly as they are stored in the
+        database, so callers always get their own copy. A category is
+        "complete" when all of its keys were loaded in bulk, then missing
+        keys don't need a database lookup either.
+
+        .. note:: The cache is coherent with the writes of this process
+                  only, other processes writing to the same database
+                  aren't seen.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # category -> {key: JSON encoded value, or None when the key doesn't exist}
+        self.categories = {}
+        self.complete = set()
+        # Bumped on every write to the category, guards against caching
+        # stale database reads
+        self.generations = {}
+
+    def generation(self, category):
+        with self.lock:
+            return self.generations.get(category, 0)
+
+    def lookup(self, category, key):
+        """ Returns a (hit, encoded value) tuple
+        """
+        with self.lock:
+            values = self.categories.get(category, {})
+            if key in values:
+                return True, values[key]
+            if category in self.complete:
+                return True, None
+            return False, None
+
+    def fill(self, category, key, value, generation):
+        """ Caches a value read from the database, unless a write happened
+            since the read was issued
+        """
+        with self.lock:
+            if generation == self.generations.get(category, 0):
+                self.categories.setdefault(category, {})[key] = value
+
+    def fill_category(self, category, items, generation):
+        with self.lock:
+            if generation == self.generations.get(category, 0):
+                self.categories[category] = dict(items)
+                self.complete.add(category)
+
+    def set(self, category, key, value):
+        with self.lock:
+            self.generations[category] = self.generations.get(category, 0) + 1
+            self.categories.setdefault(category, {})[key] = value
+
+    def clear(self, category):
+        with self.lock:
+            self.generations[category] = self.generations.get(category, 0) + 1
+            self.categories[category] = {}
+            self.complete.add(category)
+
+
 class Storage(dict):
     """ Storage class
 
+        Reads are served from an in-memory cache shared by all Storage
+        instances of the process, see :class:`StorageCache`.
+
         :param string category: The category to distinguish
                                 different storage namespaces
     """
@@ -80,31 +381,60 @@ class Storage(dict):
         self.category = category
 
     def __setitem__(self, key, value):
-        db_worker.set_item(self.category, key, value)
+        with storage_cache.lock:
+            storage_cache.set(self.category, key, json.dumps(value))
+            db_worker.set_item(self.category, key, value)
 
     def __getitem__(self, key):
-        return db_worker.get_item(self.category, key)
+        value = self._get_encoded(key)
+        if value is None:
+            return None
+        return json.loads(value)
 
     def __delitem__(self, key):
-        db_worker.del_item(self.category, key)
+        with storage_cache.lock:
+            storage_cache.set(self.category, key, None)
+            db_worker.del_item(self.category, key)
 
     def __contains__(self, key):
-        return db_worker.contains(self.category, key)
+        return self._get_encoded(key) is not None
+
+    def _get_encoded(self, key):
+        hit, value = storage_cache.lookup(self.category, key)
+        if hit:
+            return value
+        generation = storage_cache.generation(self.category)
+        value = db_worker.get_raw_item(self.category, key)
+        storage_cache.fill(self.category, key, value, generation)
+        return value
+
+    def load(self):
+        """ Load all the keys of the category into the cache at once
+        """
+        generation = storage_cache.generation(self.category)
+        items = db_worker.get_items(self.category)
+        storage_cache.fill_category(self.category, items, generation)
 
     def items(self):
+        with storage_cache.lock:
+            if self.category in storage_cache.complete:
+                values = storage_cache.categories[self.category]
+                return [(key, value) for key, value in values.items() if value is not None]
         return db_worker.get_items(self.category)
 
     def clear(self):
-        db_worker.clear(self.category)
+        with storage_cache.lock:
+            storage_cache.clear(self.category)
+            db_worker.clear(self.category)
 
     def save_journal(self, amounts):
         db_worker.execute_noreturn(db_worker.save_journal, self.category, amounts)
 
     def query_journal(self, start, end_=None):
-        return db_worker.execute(db_worker.query_journal, self.category, start, end_)
+        return db_reader.query_journal(self.category, start, end_)
 
     def query_log(self, start, end_=None):
-        return db_worker.execute(db_worker.query_log, self.category, start, end_)
+        return db_reader.query_log(self.category, start, end_)
 
     def save_order(self, order):
         """ Save the order to the database
@@ -112,6 +442,11 @@ class Storage(dict):
         order_id = order['id']
         db_worker.save_order(self.category, order_id, order)
 
+    def save_orders(self, orders):
+        """ Save the orders to the database, as a single write
+        """
+        db_worker.save_orders(self.category, [(order['id'], order) for order in orders])
+
     def remove_order(self, order):
         """ Removes an order from the database
         """
@@ -133,56 +468,157 @@ class Storage(dict):
     @staticmethod
     def clear_worker_data(worker):
         db_worker.clear_orders(worker)
-        db_worker.clear(worker)
+        with storage_cache.lock:
+            storage_cache.clear(worker)
+            db_worker.clear(worker)
 
 
 class DatabaseWorker(threading.Thread):
     """ Thread safe database worker
+
+        Writes are queued and committed in batches (write-behind), reads
+        act as a flush barrier so they always see the previously queued
+        writes. Every read gets its own future, so concurrent readers only
+        wake up for their own result.
+
+        :param int batch_size: maximum number of writes per commit
+        :param float batch_latency: maximum time in seconds a write may wait
+            for the batch to be committed
+        :param str path: sqlite database file, defaults to ``dexbot.sqlite``
+            in the user data directory
     """
 
-    def __init__(self):
+    def __init__(self, batch_size=WRITE_BATCH_SIZE, batch_latency=WRITE_BATCH_LATENCY, path=None):
         super().__init__()
 
         # Obtain engine and session
-        engine = create_engine('sqlite:///%s' % sqlDataBaseFile, echo=False)
+        engine = database_engine(path)
         Session = sessionmaker(bind=engine)
         self.session = Session()
         Base.metadata.create_all(engine)
+        migrate(engine)
         self.session.commit()
 
+        self.batch_size = max(int(batch_size), 1)
+        self.batch_latency = batch_latency
         self.task_queue = queue.Queue()
-        self.results = {}
-        self.lock = threading.Lock()
-        self.event = threading.Event()
         self.daemon = True
         self.start()
 
     def run(self):
-        for func, args, token in iter(self.task_queue.get, None):
-            if token is not None:
-                args = args + (token,)
-            func(*args)
-
-    def _get_result(self, token):
+        pending = 0
+        deadline = 0
         while True:
-            with self.lock:
-                if token in self.results:
-                    return_value = self.results[token]
-                    del self.results[token]
-                    return return_value
+            try:
+                if pending:
+                    # Wait for more writes only until the latency cap is reached
+                    task = self.task_queue.get(timeout=max(deadline - time.time(), 0))
                 else:
-                    self.event.clear()
-            self.event.wait()
+                    task = self.task_queue.get()
+            except queue.Empty:
+                pending = self._commit()
+                continue
+
+            if task is None:
+                break
+
+            func, args, future = task
+            if future is None:
+                if not pending:
+                    deadline = time.time() + self.batch_latency
+                pending = self._run_write(func, args, pending)
+                if pending >= self.batch_size:
+                    pending = self._commit()
+            else:
+                # Flush barrier: commit pending writes before any read
+                if pending:
+                    pending = self._commit()
+                self._run_read(func, args, future)
+
+        if pending:
+            self._commit()
+        self.session.close()
+
+    def stop(self):
+        """ Commits the pending writes and stops the database thread
+        """
+        self.task_queue.put(None)
+        self.join()
 
-    def _set_result(self, token, result):
-        with self.lock:
-            self.results[token] = result
-            self.event.set()
+    def _run_write(self, func, args, pending):
+        """ Runs a write task, returns the number of writes pending commit
 
-    def execute(self, func, *args):
-        token = str(uuid.uuid4)
-        self.task_queue.put((func, args, token))
-        return self._get_result(token)
+            Each write runs in a savepoint of the batch, so that a failing
+            one is rolled back alone.
+        """
+        try:
+            with self.session.begin_nested():
+                func(*args)
+            return pending + 1
+        except Exception:
+            log.exception("Database write failed")
+            return pending
+
+    def _run_read(self, func, args, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = func(*args)
+        except Exception as e:
+            log.exception("Database read failed")
+            self.session.rollback()
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def _commit(self):
+        """ Commits the pending writes, returns the number of writes still pending
+        """
+        try:
+            self.session.commit()
+        except Exception:
+            log.exception("Database commit failed")
+            self.session.rollback()
+        return 0
+
+    def flush(self):
+        """ Blocks until all the writes queued so far are committed
+        """
+        if self.is_alive():
+            self.execute(self._flush)
+
+    def _flush(self):
+        pass
+
+    def configure(self, settings):
+        """ Applies the pragmas to the connection of the database thread
+        """
+        if self.is_alive():
+            self.execute(self._configure, settings)
+
+    def _configure(self, settings):
+        # Pending writes were committed by the read barrier, so no transaction
+        # is open, the pragmas are applied outside of one
+        connection = self.session.get_bind().raw_connection()
+        try:
+            apply_pragmas(connection.connection, settings)
+        finally:
+            connection.close()
+
+    def submit(self, func, *args):
+        """ Queue a read, returns a :class:`concurrent.futures.Future` of its result
+        """
+        future = concurrent.futures.Future()
+        self.task_queue.put((func, args, future))
+        return future
+
+    def execute(self, func, *args, timeout=None):
+        """ Run a read on the database thread and wait for its result
+
+            :param float timeout: seconds to wait for the result, raises
+                :class:`concurrent.futures.TimeoutError` when exceeded
+        """
+        return self.submit(func, *args).result(timeout)
 
     def execute_noreturn(self, func, *args):
         self.task_queue.put((func, args, None))
@@ -192,6 +628,14 @@ class DatabaseWorker(threading.Thread):
 
     def _set_item(self, category, key, value):
         value = json.dumps(value)
+        if UPSERT_SUPPORTED:
+            self.session.execute(
+                text('INSERT INTO config (category, key, value) VALUES (:category, :key, :value) '
+                     'ON CONFLICT (category, key) DO UPDATE SET value = excluded.value'),
+                {'category': category, 'key': key, 'value': value}
+            )
+            return
+
         e = self.session.query(Config).filter_by(
             category=category,
             key=key
@@ -201,21 +645,32 @@ class DatabaseWorker(threading.Thread):
         else:
             e = Config(category, key, value)
             self.session.add(e)
-        self.session.commit()
 
     def get_item(self, category, key):
         return self.execute(self._get_item, category, key)
 
-    def _get_item(self, category, key, token):
+    def _get_item(self, category, key):
         e = self.session.query(Config).filter_by(
             category=category,
             key=key
         ).first()
         if not e:
-            result = None
-        else:
-            result = json.loads(e.value)
-        self._set_result(token, result)
+            return None
+        return json.loads(e.value)
+
+    def get_raw_item(self, category, key):
+        return self.execute(self._get_raw_item, category, key)
+
+    def _get_raw_item(self, category, key):
+        """ Returns the JSON encoded value, None if the key doesn't exist
+        """
+        e = self.session.query(Config).filter_by(
+            category=category,
+            key=key
+        ).first()
+        if not e:
+            return None
+        return e.value
 
     def del_item(self, category, key):
         self.execute_noreturn(self._del_item, category, key)
@@ -225,111 +680,93 @@ class DatabaseWorker(threading.Thread):
             category=category,
             key=key
         ).first()
-        self.session.delete(e)
-        self.session.commit()
+        if e:
+            self.session.delete(e)
 
     def contains(self, category, key):
         return self.execute(self._contains, category, key)
 
-    def _contains(self, category, key, token):
+    def _contains(self, category, key):
         e = self.session.query(Config).filter_by(
             category=category,
             key=key
         ).first()
-        self._set_result(token, bool(e))
+        return bool(e)
 
     def get_items(self, category):
         return self.execute(self._get_items, category)
 
-    def _get_items(self, category, token):
+    def _get_items(self, category):
         es = self.session.query(Config).filter_by(
             category=category
         ).all()
-        result = [(e.key, e.value) for e in es]
-        self._set_result(token, result)
+        return [(e.key, e.value) for e in es]
 
     def clear(self, category):
         self.execute_noreturn(self._clear, category)
 
     def _clear(self, category):
-        rows = self.session.query(Config).filter_by(
+        self.session.query(Config).filter_by(
             category=category
-        )
-        for row in rows:
-            self.session.delete(row)
-            self.session.commit()
+        ).delete(synchronize_session=False)
 
-    def save_journal(self, category, amounts, token=None):
+    def save_journal(self, category, amounts):
         now_t = datetime.datetime.now()
         for key, amount in amounts:
             e = Journal(key=key, category=category, amount=amount, stamp=now_t)
             self.session.add(e)
-        self.session.commit()
 
-    def query_journal(self, category, start, end_, token):
-        """Query this bots journal
-        start: datetime of start time
-        end_: datetime of end (None means up to now)
-        """
-        r = self.session.query(Journal).filter(Journal.category == category)
-        if isinstance(start, str):
-            m = re.match("(\\d+)([dw])", start)
-            if m:
-                n = int(m.group(1))
-                start = datetime.datetime.now()
-                if m.group(2) == 'w':
-                    n *= 7
-                start -= datetime.timedelta(days=n)
-        if end_:
-            r = r.filter(Journal.stamp > start, Journal.stamp < end_)
-        else:
-            r = r.filter(Journal.stamp > start)
-        self.set_result(token, r.all())
+    def query_journal(self, category, start, end_):
+        return self._detach(query_journal(self.session, category, start, end_))
 
-    def save_log(self, category, severity, message, created, token=None):
+    def save_log(self, category, severity, message, created):
         e = Log(
             category=category,
             severity=severity,
             message=message,
             stamp=created)
         self.session.add(e)
-        self.session.commit()
 
-    def query_log(self, category, start, end_, token):
-        """Query this bots log
-        start: datetime of start time
-        end_: datetime of end (None means up to now)
+    def query_log(self, category, start, end_):
+        return self._detach(query_log(self.session, category, start, end_))
+
+    def _detach(self, rows):
+        """ Detach the rows from the session, so they can be used outside of
+            the database thread after the session expires them on commit
         """
-        r = self.session.query(Log).filter(Log.category == category)
-        if isinstance(start, str):
-            m = re.match("(\\d+)([dw])", start)
-            if m:
-                n = int(m.group(1))
-                start = datetime.datetime.now()
-                if m.group(2) == 'w':
-                    n *= 7
-                start -= datetime.timedelta(days=n)
-        if end_:
-            r = r.filter(Log.stamp > start, Log.stamp < end_)
-        else:
-            r = r.filter(Log.stamp > start)
-        r = r.order_by(Log.stamp)
-        self.set_result(token, r.all())
+        for row in rows:
+            self.session.expunge(row)
+        return rows
 
     def save_order(self, worker, order_id, order):
         self.execute_noreturn(self._save_order, worker, order_id, order)
 
     def _save_order(self, worker, order_id, order):
         value = json.dumps(order)
+        if UPSERT_SUPPORTED:
+            self.session.execute(
+                text('INSERT INTO orders (worker, order_id, "order") VALUES (:worker, :order_id, :order) '
+                     'ON CONFLICT (worker, order_id) DO UPDATE SET "order" = excluded."order"'),
+                {'worker': worker, 'order_id': order_id, 'order': value}
+            )
+            return
+
         e = self.session.query(Orders).filter_by(
+            worker=worker,
             order_id=order_id
         ).first()
         if e:
-            e.value = value
+            e.order = value
         else:
             e = Orders(worker, order_id, value)
             self.session.add(e)
-        self.session.commit()
+
+    def save_orders(self, worker, orders):
+        self.execute_noreturn(self._save_orders, worker, orders)
+
+    def _save_orders(self, worker, orders):
+        for order_id, order in orders:
+            self._save_order(worker, order_id, order)
 
     def remove_order(self, worker, order_id):
         self.execute_noreturn(self._remove_order, worker, order_id)
@@ -339,34 +776,76 @@ class DatabaseWorker(threading.Thread):
             worker=worker,
             order_id=order_id
         ).first()
-        self.session.delete(e)
-        self.session.commit()
+        if e:
+            self.session.delete(e)
 
     def clear_orders(self, worker):
         self.execute_noreturn(self._clear_orders, worker)
 
     def _clear_orders(self, worker):
-        rows = self.session.query(Orders).filter_by(
+        self.session.query(Orders).filter_by(
             worker=worker
-        )
-        for row in rows:
-            self.session.delete(row)
-            self.session.commit()
+        ).delete(synchronize_session=False)
 
     def fetch_orders(self, category):
         return self.execute(self._fetch_orders, category)
 
-    def _fetch_orders(self, worker, token):
+    def _fetch_orders(self, worker):
         results = self.session.query(Orders).filter_by(
             worker=worker,
         ).all()
         if not results:
-            result = None
-        else:
-            result = {}
-            for row in results:
-                result[row.order_id] = json.loads(row.order)
-        self._set_result(token, result)
+            return None
+        result = {}
+        for row in results:
+            result[row.order_id] = json.loads(row.order)
+        return result
+
+
+class LazyDatabaseWorker:
+    """ Stands in for the :class:`DatabaseWorker` of the process, which is
+        only started, and the schema only created or migrated, on first use
+
+        Importing the module thus neither opens the database nor starts a
+        thread, e.g. for the command line tools not touching the storage.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._args = args
+        self._kwargs = kwargs
+        self._worker = None
+        self._lock = threading.Lock()
+
+    @property
+    def started(self):
+        return self._worker is not None
+
+    def get(self):
+        """ Returns the database worker, starting it if needed
+        """
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = DatabaseWorker(*self._args, **self._kwargs)
+        return self._worker
+
+    def configure(self, settings):
+        # A worker started later opens its connection with the new settings
+        if self.started:
+            self._worker.configure(settings)
+
+    def flush(self):
+        if self.started:
+            self._worker.flush()
+
+    def stop(self):
+        if self.started:
+            self._worker.stop()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
 
 
 MAP_LEVELS = {
@@ -410,4 +889,34 @@ sqlDataBaseFile = os.path.join(data_dir, storageDatabase)
 # Create directory for sqlite file
 helper.mkdir(data_dir)
 
-db_worker = DatabaseWorker()
+db_worker = LazyDatabaseWorker()
+db_reader = DatabaseReader(worker=db_worker)
+storage_cache = StorageCache()
+
+
+def flush_database():
+    """ Commits the writes queued to the database in use
+    """
+    db_worker.flush()
+
+
+# Don't lose the writes of the last batch on exit
+atexit.register(flush_database)
+
+
+def use_database(path=None):
+    """ Points the storage of the process to another database file, e.g.
+        to keep the data of backtests apart from the one of the workers
+
+        The writes queued so far are committed to the current database
+        first. The database thread of the new one starts on first use.
+
+        :param str path: sqlite database file, None for the default one
+        :return: the database worker of the new database
+    """
+    global db_worker, db_reader, storage_cache
+    db_worker.flush()
+    db_worker = LazyDatabaseWorker(path=path)
+    db_reader = DatabaseReader(path, db_worker)
+    storage_cache = StorageCache()
+    return db_worker
@@ -1,9 +1,8 @@
-import math
-from datetime import datetime
 from datetime import timedelta
 
 from bitshares.amount import Amount
 
+from dexbot import ladder
 from dexbot.basestrategy import BaseStrategy, ConfigElement
 from dexbot.errors import EmptyMarket
 from dexbot.qt_queue.idle_queue import idle_add
@@ -13,6 +12,8 @@ class Strategy(BaseStrategy):
     """ Ataxia strategy, based on Staggered Orders
     """
 
+    coalesce_market_updates = True
+
     @classmethod
     def configure(cls):
         return BaseStrategy.configure() + [
@@ -52,7 +53,7 @@ class Strategy(BaseStrategy):
         self.lower_bound = self.worker['lower_bound']
         # Order expiration time, should be high enough
         self.expiration = 60*60*24*365*5
-        self.last_check = datetime.now()
+        self.last_check = self.now()
 
         self.reassess()
 
@@ -75,9 +76,11 @@ class Strategy(BaseStrategy):
                 return True
         return False
 
-    def check_at_price(self, price):
+    def check_at_price(self, price, orders=None):
         """True if no order in self.orderlist at this price"""
-        for o in self.orders:
+        if orders is None:
+            orders = self.orders
+        for o in orders:
             if abs(o['price']-price)/price < 0.001:  # "within 0.1% means equal" as slight errors creep in due to rounding
                 return False
         return True
@@ -90,20 +93,14 @@ class Strategy(BaseStrategy):
 
     @staticmethod
     def create_ladder(sizep, spread, increment, upper_bound, lower_bound):
-        l = []
-        size = sizep
-        price = upper_bound
-        while price > lower_bound:
-            l.append((price, size))
-            size = size / math.sqrt(1 + spread + increment)
-            price = price * (1 - increment)
+        prices, sizes = ladder.ataxia_ladder(sizep, spread, increment, upper_bound, lower_bound)
+        l = list(zip(prices.tolist(), sizes.tolist()))
         rl = l.copy()
         rl.reverse()
         return (l, rl)
 
     @staticmethod
-    def spread_zone(spread, market):
-        ticker = market.ticker()
+    def spread_zone(spread, ticker):
         spread = max(spread, 0.001)
         if 'latest' in ticker and ticker['latest'] and float(ticker['latest']) > 0.0:
             centre = float(ticker['latest'])
@@ -134,7 +131,7 @@ class Strategy(BaseStrategy):
                 lowest_buy = highest_buy * (1 - spread)
             else:
                 # market has no latest, no bids and no asks
-                raise errors.EmptyMarket()
+                raise EmptyMarket()
         return (highest_buy, lowest_sell)
 
     def reassess(self, *args, **kwargs):
@@ -143,20 +140,21 @@ class Strategy(BaseStrategy):
             # Make sure no orders remain
             self.cancel_all()
 
-        self.last_check = datetime.now()
+        self.last_check = self.now()
         downladder, upladder = self.ladder()
         new_order = True
         total_orders = 0
         while new_order:
             new_order = False
-            self.account.refresh()
-            highest_buy, lowest_sell = Strategy.spread_zone(self.spread, self.market)
+            # Read once for every rung of this pass
+            orders = self.orders
+            highest_buy, lowest_sell = Strategy.spread_zone(self.spread, self.ticker())
             self.log.debug("highest_buy = {} lowest_sell = {}".format(highest_buy, lowest_sell))
             # do max one order on each side, then cycle outer loop (i.e. check back
             # with market whether things have shifted)
             for price, size in downladder:
                 if price > lowest_sell:
-                    if self.check_at_price(1/price):  # sell orders are inverted
+                    if self.check_at_price(1/price, orders):  # sell orders are inverted
                         if float(self.balance(self.market['quote'])) > size:
                             new_order = True
                             total_orders += 1
@@ -168,7 +166,7 @@ class Strategy(BaseStrategy):
                     break
             for price, size in upladder:
                 if price < highest_buy:
-                    if self.check_at_price(price):
+                    if self.check_at_price(price, orders):
                         if float(self.balance(self.market['base'])) > size*price:
                             new_order = True
                             total_orders += 1
@@ -193,7 +191,7 @@ class Strategy(BaseStrategy):
     def on_market_update_wrapper(self, *args, **kwargs):
         """ Handle market update callbacks
         """
-        delta = datetime.now() - self.last_check
+        delta = self.now() - self.last_check
 
         # Only allow to check orders whether minimal time passed
         if delta > timedelta(seconds=300):
@@ -208,13 +206,14 @@ class Strategy(BaseStrategy):
         pass
 
     def update_gui_slider(self):
-        ticker = self.market.ticker()
+        ticker = self.ticker()
         latest_price = ticker.get('latest', {}).get('price', None)
         if not latest_price:
             return
 
-        if self.orders:
-            order_ids = [i['id'] for i in self.orders]
+        orders = self.orders
+        if orders:
+            order_ids = [i['id'] for i in orders]
         else:
             order_ids = None
         total_balance = self.total_balance(order_ids)
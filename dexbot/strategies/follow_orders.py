@@ -137,8 +137,8 @@ class Strategy(BaseStrategy):
                 amt=repr(sell_wall),
                 price=sell_price,
                 inv_price=1 / sell_price,
-                quote=self.market['quote']['symbol'],
-                base=self.market['base']['symbol']))
+                quote=self.quote_asset.symbol,
+                base=self.base_asset.symbol))
             ret = self.market.sell(
                 sell_price,
                 sell_wall,
@@ -163,8 +163,8 @@ class Strategy(BaseStrategy):
                 amt=repr(buy_wall),
                 price=buy_price,
                 inv_price=1 / buy_price,
-                quote=self.market['quote']['symbol'],
-                base=self.market['base']['symbol']))
+                quote=self.quote_asset.symbol,
+                base=self.base_asset.symbol))
             ret = self.market.buy(
                 buy_price,
                 buy_wall,
@@ -217,7 +217,7 @@ class Strategy(BaseStrategy):
             self.log.error("we have open orders but no record, weird: recalculating startprice")
             recalc = True
         if recalc:
-            t = self.market.ticker()
+            t = self.ticker()
             if t['highestBid'] is None:
                 self.log.critical("no bid price available")
                 self.disabled = True
@@ -75,7 +75,7 @@ class Strategy(BaseStrategy):
         if hasattr(self, "record_balances"):
             self.record_balances(newprice)
 
-        market_orders = self.market.orderbook()
+        market_orders = self.orderbook()
         bids = market_orders['bids']
         asks = market_orders['asks']
 
@@ -156,7 +156,7 @@ class Strategy(BaseStrategy):
             self.log.error("we have open orders but no record, weird: recalculating startprice")
             recalc = True
         if recalc:
-            t = self.market.ticker()
+            t = self.ticker()
             if t['highestBid'] is None:
                 self.log.critical("no bid price available")
                 self.disabled = True
@@ -34,6 +34,7 @@ class Strategy(BaseStrategy):
         # Define Callbacks
         self.onMarketUpdate += self.check_orders
         self.onAccount += self.check_orders
+        self.ontick += self.tick
 
         self.error_ontick = self.error
         self.error_onMarketUpdate = self.error
@@ -63,22 +64,25 @@ class Strategy(BaseStrategy):
         self.cancel_all()
         self.disabled = True
 
-    @property
-    def amount_quote(self):
+    def amount_quote(self, locked=0):
         """ Get quote amount, calculate if order size is relative
+
+            :param float locked: quote asset in the worker's own orders, it
+                counts towards relative order sizes
         """
         if self.is_relative_order_size:
-            quote_balance = float(self.balance(self.market["quote"]))
+            quote_balance = float(self.balance(self.market["quote"])) + locked
             return quote_balance * (self.order_size / 100)
         else:
             return self.order_size
 
-    @property
-    def amount_base(self):
+    def amount_base(self, locked=0):
         """ Get base amount, calculate if order size is relative
+
+            :param float locked: base asset in the worker's own orders
         """
         if self.is_relative_order_size:
-            base_balance = float(self.balance(self.market["base"]))
+            base_balance = float(self.balance(self.market["base"])) + locked
             # amount = % of balance / buy_price = amount combined with calculated price to give % of balance
             return base_balance * (self.order_size / 100) / self.buy_price
         else:
@@ -105,39 +109,58 @@ class Strategy(BaseStrategy):
         self.buy_price = self.center_price / math.sqrt(1 + self.spread)
         self.sell_price = self.center_price * math.sqrt(1 + self.spread)
 
+    def locked_balance(self, orders):
+        """ Returns the quote and base amounts held by the orders
+
+            :param list orders: live orders of the worker
+            :return: dict of the amounts, by 'quote' and 'base'
+        """
+        locked = {'quote': 0, 'base': 0}
+        for order in orders:
+            side, amount, price = self.get_order_terms(order)
+            if side == 'buy':
+                locked['base'] += amount * price
+            else:
+                locked['quote'] += amount
+        return locked
+
     def update_orders(self):
         self.log.info('Change detected, updating orders')
+        self.recheck_orders = False
 
         # Recalculate buy and sell order prices
         self.calculate_order_prices()
 
-        # Cancel the orders before redoing them
-        self.cancel_all()
-        self.clear_orders()
-
-        order_ids = []
+        # Size the orders as if the live ones were canceled first
+        live_orders = self.updated_open_orders
+        locked = self.locked_balance(live_orders)
 
-        amount_base = self.amount_base
-        amount_quote = self.amount_quote
+        desired_orders = [
+            ('buy', self.amount_base(locked['base']), self.buy_price),
+            ('sell', self.amount_quote(locked['quote']), self.sell_price)
+        ]
 
-        # Buy Side
-        buy_order = self.market_buy(amount_base, self.buy_price, True)
-        if buy_order:
-            self.save_order(buy_order)
-            order_ids.append(buy_order['id'])
+        # Only cancel and place the orders that differ, in one transaction
+        kept_orders, placed_orders = self.reconcile_orders(desired_orders, live_orders)
+        orders = kept_orders + [order for order in placed_orders if not order['deleted']]
 
-        # Sell Side
-        sell_order = self.market_sell(amount_quote, self.sell_price, True)
-        if sell_order:
-            self.save_order(sell_order)
-            order_ids.append(sell_order['id'])
+        self.clear_orders()
+        for order in orders:
+            self.save_order(order)
 
+        order_ids = [order['id'] for order in orders]
         self['order_ids'] = order_ids
 
         self.log.info("Done placing orders")
 
-        # Some orders weren't successfully created, redo them
-        if len(order_ids) < 2 and not self.disabled:
+        # Some orders were filled at once, they are placed again on the next block
+        if len(order_ids) < len(desired_orders) and not self.disabled:
+            self.recheck_orders = True
+
+    def tick(self, d):
+        """ ticks come in on every block
+        """
+        if self.recheck_orders:
             self.update_orders()
 
     def check_orders(self, *args, **kwargs):
@@ -178,7 +201,7 @@ class Strategy(BaseStrategy):
         self['profit'] = profit
 
     def update_gui_slider(self):
-        ticker = self.market.ticker()
+        ticker = self.ticker()
         latest_price = ticker.get('latest', {}).get('price', None)
         if not latest_price:
             return
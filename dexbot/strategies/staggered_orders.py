@@ -1,7 +1,7 @@
 import math
-from datetime import datetime
 from datetime import timedelta
 
+from dexbot import ladder
 from dexbot.basestrategy import BaseStrategy, ConfigElement
 from dexbot.qt_queue.idle_queue import idle_add
 
@@ -10,6 +10,8 @@ class Strategy(BaseStrategy):
     """ Staggered Orders strategy
     """
 
+    coalesce_market_updates = True
+
     @classmethod
     def configure(cls):
         return BaseStrategy.configure() + [
@@ -42,6 +44,7 @@ class Strategy(BaseStrategy):
 
         # Define Callbacks
         self.onMarketUpdate += self.on_market_update_wrapper
+        self.onOrderMatched += self.on_order_matched
         self.onAccount += self.check_orders
         self.ontick += self.tick
 
@@ -58,7 +61,7 @@ class Strategy(BaseStrategy):
         self.lower_bound = self.worker['lower_bound']
         # Order expiration time, should be high enough
         self.expiration = 60*60*24*365*5
-        self.last_check = datetime.now()
+        self.last_check = self.now()
 
         if self['setup_done']:
             self.check_orders()
@@ -91,14 +94,9 @@ class Strategy(BaseStrategy):
         lower_bound = self.lower_bound
         upper_bound = self.upper_bound
 
-        # Calculate buy prices
-        buy_prices = self.calculate_buy_prices(center_price, spread, increment, lower_bound)
-
-        # Calculate sell prices
-        sell_prices = self.calculate_sell_prices(center_price, spread, increment, upper_bound)
-
-        # Calculate buy and sell amounts
-        buy_orders, sell_orders = self.calculate_amounts(buy_prices, sell_prices, amount, spread, increment)
+        # Calculate buy and sell prices and amounts
+        buy_orders, sell_orders = self.calculate_orders(
+            center_price, amount, spread, increment, lower_bound, upper_bound)
 
         # Make sure there is enough balance for the buy orders
         needed_buy_asset = 0
@@ -106,7 +104,7 @@ class Strategy(BaseStrategy):
             needed_buy_asset += buy_order['amount'] * buy_order['price']
         if self.balance(self.market["base"]) < needed_buy_asset:
             self.log.critical(
-                "Insufficient buy balance, needed {} {}".format(needed_buy_asset, self.market['base']['symbol'])
+                "Insufficient buy balance, needed {} {}".format(needed_buy_asset, self.base_asset.symbol)
             )
             self.disabled = True
             return
@@ -117,22 +115,15 @@ class Strategy(BaseStrategy):
             needed_sell_asset += sell_order['amount']
         if self.balance(self.market["quote"]) < needed_sell_asset:
             self.log.critical(
-                "Insufficient sell balance, needed {} {}".format(needed_sell_asset, self.market['quote']['symbol'])
+                "Insufficient sell balance, needed {} {}".format(needed_sell_asset, self.quote_asset.symbol)
             )
             self.disabled = True
             return
 
-        # Place the buy orders
-        for buy_order in buy_orders:
-            order = self.market_buy(buy_order['amount'], buy_order['price'], expiration=self.expiration)
-            if order:
-                self.save_order(order)
-
-        # Place the sell orders
-        for sell_order in sell_orders:
-            order = self.market_sell(sell_order['amount'], sell_order['price'], expiration=self.expiration)
-            if order:
-                self.save_order(order)
+        # Place the whole ladder in bulk
+        orders = [('buy', order['amount'], order['price']) for order in buy_orders]
+        orders += [('sell', order['amount'], order['price']) for order in sell_orders]
+        self.bulk_place_orders(orders, expiration=self.expiration)
 
         self['setup_done'] = True
         self.log.info("Done placing orders")
@@ -146,7 +137,7 @@ class Strategy(BaseStrategy):
         """ Replaces an order with a reverse order
             buy orders become sell orders and sell orders become buy orders
         """
-        if order['base']['symbol'] == self.market['base']['symbol']:  # Buy order
+        if order['base']['symbol'] == self.base_asset.symbol:  # Buy order
             price = order['price'] * (1 + self.spread)
             amount = order['quote']['amount']
             new_order = self.market_sell(amount, price, expiration=self.expiration)
@@ -162,7 +153,7 @@ class Strategy(BaseStrategy):
     def place_order(self, order):
         self.remove_order(order)
 
-        if order['base']['symbol'] == self.market['base']['symbol']:  # Buy order
+        if order['base']['symbol'] == self.base_asset.symbol:  # Buy order
             price = order['price']
             amount = order['quote']['amount']
             new_order = self.market_buy(amount, price, expiration=self.expiration)
@@ -177,7 +168,7 @@ class Strategy(BaseStrategy):
         """ Place all the orders found in the database
             FIXME: unused method
         """
-        orders = self.fetch_orders()
+        orders = self.fetch_orders() or {}
         for order_id, order in orders.items():
             if not self.get_order(order_id):
                 self.place_order(order)
@@ -187,20 +178,30 @@ class Strategy(BaseStrategy):
     def on_market_update_wrapper(self, *args, **kwargs):
         """ Handle market update callbacks
         """
-        delta = datetime.now() - self.last_check
+        delta = self.now() - self.last_check
 
         # Only allow to check orders whether minimal time passed
         if delta > timedelta(seconds=5):
             self.check_orders(*args, **kwargs)
 
+    def on_order_matched(self, filled_order):
+        """ Checks the orders on the next block when one of them gets filled,
+            once however many fills the block holds
+        """
+        if filled_order.get('order_id') in (self.fetch_orders() or {}):
+            self.recheck_orders = True
+
     def check_orders(self, *args, **kwargs):
         """ Tests if the orders need updating
         """
         order_placed = False
-        orders = self.fetch_orders()
+        self.recheck_orders = False
+        # No orders are saved before the ladder is placed
+        orders = self.fetch_orders() or {}
+        # Orders missing from the account's open orders got filled
+        open_order_ids = self.get_open_order_ids() if orders else set()
         for order_id, order in orders.items():
-            current_order = self.get_order(order_id)
-            if not current_order:
+            if order_id not in open_order_ids:
                 # Write order to .csv log
                 self.write_order_log(self.worker_name, order)
                 self.place_reverse_order(order)
@@ -213,55 +214,19 @@ class Strategy(BaseStrategy):
             self.update_gui_profit()
             self.update_gui_slider()
 
-        self.last_check = datetime.now()
-
-    @staticmethod
-    def calculate_buy_prices(center_price, spread, increment, lower_bound):
-        buy_prices = []
-        if lower_bound > center_price / math.sqrt(1 + increment + spread):
-            return buy_prices
-
-        buy_price = center_price / math.sqrt(1 + increment + spread)
-        while buy_price > lower_bound:
-            buy_prices.append(buy_price)
-            buy_price = buy_price / (1 + increment)
-        return buy_prices
-
-    @staticmethod
-    def calculate_sell_prices(center_price, spread, increment, upper_bound):
-        sell_prices = []
-        if upper_bound < center_price * math.sqrt(1 + increment + spread):
-            return sell_prices
-
-        sell_price = center_price * math.sqrt(1 + increment + spread)
-        while sell_price < upper_bound:
-            sell_prices.append(sell_price)
-            sell_price = sell_price * (1 + increment)
-        return sell_prices
+        self.last_check = self.now()
 
     @staticmethod
-    def calculate_amounts(buy_prices, sell_prices, amount, spread, increment):
-        # Calculate buy amounts
-        buy_orders = []
-        if buy_prices:
-            highest_buy_price = buy_prices.pop(0)
-            buy_orders.append({'amount': amount, 'price': highest_buy_price})
-            for buy_price in buy_prices:
-                last_amount = buy_orders[-1]['amount']
-                current_amount = last_amount * math.sqrt(1 + increment)
-                buy_orders.append({'amount': current_amount, 'price': buy_price})
-
-        # Calculate sell amounts
-        sell_orders = []
-        if sell_prices:
-            lowest_sell_price = sell_prices.pop(0)
-            current_amount = amount * math.sqrt(1 + spread + increment)
-            sell_orders.append({'amount': current_amount, 'price': lowest_sell_price})
-            for sell_price in sell_prices:
-                last_amount = sell_orders[-1]['amount']
-                current_amount = last_amount / math.sqrt(1 + increment)
-                sell_orders.append({'amount': current_amount, 'price': sell_price})
+    def calculate_orders(center_price, amount, spread, increment, lower_bound, upper_bound):
+        """ Returns the buy and sell orders of the ladder, see :func:`dexbot.ladder.staggered_ladder`
+        """
+        buy_prices, buy_amounts, sell_prices, sell_amounts = ladder.staggered_ladder(
+            center_price, amount, spread, increment, lower_bound, upper_bound)
 
+        buy_orders = [{'amount': amount, 'price': price}
+                      for amount, price in zip(buy_amounts.tolist(), buy_prices.tolist())]
+        sell_orders = [{'amount': amount, 'price': price}
+                       for amount, price in zip(sell_amounts.tolist(), sell_prices.tolist())]
         return [buy_orders, sell_orders]
 
     @staticmethod
@@ -279,25 +244,9 @@ class Strategy(BaseStrategy):
         else:
             center_price = highest_bid['price'] * math.sqrt(lowest_ask['price'] / highest_bid['price'])
 
-        # Calculate buy prices
-        buy_prices = Strategy.calculate_buy_prices(center_price, spread, increment, lower_bound)
-
-        # Calculate sell prices
-        sell_prices = Strategy.calculate_sell_prices(center_price, spread, increment, upper_bound)
-
-        # Calculate buy and sell amounts
-        buy_orders, sell_orders = Strategy.calculate_amounts(
-            buy_prices, sell_prices, amount, spread, increment
+        needed_buy_asset, needed_sell_asset = ladder.staggered_required_assets(
+            center_price, amount, spread, increment, lower_bound, upper_bound
         )
-
-        needed_buy_asset = 0
-        for buy_order in buy_orders:
-            needed_buy_asset += buy_order['amount'] * buy_order['price']
-
-        needed_sell_asset = 0
-        for sell_order in sell_orders:
-            needed_sell_asset += sell_order['amount']
-
         return [needed_buy_asset, needed_sell_asset]
 
     def tick(self, d):
@@ -305,14 +254,13 @@ class Strategy(BaseStrategy):
         """
         if self.recheck_orders:
             self.check_orders()
-            self.recheck_orders = False
 
     # GUI updaters
     def update_gui_profit(self):
         pass
 
     def update_gui_slider(self):
-        ticker = self.market.ticker()
+        ticker = self.ticker()
         latest_price = ticker.get('latest', {}).get('price', None)
         if not latest_price:
             return
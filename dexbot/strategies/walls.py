@@ -132,7 +132,7 @@ class Strategy(BaseStrategy):
         if target.get("reference") == "feed":
             assert self.market == self.market.core_quote_market(
             ), "Wrong market for 'feed' reference!"
-            ticker = self.market.ticker()
+            ticker = self.ticker()
             price = ticker.get("quoteSettlement_price")
             assert abs(price["price"]) != float(
                 "inf"), "Check price feed of asset! (%s)" % str(price)
@@ -6,9 +6,10 @@ from functools import update_wrapper
 
 import click
 from ruamel import yaml
-from bitshares import BitShares
 from bitshares.instance import set_shared_bitshares_instance
 
+from dexbot.node_pool import create_bitshares
+
 log = logging.getLogger(__name__)
 
 
@@ -83,7 +84,7 @@ def verbose(f):
 def chain(f):
     @click.pass_context
     def new_func(ctx, *args, **kwargs):
-        ctx.bitshares = BitShares(
+        ctx.bitshares = create_bitshares(
             ctx.config["node"],
             **ctx.obj
         )
@@ -2,6 +2,7 @@ import time
 from threading import Thread
 
 from dexbot import __version__
+from dexbot.node_pool import NodePool
 from dexbot.qt_queue.queue_dispatcher import ThreadDispatcher
 from dexbot.qt_queue.idle_queue import idle_add
 from .ui.worker_list_window_ui import Ui_MainWindow
@@ -133,6 +134,17 @@ class MainView(QtWidgets.QMainWindow, Ui_MainWindow):
                 time.sleep(0.5)
 
     def set_statusbar_message(self):
+        rpc = self.main_ctrl.bitshares_instance.rpc
+        if isinstance(rpc, NodePool):
+            # The pool measures its nodes continuously, no need for a new connection
+            node = rpc.status()[0]
+            if node['healthy']:
+                self.status_bar.showMessage("ver {} - Node delay: {:.2f}ms - {}".format(
+                    __version__, node['rtt'] * 1000, node['url']))
+            else:
+                self.status_bar.showMessage("ver {} - Node disconnected".format(__version__))
+            return
+
         node = self.config['node']
         try:
             start = time.time()
@@ -7,12 +7,21 @@ import copy
 
 import dexbot.errors as errors
 import dexbot.report
+import dexbot.storage
 
 from dexbot.basestrategy import BaseStrategy
+from dexbot.dispatcher import Dispatcher, LockedRPC, DISPATCH_THREADS, DISPATCH_QUEUE_SIZE
+from dexbot.market_cache import MarketCache
+from dexbot.node_pool import NodePool, create_bitshares
+from dexbot.order_state import OrderState
 
-from bitshares import BitShares
+from bitshares.account import Account
+from bitshares.asset import Asset
+from bitshares.market import Market
 from bitshares.notify import Notify
 from bitshares.instance import shared_bitshares_instance
+from bitshares.price import Order
+from bitshares.utils import assets_from_string
 
 # FIXME: currently static list of worker strategies: ? how to enumerate workers
 # available and deploy new worker strategies.
@@ -22,6 +31,24 @@ STRATEGIES = [('dexbot.strategies.echo', "Echo Test"),
 
 
 log = logging.getLogger(__name__)
+
+# Error event called when the handler of an event fails
+ERROR_EVENTS = {
+    'ontick': 'error_ontick',
+    'onMarketUpdate': 'error_onMarketUpdate',
+    'onMarketUpdateBatch': 'error_onMarketUpdate',
+    'onAccount': 'error_onAccount'
+}
+
+
+def is_droppable(event, data):
+    """ Tells whether an event of a worker may be dropped when the worker
+        falls behind. New blocks and placed orders are superseded by the
+        next ones, fills and account updates are never dropped.
+    """
+    return event == 'ontick' or (event == 'onMarketUpdate' and isinstance(data, Order))
+
+
 log_workers = logging.getLogger('dexbot.per_worker')
 # NOTE this is the  special logger for per-worker events
 # it returns LogRecords with extra fields: worker_name, account, market and is_disabled
@@ -31,6 +58,12 @@ log_workers = logging.getLogger('dexbot.per_worker')
 
 class WorkerInfrastructure(threading.Thread):
 
+    # Runs the event handlers of the workers, see dexbot.dispatcher
+    dispatcher_class = Dispatcher
+
+    # Whether coroutine handlers are awaited, AsyncStrategy workers need it
+    runs_coroutines = False
+
     def __init__(
         self,
         config,
@@ -44,12 +77,52 @@ class WorkerInfrastructure(threading.Thread):
         self.view = view
         self.jobs = []
         self.notify = None
+        # Market ids by routing key and account names the notifications are subscribed to
+        self.subscribed_markets = {}
+        self.subscribed_accounts = set()
         self.config_lock = threading.RLock()
         self.workers = {}
 
+        # Database tuning from the optional 'database' section of the config
+        dexbot.storage.configure(self.config.get('database'))
+
         self.accounts = set()
         self.markets = set()
 
+        # Routing indexes of the running workers, replaced as a whole by
+        # rebuild_index() so the event handlers can use a snapshot of them
+        self.worker_names = ()
+        self.market_workers = {}
+        self.account_workers = {}
+
+        # Tickers and order books shared by all the workers
+        self.market_cache = MarketCache()
+
+        # Open orders of each account, shared by the workers of the account
+        self.order_states = {}
+
+        # Recorder of the market data, from the optional 'recorder' section of the config
+        self.recorder = None
+        if self.config.get('recorder'):
+            from dexbot.recorder import MarketRecorder
+            self.recorder = MarketRecorder.from_config(self.config['recorder'])
+
+        # Market updates of the workers coalescing them, delivered once per block
+        self.market_updates = {}
+        self.market_updates_lock = threading.Lock()
+
+        # Event handlers of the workers run in parallel, one lane per worker
+        dispatch = self.config.get('dispatch', {})
+        self.dispatcher = self.dispatcher_class(
+            threads=dispatch.get('threads', DISPATCH_THREADS),
+            queue_size=dispatch.get('queue_size', DISPATCH_QUEUE_SIZE)
+        )
+
+        # The workers share the node connection from several threads, a
+        # node pool serializes the calls of each of its connections itself
+        if self.bitshares.rpc is not None and not isinstance(self.bitshares.rpc, (LockedRPC, NodePool)):
+            self.bitshares.rpc = LockedRPC(self.bitshares.rpc)
+
         # Set the module search path
         user_worker_path = os.path.expanduser("~/bots")
         if os.path.exists(user_worker_path):
@@ -74,39 +147,150 @@ class WorkerInfrastructure(threading.Thread):
             self.reporters.append(reporter_instance)
 
         # set up workers
+        accounts, markets = self.prefetch(config, config["workers"])
         self.config_lock.acquire()
-        for worker_name, worker in config["workers"].items():
-            if "account" not in worker:
-                log_workers.critical("Worker has no account", extra={
-                    'worker_name': worker_name, 'account': 'unknown',
-                    'market': 'unknown', 'is_disabled': (lambda: True)
-                })
-                continue
-            if "market" not in worker:
-                log_workers.critical("Worker has no market", extra={
-                    'worker_name': worker_name, 'account': worker['account'],
-                    'market': 'unknown', 'is_disabled': (lambda: True)
-                })
-                continue
+        for worker_name in config["workers"]:
+            self.init_worker(worker_name, config, accounts, markets)
+        self.rebuild_index()
+        self.config_lock.release()
+
+    def prefetch(self, config, worker_names):
+        """ Fetches the accounts and markets of the workers all at once
+
+            The node connection carries one call at a time, so rather than
+            each worker looking up its account and market one call after
+            the other, all the accounts are fetched in a single call and
+            all the assets of the markets in another one.
+
+            :return: tuple of the Account objects by account name and the
+                Market objects by market string. What could not be fetched
+                is left out, the worker looks it up again and reports the
+                error itself.
+        """
+        workers = [config["workers"][name] for name in worker_names]
+        account_names = sorted({worker["account"] for worker in workers if "account" in worker})
+        market_names = sorted({worker["market"] for worker in workers if "market" in worker})
+
+        accounts = {}
+        if account_names:
             try:
-                strategy_class = getattr(
-                    importlib.import_module(worker["module"]),
-                    'Strategy'
-                )
-                self.workers[worker_name] = strategy_class(
-                    config=config,
-                    name=worker_name,
-                    bitshares_instance=self.bitshares,
-                    view=self.view
-                )
-                self.markets.add(worker['market'])
-                self.accounts.add(worker['account'])
-            except BaseException:
-                log_workers.exception("Worker initialisation", extra={
+                for name, full_account in self.bitshares.rpc.get_full_accounts(account_names, False):
+                    data = dict(full_account["account"])
+                    data.update((key, value) for key, value in full_account.items() if key != "account")
+                    accounts[name] = Account(data, full=True, bitshares_instance=self.bitshares)
+            except Exception as e:
+                log.debug('Unable to prefetch the accounts: {}'.format(e))
+
+        markets = {}
+        # Malformed markets are left to the worker to report
+        pairs = {name: assets_from_string(name) for name in market_names}
+        pairs = {name: pair for name, pair in pairs.items() if len(pair) == 2}
+        symbols = sorted({symbol for pair in pairs.values() for symbol in pair})
+        if symbols:
+            try:
+                assets = dict(zip(symbols, self.bitshares.rpc.lookup_asset_symbols(symbols)))
+                for name, (quote, base) in pairs.items():
+                    if assets[quote] and assets[base]:
+                        markets[name] = Market(
+                            base=Asset(assets[base], bitshares_instance=self.bitshares),
+                            quote=Asset(assets[quote], bitshares_instance=self.bitshares),
+                            bitshares_instance=self.bitshares
+                        )
+            except Exception as e:
+                log.debug('Unable to prefetch the markets: {}'.format(e))
+        return accounts, markets
+
+    def init_worker(self, worker_name, config, accounts=None, markets=None):
+        """ Initialize a single worker of the config
+
+            :param dict accounts: Account objects fetched beforehand, by name
+            :param dict markets: Market objects fetched beforehand, by market string
+        """
+        worker = config["workers"][worker_name]
+        if "account" not in worker:
+            log_workers.critical("Worker has no account", extra={
+                'worker_name': worker_name, 'account': 'unknown',
+                'market': 'unknown', 'is_disabled': (lambda: True)
+            })
+            return
+        if "market" not in worker:
+            log_workers.critical("Worker has no market", extra={
+                'worker_name': worker_name, 'account': worker['account'],
+                'market': 'unknown', 'is_disabled': (lambda: True)
+            })
+            return
+        try:
+            strategy_class = getattr(
+                importlib.import_module(worker["module"]),
+                'Strategy'
+            )
+            if getattr(strategy_class, 'needs_coroutines', False) and not self.runs_coroutines:
+                # Its handlers would be called without ever being awaited
+                log_workers.critical("Worker needs the asyncio runtime, run it with --asyncio", extra={
                     'worker_name': worker_name, 'account': worker['account'],
-                    'market': 'unknown', 'is_disabled': (lambda: True)
+                    'market': worker['market'], 'is_disabled': (lambda: True)
                 })
-        self.config_lock.release()
+                return
+            self.workers[worker_name] = strategy_class(
+                config=config,
+                name=worker_name,
+                bitshares_instance=self.worker_bitshares(),
+                view=self.view,
+                market_cache=self.market_cache,
+                order_state=self.get_order_state(worker['account']),
+                account=(accounts or {}).get(worker['account']),
+                market=(markets or {}).get(worker['market'])
+            )
+        except BaseException:
+            log_workers.exception("Worker initialisation", extra={
+                'worker_name': worker_name, 'account': worker['account'],
+                'market': 'unknown', 'is_disabled': (lambda: True)
+            })
+
+    def get_order_state(self, account_name):
+        """ Returns the order state mirror of an account, see dexbot.order_state
+        """
+        with self.config_lock:
+            if account_name not in self.order_states:
+                self.order_states[account_name] = OrderState(account_name, self.bitshares)
+            return self.order_states[account_name]
+
+    @staticmethod
+    def market_key(market):
+        """ Returns the routing key of a market, the same for both of its orientations
+
+            :param market: market string like "USD:BTS" or Market object
+        """
+        if isinstance(market, str):
+            return frozenset(assets_from_string(market))
+        return frozenset((market['quote']['symbol'], market['base']['symbol']))
+
+    def rebuild_index(self):
+        """ Rebuilds the market and account routing indexes of the running workers
+        """
+        with self.config_lock:
+            market_workers = {}
+            account_workers = {}
+            markets = set()
+            for worker_name, worker in self.config['workers'].items():
+                if worker_name not in self.workers:
+                    continue
+                market_workers.setdefault(self.market_key(worker['market']), []).append(worker_name)
+                account_workers.setdefault(worker['account'], []).append(worker_name)
+                markets.add(worker['market'])
+
+            self.worker_names = tuple(name for name in self.config['workers'] if name in self.workers)
+            self.market_workers = market_workers
+            self.account_workers = account_workers
+            self.accounts = set(account_workers)
+            self.markets = markets
+
+            if self.recorder:
+                recorded = {}
+                for worker_name in self.worker_names:
+                    market = self.workers[worker_name].market
+                    recorded.setdefault(self.market_key(market), market)
+                self.recorder.set_markets(list(recorded.values()))
 
     def update_notify(self):
         if not self.config['workers']:
@@ -117,24 +301,174 @@ class WorkerInfrastructure(threading.Thread):
             raise errors.NoWorkersAvailable()
         if self.notify:
             # Update the notification instance
-            self.notify.reset_subscriptions(list(self.accounts), list(self.markets))
+            self.update_subscriptions()
         else:
-            # Initialize the notification instance
+            # Initialize the notification instance, once per market whatever
+            # the orientation the workers trade it in
+            markets = list({self.market_key(market): market for market in self.markets}.values())
             self.notify = Notify(
-                markets=list(self.markets),
+                markets=markets,
                 accounts=list(self.accounts),
                 on_market=self.on_market,
                 on_account=self.on_account,
                 on_block=self.on_block,
                 bitshares_instance=self.bitshares
             )
+            self.subscribed_markets = {
+                self.market_key(market): ids
+                for market, ids in zip(markets, self.notify.websocket.subscription_markets)
+            }
+            self.subscribed_accounts = set(self.accounts)
+
+    def update_subscriptions(self):
+        """ Subscribes to the markets and accounts of new workers and
+            unsubscribes from the markets no longer used, leaving the other
+            subscriptions untouched
+        """
+        with self.config_lock:
+            markets = {self.market_key(market): market for market in self.markets}
+            accounts = set(self.accounts)
+
+        websocket = self.notify.websocket
+        # Until the websocket is open, its subscriptions are just recorded
+        connected = getattr(websocket, 'ws', None) is not None
+
+        for key in set(self.subscribed_markets) - set(markets):
+            ids = self.subscribed_markets.pop(key)
+            if connected:
+                websocket.unsubscribe_from_market(*ids)
+        for key in set(markets) - set(self.subscribed_markets):
+            ids = self.subscribed_markets[key] = self.notify.get_market_ids([markets[key]])[0]
+            if connected:
+                websocket.subscribe_to_market(websocket.__events__.index('on_market'), *ids)
+
+        # Accounts can't be unsubscribed one by one, the notifications of the
+        # accounts no longer used aren't routed to any worker
+        new_accounts = accounts - self.subscribed_accounts
+        if new_accounts and connected:
+            websocket.get_full_accounts(list(new_accounts), True)
+        self.subscribed_accounts |= new_accounts
+
+        # Subscribed to again as a whole on reconnection
+        websocket.subscription_markets = list(self.subscribed_markets.values())
+        websocket.subscription_accounts = list(self.subscribed_accounts)
+
+    def reload_config(self, config):
+        """ Applies a new config to the running workers
+
+            Only the workers added, removed or whose settings changed are
+            stopped or (re)started, the others keep running along with their
+            orders. The notification subscriptions are updated accordingly.
+
+            :param dict config: the new dexbot config
+        """
+        if not config.get('workers'):
+            log.critical("The new config has no workers, keeping the current one")
+            return
+        config = copy.deepcopy(config)
+        with self.config_lock:
+            old_workers = self.config['workers']
+            new_workers = config['workers']
+            removed = [name for name in old_workers if name not in new_workers]
+            changed = [name for name in old_workers
+                       if name in new_workers and new_workers[name] != old_workers[name]]
+            added = [name for name in new_workers if name not in old_workers]
+
+            for section in ('node', 'reports', 'dispatch'):
+                if config.get(section) != self.config.get(section):
+                    log.warning('Changes to "{}" take effect on restart'.format(section))
+            if config.get('database') != self.config.get('database'):
+                dexbot.storage.configure(config.get('database'))
+
+            for worker_name in removed + changed:
+                worker = self.workers.pop(worker_name, None)
+                # The old instance is done with its events before a new one
+                # takes over the lane or its orders are canceled
+                self.dispatcher.remove(worker_name, wait=True)
+                if worker is not None and worker_name in removed:
+                    worker.pause()
+
+            config['workers'] = new_workers
+            self.config = config
+            accounts, markets = self.prefetch(config, changed + added)
+            for worker_name in changed + added:
+                self.init_worker(worker_name, config, accounts, markets)
+            self.rebuild_index()
+
+        log.info('Config reloaded: {} added, {} changed, {} removed, {} unchanged'.format(
+            len(added), len(changed), len(removed), len(new_workers) - len(added) - len(changed)))
+        self.update_notify()
+
+    def worker_bitshares(self):
+        """ Returns a BitShares instance for a worker
+
+            It shares the node connection and the wallet with the others,
+            but has transaction buffers and broadcast settings of its own,
+            so workers can build transactions in parallel.
+        """
+        bitshares = copy.copy(self.bitshares)
+        bitshares.clear()
+        return bitshares
 
     def shutdown(self):
         for i in self.reporters:
             i.shutdown()
+        self.dispatcher.shutdown(wait=False)
+        if self.recorder:
+            self.recorder.close()
+
+    def record(self, event, *args):
+        """ Passes an event to the market data recorder, which is never to
+            stop the workers from getting it
+        """
+        try:
+            getattr(self.recorder, event)(*args)
+        except Exception:
+            log.exception("Unable to record {}".format(event))
+
+    def metrics(self):
+        """ Returns the event queue depth and handler latency of each
+            worker, and the market data cache statistics
+        """
+        return {
+            'workers': self.dispatcher.metrics(),
+            'market_cache': self.market_cache.stats(),
+            'order_state': {name: state.stats() for name, state in list(self.order_states.items())},
+            'recorder': self.recorder.stats() if self.recorder else None
+        }
+
+    def dispatch(self, worker_name, event, data):
+        """ Queues an event on the lane of the worker
+        """
+        self.dispatcher.submit(worker_name, self.handle_event, worker_name, event, data,
+                               droppable=is_droppable(event, data))
+
+    def handle_event(self, worker_name, event, data):
+        """ Calls the handler of an event of the worker, on the worker's lane
+        """
+        worker = self.workers.get(worker_name)
+        if worker is None:
+            return
+        if worker.disabled:
+            worker.log.debug('Worker "{}" is disabled'.format(worker_name))
+            return
+        try:
+            getattr(worker, event)(data)
+        except Exception as e:
+            worker.log.exception("in {}()".format(event))
+            try:
+                getattr(worker, ERROR_EVENTS[event])(e)
+            except Exception:
+                worker.log.exception("in {}()".format(ERROR_EVENTS[event]))
 
     # Events
     def on_block(self, data):
+        self.market_cache.on_block(data)
+        for order_state in list(self.order_states.values()):
+            order_state.on_block()
+        if self.recorder:
+            self.record('on_block', data, self.market_cache)
+
         if self.jobs:
             try:
                 for job in self.jobs:
@@ -145,56 +479,56 @@ class WorkerInfrastructure(threading.Thread):
         self.config_lock.acquire()
         for reporter in self.reporters:
             reporter.ontick()
-        for worker_name, worker in self.config["workers"].items():
-            if worker_name not in self.workers or self.workers[worker_name].disabled:
-                continue
-            try:
-                self.workers[worker_name].ontick(data)
-            except Exception as e:
-                self.workers[worker_name].log.exception("in ontick()")
-                try:
-                    self.workers[worker_name].error_ontick(e)
-                except Exception:
-                    self.workers[worker_name].log.exception("in error_ontick()")
+        worker_names = self.worker_names
         self.config_lock.release()
 
+        # The market updates of the previous block go first
+        with self.market_updates_lock:
+            market_updates, self.market_updates = self.market_updates, {}
+        for worker_name, updates in market_updates.items():
+            self.dispatch(worker_name, 'onMarketUpdateBatch', updates)
+
+        for worker_name in worker_names:
+            self.dispatch(worker_name, 'ontick', data)
+
     def on_market(self, data):
+        # A canceled order leaves the cached order book of its market stale too
+        self.market_cache.on_market(data)
         if data.get("deleted", False):  # No info available on deleted orders
             return
 
-        self.config_lock.acquire()
-        for worker_name, worker in self.config["workers"].items():
-            if self.workers[worker_name].disabled:
-                self.workers[worker_name].log.debug('Worker "{}" is disabled'.format(worker_name))
-                continue
-            if worker["market"] == data.market:
-                try:
-                    self.workers[worker_name].onMarketUpdate(data)
-                except Exception as e:
-                    self.workers[worker_name].log.exception("in onMarketUpdate()")
-                    try:
-                        self.workers[worker_name].error_onMarketUpdate(e)
-                    except Exception:
-                        self.workers[worker_name].log.exception("in error_onMarketUpdate()")
-        self.config_lock.release()
+        if self.recorder:
+            self.record('on_market', data)
+
+        with self.config_lock:
+            market_workers = self.market_workers
+
+        for worker_name in market_workers.get(self.market_key(data.market), ()):
+            worker = self.workers.get(worker_name)
+            if worker is not None and worker.coalesce_market_updates:
+                with self.market_updates_lock:
+                    self.market_updates.setdefault(worker_name, []).append(data)
+            else:
+                self.dispatch(worker_name, 'onMarketUpdate', data)
 
     def on_account(self, account_update):
-        self.config_lock.acquire()
-        account = account_update.account
-        for worker_name, worker in self.config["workers"].items():
-            if self.workers[worker_name].disabled:
-                self.workers[worker_name].log.info('Worker "{}" is disabled'.format(worker_name))
-                continue
-            if worker["account"] == account["name"]:
-                try:
-                    self.workers[worker_name].onAccount(account_update)
-                except Exception as e:
-                    self.workers[worker_name].log.exception("in onAccountUpdate()")
-                    try:
-                        self.workers[worker_name].error_onAccount(e)
-                    except Exception:
-                        self.workers[worker_name].log.exception("in error_onAccountUpdate()")
-        self.config_lock.release()
+        with self.config_lock:
+            account_workers = self.account_workers
+        if self.recorder:
+            self.record('on_account', account_update)
+
+        # The update is the statistics object of the account, its owner is
+        # looked up among the mirrored accounts to save fetching the account
+        for order_state in list(self.order_states.values()):
+            if order_state.account_id == account_update.get('owner'):
+                order_state.on_account(account_update)
+                account_name = order_state.account_name
+                break
+        else:
+            account_name = account_update.account["name"]
+
+        for worker_name in account_workers.get(account_name, ()):
+            self.dispatch(worker_name, 'onAccount', account_update)
 
     def add_worker(self, worker_name, config):
         with self.config_lock:
@@ -215,19 +549,22 @@ class WorkerInfrastructure(threading.Thread):
         """
         if worker_name and len(self.workers) > 1:
             # Kill only the specified worker
-            self.remove_market(worker_name)
             with self.config_lock:
-                account = self.config['workers'][worker_name]['account']
                 self.config['workers'].pop(worker_name)
+                worker = self.workers.pop(worker_name, None)
+                # Markets and accounts still in use by other workers stay subscribed
+                self.rebuild_index()
 
-            self.accounts.remove(account)
-            if pause:
-                self.workers[worker_name].pause()
-            self.workers.pop(worker_name, None)
+            # The orders are canceled once the worker is done with its events
+            self.dispatcher.remove(worker_name, wait=True)
+            if pause and worker is not None:
+                worker.pause()
             self.update_notify()
         else:
             # Kill all of the workers
             if pause:
+                for worker in list(self.workers):
+                    self.dispatcher.remove(worker, wait=True)
                 for worker in self.workers:
                     self.workers[worker].pause()
             if self.notify:
@@ -256,7 +593,7 @@ class WorkerInfrastructure(threading.Thread):
     @staticmethod
     def remove_offline_worker(config, worker_name):
         # Initialize the base strategy to get control over the data
-        bitshares_instance = BitShares(config['node'])
+        bitshares_instance = create_bitshares(config['node'])
         strategy = BaseStrategy(worker_name, config, bitshares_instance=bitshares_instance)
         strategy.purge()
 
@@ -0,0 +1,104 @@
+""" In-memory chain the unit tests and the benchmarks run the workers
+    against, see dexbot.backtest
+"""
+import os
+import shutil
+import tempfile
+
+from bitshares.blockchainobject import BlockchainObject
+from bitshares.instance import SharedInstance, set_shared_bitshares_instance
+from bitshares.price import Order
+
+from dexbot import storage
+from dexbot.assets import asset_registry
+from dexbot.backtest.exchange import Exchange
+from dexbot.backtest.node import SimulatedNode, CHAIN_ID
+from dexbot.backtest.simulated import SimulatedBitShares
+
+# Balances of the accounts, unless given others
+BALANCES = {'USD': 1000, 'BTS': 10000}
+
+# Settings of the relative orders workers
+RELATIVE_ORDERS = {
+    'module': 'dexbot.strategies.relative_orders',
+    'amount': 10,
+    'amount_relative': False,
+    'center_price_dynamic': True,
+    'center_price': 0,
+    'center_price_offset': False,
+    'spread': 4,
+    'manual_offset': 0
+}
+
+
+def limit_order(account, sell, sell_amount, receive, receive_amount):
+    return [1, {
+        'fee': {'amount': 0, 'asset_id': '1.3.0'},
+        'seller': account['id'],
+        'amount_to_sell': {'amount': sell_amount, 'asset_id': sell['id']},
+        'min_to_receive': {'amount': receive_amount, 'asset_id': receive['id']},
+        'expiration': '2030-01-01T00:00:00',
+        'fill_or_kill': False,
+        'extensions': []
+    }]
+
+
+class SimulatedChain:
+    """ Exchange with a BTS:USD market and a database of its own, set up as
+        the backtests do, see :class:`dexbot.backtest.engine.Backtest`
+
+        The shared bitshares instance, the database and the asset registry
+        of the process are given back by :meth:`close`.
+
+        :param dict fees: fees of the operations, none by default
+        :param dict balances: balances of the accounts added, by symbol
+        :param float price: initial price of BTS in USD
+    """
+
+    def __init__(self, fees=None, balances=None, price=0.2):
+        self.previous_instance = SharedInstance.instance
+        self.previous_storage = storage.db_worker, storage.db_reader, storage.storage_cache
+        self.previous_registry_path = asset_registry.path
+        self.data_dir = tempfile.mkdtemp(prefix='dexbot-test-')
+        self.db_worker = storage.use_database(os.path.join(self.data_dir, storage.storageDatabase))
+        asset_registry.path = None
+        self.balances = balances or BALANCES
+
+        self.exchange = Exchange(fees=fees if fees is not None else {})
+        self.usd = self.exchange.add_asset('USD', 4)
+        self.bts = self.exchange.core
+        self.book = self.exchange.add_market('USD', 'BTS')
+        self.set_price(price)
+        self.node = SimulatedNode(self.exchange)
+        self.bitshares = SimulatedBitShares(self.node)
+        # The strategies fetch their orders through the shared instance
+        set_shared_bitshares_instance(self.bitshares)
+
+    def set_price(self, price):
+        self.exchange.set_market_book(self.book, [[price * 0.999, None]], [[price * 1.001, None]])
+        self.book.latest = price
+
+    def add_account(self, name, balances=None):
+        return self.exchange.add_account(name, balances or self.balances)
+
+    def worker_config(self, account, **settings):
+        return dict(dict(RELATIVE_ORDERS, account=account, market='BTS:USD'), **settings)
+
+    def order(self, account):
+        """ Places an order of a new account far from the market, returns the
+            notification of the order
+        """
+        account = self.add_account(account)
+        self.exchange.apply_transaction([limit_order(account, self.usd, 10000, self.bts, 1000000)])
+        notifications, _ = self.exchange.collect_notifications()
+        return Order(notifications[-1][1], bitshares_instance=self.bitshares)
+
+    def close(self):
+        set_shared_bitshares_instance(self.previous_instance)
+        BlockchainObject.clear_cache()
+        with asset_registry.lock:
+            asset_registry.chains.pop(CHAIN_ID, None)
+        asset_registry.path = self.previous_registry_path
+        self.db_worker.stop()
+        storage.db_worker, storage.db_reader, storage.storage_cache = self.previous_storage
+        shutil.rmtree(self.data_dir, ignore_errors=True)
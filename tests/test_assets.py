@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+import os
+import shutil
+import tempfile
+import unittest
+
+from dexbot.assets import AssetRegistry, AssetInfo
+from dexbot.backtest.node import CHAIN_ID
+
+from simulated_chain import SimulatedChain
+
+
+class AssetRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = SimulatedChain()
+        self.addCleanup(self.chain.close)
+        self.data_dir = tempfile.mkdtemp(prefix='dexbot-test-')
+        self.addCleanup(shutil.rmtree, self.data_dir, True)
+        self.path = os.path.join(self.data_dir, 'assets', 'assets.json')
+
+    def test_round_trip(self):
+        registry = AssetRegistry(self.path)
+        usd = registry.get('USD', self.chain.bitshares)
+        self.assertEqual(usd, AssetInfo(self.chain.usd['id'], 'USD', 4))
+        self.assertEqual(usd['precision'], 4)
+        self.assertEqual(usd.to_amount(12345), 1.2345)
+        self.assertIs(registry.get(usd.id, self.chain.bitshares), usd)
+        self.assertTrue(os.path.exists(self.path))
+
+        # A new process reads the descriptors from the file, with no RPC call
+        calls = self.chain.node.calls
+        restarted = AssetRegistry(self.path)
+        self.assertEqual(restarted.get('USD', self.chain.bitshares), usd)
+        self.assertEqual(restarted.get(usd.id, self.chain.bitshares), usd)
+        self.assertEqual(self.chain.node.calls, calls)
+        self.assertEqual(set(restarted.chains), {CHAIN_ID})
+
+    def test_unreadable_file(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            f.write('{"truncated')
+        registry = AssetRegistry(self.path)
+        self.assertEqual(registry.get('USD', self.chain.bitshares).precision, 4)
+
+        # The file is written afresh
+        restarted = AssetRegistry(self.path)
+        restarted.load()
+        self.assertIn('USD', restarted.chains[CHAIN_ID])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+import time
+import unittest
+
+from bitshares.price import FilledOrder
+
+from dexbot.async_strategy import AsyncStrategy
+from dexbot.async_worker import AsyncWorkerInfrastructure
+from dexbot.worker import WorkerInfrastructure
+
+from simulated_chain import SimulatedChain, limit_order
+
+
+class Strategy(AsyncStrategy):
+    """ Keeps the fills of its orders, the worker module of the tests
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.matched = []
+        self.onOrderMatched += self.order_matched
+
+    async def order_matched(self, order):
+        self.matched.append(order)
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('Timed out')
+        time.sleep(0.01)
+
+
+class AsyncWorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = SimulatedChain()
+        self.alice = self.chain.add_account('alice')
+        self.chain.add_account('bob')
+        self.config = {'node': None, 'workers': {
+            'async': self.chain.worker_config('alice', module=__name__),
+            'sync': self.chain.worker_config('bob'),
+        }}
+        self.infrastructure = None
+
+    def tearDown(self):
+        if self.infrastructure:
+            self.infrastructure.shutdown()
+            self.infrastructure.dispatcher.shutdown(wait=True)
+        self.chain.close()
+
+    def start(self, infrastructure_class):
+        self.infrastructure = infrastructure_class(self.config, bitshares_instance=self.chain.bitshares)
+        self.infrastructure.init_workers(self.config)
+        return self.infrastructure.workers.get('async')
+
+    def test_threaded_runtime_refuses(self):
+        self.assertIsNone(self.start(WorkerInfrastructure))
+
+    def test_fills_awaited(self):
+        worker = self.start(AsyncWorkerInfrastructure)
+        self.assertIsNotNone(worker)
+
+        # Alice buys 50 BTS at 0.2 USD, filled by a trade of the market
+        self.chain.exchange.apply_transaction(
+            [limit_order(self.alice, self.chain.usd, 100000, self.chain.bts, 5000000)])
+        self.chain.exchange.market_trade(self.chain.book, 0.19, 100)
+        notifications, _ = self.chain.exchange.collect_notifications()
+        fill = [data for _, data in notifications if data.get('account_id') == self.alice['id']][0]
+        self.infrastructure.on_market(FilledOrder(fill, bitshares_instance=self.chain.bitshares))
+
+        wait_for(lambda: worker.matched)
+        self.assertEqual(worker.matched[0]['order_id'], fill['order_id'])
+
+    def test_sync_worker_stops_itself(self):
+        self.start(AsyncWorkerInfrastructure)
+        stopped = []
+
+        def handle_event(worker_name, event, data):
+            self.infrastructure.stop(worker_name)
+            stopped.append(worker_name)
+
+        self.infrastructure.handle_event = handle_event
+        self.infrastructure.update_notify = lambda: None
+        self.infrastructure.dispatch('sync', 'ontick', {})
+        wait_for(lambda: stopped)
+        self.assertNotIn('sync', self.infrastructure.dispatcher.metrics())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+import shutil
+import tempfile
+import unittest
+
+from bitshares.instance import SharedInstance
+
+from dexbot.backtest.engine import Backtest
+from dexbot.backtest.exchange import Exchange
+from dexbot.backtest.feed import Feed
+from dexbot.backtest.sweep import Sweep, SweepError, format_table, parameter_grid
+from dexbot.strategies.relative_orders import Strategy as RelativeOrders
+
+MARKET = {'type': 'market', 'base': 'USD', 'quote': 'BTS', 'base_precision': 4, 'quote_precision': 5}
+
+TEST_CONFIG = {
+    'node': 'wss://node.testnet.bitshares.eu',
+    'workers': {
+        'relative': {
+            'account': 'backtest',
+            'market': 'BTS:USD',
+            'module': 'dexbot.strategies.relative_orders',
+            'amount': 100,
+            'amount_relative': False,
+            'center_price_dynamic': True,
+            'center_price': 0,
+            'center_price_offset': False,
+            'spread': 4,
+            'manual_offset': 0
+        },
+        'staggered': {
+            'account': 'backtest',
+            'market': 'BTS:USD',
+            'module': 'dexbot.strategies.staggered_orders',
+            'amount': 100,
+            'center_price_dynamic': True,
+            'spread': 4,
+            'increment': 4,
+            'upper_bound': 0.25,
+            'lower_bound': 0.16
+        },
+        'ataxia': {
+            'account': 'backtest',
+            'market': 'BTS:USD',
+            'module': 'dexbot.strategies.ataxia',
+            'size': 10,
+            'spread': 5,
+            'increment': 2,
+            'upper_bound': 0.3,
+            'lower_bound': 0.1
+        }
+    }
+}
+
+# Least times faster than real time the backtests of the tests run, far
+# below what they reach to leave room for slow machines
+MIN_SPEEDUP = 20
+
+
+def limit_order(account, sell, sell_amount, receive, receive_amount):
+    return [1, {
+        'fee': {'amount': 0, 'asset_id': '1.3.0'},
+        'seller': account['id'],
+        'amount_to_sell': {'amount': sell_amount, 'asset_id': sell['id']},
+        'min_to_receive': {'amount': receive_amount, 'asset_id': receive['id']},
+        'expiration': '2030-01-01T00:00:00',
+        'fill_or_kill': False,
+        'extensions': []
+    }]
+
+
+class ExchangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.exchange = Exchange(fees={'limit_order_create': 0, 'limit_order_cancel': 0})
+        self.usd = self.exchange.add_asset('USD', 4)
+        self.bts = self.exchange.core
+        self.book = self.exchange.add_market('USD', 'BTS')
+        self.alice = self.exchange.add_account('alice', {'USD': 100, 'BTS': 1000})
+        self.bob = self.exchange.add_account('bob', {'USD': 100, 'BTS': 1000})
+
+    def test_resting_orders_match(self):
+        # Alice sells 100 BTS at 0.2 USD, Bob sells 12.5 USD for at least 50 BTS
+        self.exchange.apply_transaction([limit_order(self.alice, self.bts, 10000000, self.usd, 200000)])
+        self.exchange.apply_transaction([limit_order(self.bob, self.usd, 125000, self.bts, 5000000)])
+
+        # The whole 12.5 USD is sold, at the price of the resting order
+        self.assertEqual(self.exchange.balance(self.bob['id'], self.bts['id']), 106250000)
+        self.assertEqual(self.exchange.balance(self.bob['id'], self.usd['id']), 1000000 - 125000)
+        self.assertEqual(self.exchange.balance(self.alice['id'], self.usd['id']), 1000000 + 125000)
+        self.assertEqual(self.book.asks[0]['for_sale'], 3750000)
+        self.assertEqual(self.book.bids, [])
+
+    def test_market_trade_fills_resting_order(self):
+        self.exchange.apply_transaction([limit_order(self.alice, self.usd, 200000, self.bts, 10000000)])
+        # Above the price of the bid, then at it, then through it
+        self.exchange.market_trade(self.book, 0.25, 40)
+        self.assertEqual(self.exchange.balance(self.alice['id'], self.bts['id']), 100000000)
+        self.exchange.market_trade(self.book, 0.2, 40)
+        self.assertEqual(self.exchange.balance(self.alice['id'], self.bts['id']), 104000000)
+        self.exchange.market_trade(self.book, 0.15, 1000)
+        self.assertEqual(self.exchange.balance(self.alice['id'], self.bts['id']), 110000000)
+        self.assertEqual(self.book.bids, [])
+
+    def test_cancel_refunds(self):
+        op_type, result = self.exchange.apply_transaction(
+            [limit_order(self.alice, self.usd, 200000, self.bts, 10000000)])[0]
+        self.exchange.apply_transaction([[2, {
+            'fee': {'amount': 0, 'asset_id': '1.3.0'},
+            'fee_paying_account': self.alice['id'],
+            'order': result,
+            'extensions': []
+        }]])
+        self.assertEqual(self.exchange.balance(self.alice['id'], self.usd['id']), 1000000)
+        self.assertIsNone(self.exchange.get_object(result))
+
+    def test_insufficient_balance(self):
+        with self.assertRaises(Exception):
+            self.exchange.apply_transaction([limit_order(self.alice, self.usd, 2000000, self.bts, 10000000)])
+        self.assertEqual(self.exchange.balance(self.alice['id'], self.usd['id']), 1000000)
+
+
+def swinging_feed(blocks=200):
+    events = []
+    for block in range(blocks):
+        # A slow swing of the price, with trades on both sides
+        price = 0.2 * (1 + 0.05 * ((block % 100) - 50) / 50)
+        time = 1500000000 + block * 3
+        events.append({'type': 'ticker', 'time': time, 'bid': price * 0.999, 'ask': price * 1.001})
+        if block % 4 == 0:
+            events.append({'type': 'trade', 'time': time + 1, 'price': price * (1.03 if block % 8 else 0.97),
+                           'amount': 50})
+    return Feed(MARKET, events)
+
+
+class FeedTest(unittest.TestCase):
+
+    def test_arrays_round_trip(self):
+        feed = swinging_feed(8)
+        feed.events.append({'type': 'orderbook', 'time': 1500000030, 'bids': [[0.19, 10], [0.18, None]],
+                            'asks': [[0.21, 5]]})
+        feed.events.append({'type': 'block', 'time': 1500000033})
+        directory = tempfile.mkdtemp()
+        try:
+            feed.save_arrays(directory)
+            loaded = Feed.load_arrays(directory)
+            self.assertEqual(loaded.market, feed.market)
+            self.assertEqual(list(loaded.events), feed.events)
+            self.assertEqual(list(loaded.blocks(3)), list(feed.blocks(3)))
+        finally:
+            shutil.rmtree(directory)
+
+
+class BacktestTest(unittest.TestCase):
+
+    def feed(self):
+        return swinging_feed()
+
+    def test_relative_orders(self):
+        instance = SharedInstance.instance
+        result = Backtest(TEST_CONFIG, 'relative', self.feed(), {'USD': 1000, 'BTS': 5000}).run()
+
+        self.assertEqual(result['blocks'], 200)
+        self.assertGreater(result['orders_created'], 0)
+        self.assertGreater(result['fills'], 0)
+        self.assertFalse(result['disabled'])
+        self.assertGreater(result['operation_fees'], 0)
+        # The shared instance of the process is given back
+        self.assertIs(SharedInstance.instance, instance)
+
+        # Deterministic, a second run gives the same results
+        again = Backtest(TEST_CONFIG, 'relative', self.feed(), {'USD': 1000, 'BTS': 5000}).run()
+        self.assertEqual(again['end_balance'], result['end_balance'])
+
+    def check_run(self, worker_name):
+        result = Backtest(TEST_CONFIG, worker_name, self.feed(), {'USD': 1000, 'BTS': 5000}).run()
+        self.assertGreater(result['orders_created'], 0)
+        self.assertGreater(result['fills'], 0)
+        self.assertFalse(result['disabled'])
+        self.assertGreater(result['speedup'], MIN_SPEEDUP)
+        # The orders are read from the mirror, most reads with no RPC call
+        self.assertGreater(result['order_state']['avoided_rpcs'], 0)
+        return result
+
+    def test_staggered_orders(self):
+        self.check_run('staggered')
+
+    def test_ataxia(self):
+        self.check_run('ataxia')
+
+
+class SweepTest(unittest.TestCase):
+
+    def test_parameter_grid(self):
+        grid = parameter_grid(RelativeOrders.configure(), {'spread': '1:2:0.5', 'center_price_offset': 'yes,no'})
+        self.assertEqual(len(grid), 6)
+        self.assertEqual(grid[0], {'center_price_offset': True, 'spread': 1.0})
+        self.assertEqual(sorted(set(params['spread'] for params in grid)), [1.0, 1.5, 2.0])
+
+        # Values out of the limits of the settings, and unknown settings
+        with self.assertRaises(SweepError):
+            parameter_grid(RelativeOrders.configure(), {'spread': '50:150:50'})
+        with self.assertRaises(SweepError):
+            parameter_grid(RelativeOrders.configure(), {'increment': '1,2'})
+
+    def test_sweep(self):
+        sweep = Sweep(TEST_CONFIG, 'relative', swinging_feed(100), {'USD': 1000, 'BTS': 5000},
+                      {'spread': '2,4,8'}, processes=2)
+        outcomes = sweep.run()
+        self.assertEqual(sorted(outcome['params']['spread'] for outcome in outcomes), [2.0, 4.0, 8.0])
+        self.assertTrue(all(outcome['error'] is None for outcome in outcomes))
+        profits = [outcome['result']['profit_percent'] for outcome in outcomes]
+        self.assertEqual(profits, sorted(profits, reverse=True))
+        self.assertEqual(len(format_table(outcomes).splitlines()), 4)
+
+        # The same results as the backtests run one by one
+        again = Sweep(TEST_CONFIG, 'relative', swinging_feed(100), {'USD': 1000, 'BTS': 5000},
+                      {'spread': '2,4,8'}, processes=1).run()
+        self.assertEqual([outcome['result']['end_balance'] for outcome in again],
+                         [outcome['result']['end_balance'] for outcome in outcomes])
+
+
+if __name__ == '__main__':
+    unittest.main()
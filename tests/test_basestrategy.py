@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+import unittest
+
+from dexbot.strategies.relative_orders import Strategy
+
+from simulated_chain import SimulatedChain
+
+
+class BulkPlaceOrdersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = SimulatedChain()
+        self.chain.add_account('alice')
+        config = {'node': None, 'workers': {'relative': self.chain.worker_config('alice')}}
+        self.worker = Strategy(config=config, name='relative', bitshares_instance=self.chain.bitshares,
+                               clock=self.chain.exchange.now)
+        self.worker.cancel_all()
+        self.worker.clear_orders()
+
+    def tearDown(self):
+        self.chain.close()
+
+    def test_batches_saved(self):
+        place = [('buy', 10, 0.1), ('buy', 10, 0.11), ('sell', 10, 0.3)]
+        orders = self.worker.bulk_place_orders(place, batch_size=2)
+        self.assertEqual(len(orders), 3)
+        self.assertEqual(set(self.worker.fetch_orders()), {order['id'] for order in orders})
+
+    def test_failing_batch_keeps_placed_orders(self):
+        # The node rejects the second transaction, selling for nothing
+        place = [('buy', 10, 0.1), ('sell', 10, 0)]
+        with self.assertRaises(Exception):
+            self.worker.bulk_place_orders(place, batch_size=1)
+        live_orders = [order['id'] for order in self.worker.orders]
+        self.assertEqual(len(live_orders), 1)
+        self.assertEqual(list(self.worker.fetch_orders()), live_orders)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+import threading
+import time
+import unittest
+
+from dexbot.async_worker import AsyncDispatcher
+from dexbot.dispatcher import Dispatcher
+from dexbot.worker import WorkerInfrastructure
+
+from simulated_chain import SimulatedChain
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('Timed out')
+        time.sleep(0.01)
+
+
+class DispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = Dispatcher(threads=4, queue_size=2)
+        self.release = threading.Event()
+        self.handled = []
+
+    def tearDown(self):
+        self.release.set()
+        self.dispatcher.shutdown()
+
+    def block(self):
+        """ Holds the lane until the test releases it
+        """
+        self.handled.append('block')
+        self.release.wait(10)
+
+    def test_events_in_order(self):
+        for number in range(10):
+            self.dispatcher.submit('lane', self.handled.append, number)
+        self.release.set()
+        wait_for(lambda: len(self.handled) == 10)
+        self.assertEqual(self.handled, list(range(10)))
+
+    def test_only_droppable_events_dropped(self):
+        self.dispatcher.submit('lane', self.block)
+        wait_for(lambda: self.handled)
+        for number in range(3):
+            self.dispatcher.submit('lane', self.handled.append, 'tick {}'.format(number), droppable=True)
+            self.dispatcher.submit('lane', self.handled.append, 'fill {}'.format(number))
+        self.release.set()
+        wait_for(lambda: not self.dispatcher.metrics()['lane']['depth'])
+
+        self.assertEqual([event for event in self.handled if event.startswith('fill')], ['fill 0', 'fill 1', 'fill 2'])
+        self.assertEqual(self.dispatcher.metrics()['lane']['dropped'], 3)
+
+    def test_remove_waits_for_running_event(self):
+        self.dispatcher.submit('lane', self.block)
+        self.dispatcher.submit('lane', self.handled.append, 'dropped')
+        wait_for(lambda: self.handled)
+        remover = threading.Thread(target=self.dispatcher.remove, args=('lane',), kwargs={'wait': True})
+        remover.start()
+        remover.join(0.2)
+        self.assertTrue(remover.is_alive())
+        self.release.set()
+        remover.join(10)
+        self.assertFalse(remover.is_alive())
+        self.assertEqual(self.handled, ['block'])
+
+    def test_remove_from_own_lane(self):
+        self.dispatcher.submit('lane', lambda: (self.dispatcher.remove('lane', wait=True), self.handled.append(1)))
+        wait_for(lambda: self.handled)
+
+
+class AsyncDispatcherTest(DispatcherTest):
+    """ The same lanes, handled on an asyncio event loop
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.dispatcher = AsyncDispatcher(threads=4, queue_size=2)
+
+    def test_remove_from_own_coroutine(self):
+        async def handler():
+            self.dispatcher.remove('lane', wait=True)
+            self.handled.append(1)
+
+        self.dispatcher.submit('lane', handler)
+        wait_for(lambda: self.handled)
+
+
+class WorkerLaneTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = SimulatedChain()
+        self.config = {'node': None, 'workers': {}}
+        for name in ('alice', 'bob'):
+            self.chain.add_account(name)
+            self.config['workers'][name] = self.chain.worker_config(name, module='dexbot.strategies.echo')
+        self.infrastructure = WorkerInfrastructure(self.config, bitshares_instance=self.chain.bitshares)
+        self.infrastructure.init_workers(self.config)
+        # No notifications to subscribe to without a node
+        self.infrastructure.update_notify = lambda: None
+        self.release = threading.Event()
+        self.events = []
+
+    def tearDown(self):
+        self.release.set()
+        self.infrastructure.shutdown()
+        self.infrastructure.dispatcher.shutdown(wait=True)
+        self.chain.close()
+
+    def hold_lane(self, worker_name):
+        """ Runs a long handler on the lane of the worker
+        """
+        def handler():
+            self.events.append('handler started')
+            self.release.wait(10)
+            self.events.append('handler done')
+        self.infrastructure.dispatcher.submit(worker_name, handler)
+        wait_for(lambda: self.events)
+
+    def run_blocked(self, func, *args, **kwargs):
+        """ Runs the call while the lane is held, then releases it
+        """
+        thread = threading.Thread(target=func, args=args, kwargs=kwargs)
+        thread.start()
+        thread.join(0.2)
+        self.assertTrue(thread.is_alive())
+        self.release.set()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+
+    def test_stop_waits_for_lane(self):
+        worker = self.infrastructure.workers['alice']
+        worker.pause = lambda: self.events.append('paused')
+        self.hold_lane('alice')
+        self.run_blocked(self.infrastructure.stop, 'alice', pause=True)
+        self.assertEqual(self.events, ['handler started', 'handler done', 'paused'])
+        self.assertNotIn('alice', self.infrastructure.workers)
+
+    def test_reload_waits_for_lane(self):
+        old_worker = self.infrastructure.workers['alice']
+        bob = self.infrastructure.workers['bob']
+        config = {'node': None, 'workers': dict(self.config['workers'])}
+        config['workers']['alice'] = dict(config['workers']['alice'], spread=5)
+        self.hold_lane('alice')
+        self.run_blocked(self.infrastructure.reload_config, config)
+        self.assertEqual(self.events, ['handler started', 'handler done'])
+        self.assertIsNot(self.infrastructure.workers['alice'], old_worker)
+        self.assertIs(self.infrastructure.workers['bob'], bob)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+# Budget in seconds for importing the worker infrastructure, cumulated as
+# reported by python -X importtime. Loose on purpose, it catches a heavy
+# module imported at load time again rather than measuring small changes.
+IMPORT_BUDGET = 3.0
+
+# Modules only needed on first use, never to be imported at load time. Not
+# numpy, websocket-client loads it when installed.
+LAZY_MODULES = ('matplotlib', 'dexbot.graph')
+
+
+def import_times(module):
+    """ Imports the module in a fresh interpreter
+
+        :return: dict of the cumulative import time in seconds of every
+            module imported, by module name, and the names of the threads
+            running once imported
+    """
+    code = 'import threading, {}; print(",".join(t.name for t in threading.enumerate()))'.format(module)
+    with tempfile.TemporaryDirectory() as home:
+        # Keeps the database of the user out of the way
+        env = dict(os.environ, HOME=home, XDG_DATA_HOME=home)
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, universal_newlines=True, check=True
+        )
+
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        try:
+            times[name.strip()] = int(cumulative) / 1e6
+        except ValueError:
+            # The header line
+            continue
+    return times, result.stdout.strip().split(',')
+
+
+class ImportTimeTest(unittest.TestCase):
+
+    def test_basestrategy(self):
+        times, threads = import_times('dexbot.basestrategy')
+        for module in LAZY_MODULES:
+            self.assertFalse(module in times, '{} imported at load time'.format(module))
+        self.assertEqual(threads, ['MainThread'])
+        self.assertLess(times['dexbot.basestrategy'], IMPORT_BUDGET)
+
+    def test_worker(self):
+        times, threads = import_times('dexbot.worker')
+        for module in LAZY_MODULES:
+            self.assertFalse(module in times, '{} imported at load time'.format(module))
+        self.assertEqual(threads, ['MainThread'])
+        self.assertLess(times['dexbot.worker'], IMPORT_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+import math
+import unittest
+
+from dexbot import ladder
+from dexbot.strategies.ataxia import Strategy as Ataxia
+from dexbot.strategies.staggered_orders import Strategy as StaggeredOrders
+
+# (center price, amount, spread, increment, lower bound, upper bound)
+STAGGERED_CASES = [
+    (0.2, 10, 0.04, 0.04, 0.16, 0.25),
+    (1.0, 10, 0.06, 0.04, 0.001, 1000.0),
+    (1.0, 1, 0.06, 0.001, 1e-6, 1e6),
+    (250.0, 5, 0.01, 0.0001, 1e-4, 1e4),
+    # Bounds inside the spread, no rungs at all
+    (1.0, 10, 0.06, 0.04, 0.99, 1.01),
+]
+
+
+def loop_staggered(center_price, amount, spread, increment, lower_bound, upper_bound):
+    """ The ladder as the strategy built it step by step before dexbot.ladder
+    """
+    buy_prices = []
+    buy_price = center_price / math.sqrt(1 + increment + spread)
+    while buy_price > lower_bound:
+        buy_prices.append(buy_price)
+        buy_price = buy_price / (1 + increment)
+
+    sell_prices = []
+    sell_price = center_price * math.sqrt(1 + increment + spread)
+    while sell_price < upper_bound:
+        sell_prices.append(sell_price)
+        sell_price = sell_price * (1 + increment)
+
+    buy_orders = []
+    for buy_price in buy_prices:
+        current_amount = buy_orders[-1]['amount'] * math.sqrt(1 + increment) if buy_orders else amount
+        buy_orders.append({'amount': current_amount, 'price': buy_price})
+
+    sell_orders = []
+    for sell_price in sell_prices:
+        if sell_orders:
+            current_amount = sell_orders[-1]['amount'] / math.sqrt(1 + increment)
+        else:
+            current_amount = amount * math.sqrt(1 + spread + increment)
+        sell_orders.append({'amount': current_amount, 'price': sell_price})
+    return buy_orders, sell_orders
+
+
+def loop_ataxia(size, spread, increment, upper_bound, lower_bound):
+    """ The Ataxia ladder as built before dexbot.ladder
+    """
+    rungs = []
+    price = upper_bound
+    while price > lower_bound:
+        rungs.append((price, size))
+        size = size / math.sqrt(1 + spread + increment)
+        price = price * (1 - increment)
+    return rungs
+
+
+class LadderTest(unittest.TestCase):
+
+    def assertOrdersEqual(self, orders, expected):
+        self.assertEqual(len(orders), len(expected))
+        for order, expected_order in zip(orders, expected):
+            for key in ('amount', 'price'):
+                self.assertAlmostEqual(order[key] / expected_order[key], 1, places=9)
+
+    def test_staggered_matches_loop(self):
+        for case in STAGGERED_CASES:
+            with self.subTest(case=case):
+                buy_orders, sell_orders = StaggeredOrders.calculate_orders(*case)
+                expected_buy_orders, expected_sell_orders = loop_staggered(*case)
+                self.assertOrdersEqual(buy_orders, expected_buy_orders)
+                self.assertOrdersEqual(sell_orders, expected_sell_orders)
+
+                needed_base, needed_quote = ladder.staggered_required_assets(*case)
+                expected_base = sum(order['amount'] * order['price'] for order in expected_buy_orders)
+                expected_quote = sum(order['amount'] for order in expected_sell_orders)
+                self.assertTrue(math.isclose(needed_base, expected_base, rel_tol=1e-9))
+                self.assertTrue(math.isclose(needed_quote, expected_quote, rel_tol=1e-9))
+
+    def test_bound_on_a_rung(self):
+        # Powers of two, the rungs are exact: a bound on a rung excludes it
+        buy_orders, sell_orders = StaggeredOrders.calculate_orders(1.0, 10, 2, 1, 0.125, 8)
+        self.assertEqual([order['price'] for order in buy_orders], [0.5, 0.25])
+        self.assertEqual([order['price'] for order in sell_orders], [2, 4])
+        self.assertEqual(loop_staggered(1.0, 10, 2, 1, 0.125, 8), (buy_orders, sell_orders))
+
+        # Just past a rung, it is included
+        buy_orders, sell_orders = StaggeredOrders.calculate_orders(1.0, 10, 2, 1, 0.12, 8.01)
+        self.assertEqual(len(buy_orders), 3)
+        self.assertEqual(len(sell_orders), 3)
+
+    def test_first_rung_out_of_bounds(self):
+        self.assertEqual(StaggeredOrders.calculate_orders(1.0, 10, 2, 1, 0.5, 2), [[], []])
+        self.assertEqual(ladder.staggered_required_assets(1.0, 10, 2, 1, 0.5, 2), (0, 0))
+
+    def test_ataxia_matches_loop(self):
+        for case in [(10, 0.06, 0.02, 0.3, 0.1), (1, 0.05, 0.001, 1e3, 1e-3), (1, 0.05, 0.5, 1, 1)]:
+            with self.subTest(case=case):
+                rungs, reversed_rungs = Ataxia.create_ladder(*case)
+                expected = loop_ataxia(*case)
+                self.assertEqual(len(rungs), len(expected))
+                for (price, size), (expected_price, expected_size) in zip(rungs, expected):
+                    self.assertAlmostEqual(price / expected_price, 1, places=9)
+                    self.assertAlmostEqual(size / expected_size, 1, places=9)
+                self.assertEqual(reversed_rungs, rungs[::-1])
+
+    def test_invalid_ratio(self):
+        with self.assertRaises(ValueError):
+            ladder.ladder_length(1, 1, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
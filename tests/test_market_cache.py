@@ -0,0 +1,45 @@
+#!/usr/bin/python3
+import unittest
+
+from bitshares.market import Market
+from bitshares.price import Order
+
+from dexbot.worker import WorkerInfrastructure
+
+from simulated_chain import SimulatedChain
+
+
+class MarketCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = SimulatedChain()
+        self.infrastructure = WorkerInfrastructure({'node': None, 'workers': {}},
+                                                   bitshares_instance=self.chain.bitshares)
+        self.infrastructure.init_workers(self.infrastructure.config)
+        self.cache = self.infrastructure.market_cache
+        self.market = Market('BTS:USD', bitshares_instance=self.chain.bitshares)
+
+    def tearDown(self):
+        self.infrastructure.shutdown()
+        self.chain.close()
+
+    def test_cached_until_block(self):
+        self.cache.orderbook(self.market)
+        self.cache.orderbook(self.market)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+        self.infrastructure.on_block(self.chain.exchange.produce_block())
+        self.cache.orderbook(self.market)
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+    def test_deleted_order_invalidates(self):
+        self.cache.orderbook(self.market)
+        # The notification of a canceled order tells its id only
+        deleted = Order('1.7.1000', bitshares_instance=self.chain.bitshares)
+        self.assertTrue(deleted['deleted'])
+        self.infrastructure.on_market(deleted)
+        self.cache.orderbook(self.market)
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+import unittest
+from unittest import mock
+
+from grapheneapi.exceptions import NumRetriesReached
+
+from dexbot import node_pool
+from dexbot.backtest.exchange import Exchange
+from dexbot.backtest.node import SimulatedNode
+
+from simulated_chain import limit_order
+
+
+class DroppingNode:
+    """ Connection to a node of the simulated exchange which can be dropped,
+        right before or right after a call is handled
+    """
+
+    def __init__(self, exchange):
+        self.node = SimulatedNode(exchange)
+        self.down = False
+        self.drop_after_call = False
+
+    def __getattr__(self, name):
+        method = getattr(self.node, name)
+
+        def call(*args, **kwargs):
+            if self.down:
+                raise NumRetriesReached('Connection lost')
+            result = method(*args, **kwargs)
+            if self.drop_after_call:
+                self.down = True
+                raise NumRetriesReached('Connection lost')
+            return result
+        return call
+
+
+class PoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.exchange = Exchange(fees={})
+        self.usd = self.exchange.add_asset('USD', 4)
+        self.alice = self.exchange.add_account('alice', {'USD': 100, 'BTS': 1000})
+        self.nodes = {url: DroppingNode(self.exchange) for url in ('ws://first', 'ws://second')}
+        # The connections of the pool go to the nodes of the simulated exchange
+        connect = mock.patch.object(node_pool.Node, 'connect', lambda node: self.nodes[node.url])
+        connect.start()
+        self.addCleanup(connect.stop)
+        self.pool = node_pool.NodePool(list(self.nodes), probe_interval=60)
+        self.addCleanup(self.pool.close)
+        self.active = self.nodes[self.pool.url]
+
+    def test_failover(self):
+        self.active.down = True
+        self.assertEqual(self.pool.get_dynamic_global_properties()['id'], '2.1.0')
+        self.assertIsNot(self.nodes[self.pool.url], self.active)
+
+    def test_broadcast_not_retried(self):
+        # The node accepts the transaction, then drops the connection
+        self.active.drop_after_call = True
+        transaction = {'operations': [limit_order(self.alice, self.usd, 10000, self.exchange.core, 100000)]}
+        with self.assertRaises(NumRetriesReached):
+            self.pool.broadcast_transaction_synchronous(transaction)
+        self.assertEqual(self.exchange.orders_created, 1)
+        # The calls after it go to the other node
+        self.assertEqual(len(self.pool.get_objects([self.alice['id']])), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
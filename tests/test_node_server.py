@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+import json
+import threading
+import time
+import unittest
+
+import websocket
+from bitsharesapi.websocket import BitSharesWebsocket
+
+from dexbot.backtest.exchange import Exchange
+from dexbot.backtest.node import CHAIN_ID
+from dexbot.backtest.server import NodeServer, RandomMarket
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('Timed out')
+        time.sleep(0.01)
+
+
+class NodeServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.exchange = Exchange()
+        self.usd = self.exchange.add_asset('USD', 4)
+        self.alice = self.exchange.add_account('alice', {'USD': 100, 'BTS': 1000})
+        # Blocks produced by the test
+        self.server = NodeServer(self.exchange, block_interval=0,
+                                 markets=[RandomMarket('USD', 'BTS', 0.2, trade_probability=0, seed=1)]).start()
+        self.ws = websocket.create_connection(self.server.url)
+        self.request_id = 0
+
+    def tearDown(self):
+        self.ws.close()
+        self.server.stop()
+
+    def call(self, name, *args):
+        self.request_id += 1
+        self.ws.send(json.dumps({'method': 'call', 'params': [0, name, list(args)], 'jsonrpc': '2.0',
+                                 'id': self.request_id}))
+        reply = json.loads(self.ws.recv())
+        self.assertEqual(reply['id'], self.request_id)
+        return reply
+
+    def test_calls(self):
+        self.assertEqual(self.call('get_chain_properties')['result']['chain_id'], CHAIN_ID)
+        self.assertEqual(self.call('lookup_asset_symbols', ['USD'])['result'][0]['id'], self.usd['id'])
+        ticker = self.call('get_ticker', 'USD', 'BTS')['result']
+        self.assertAlmostEqual(float(ticker['latest']), 0.2, places=2)
+        self.assertIn('error', self.call('get_witness_by_account', 'alice'))
+
+    def test_subscriptions(self):
+        events = {'block': [], 'market': [], 'account': []}
+        notify = BitSharesWebsocket(
+            self.server.url,
+            accounts=['alice'],
+            markets=[[self.usd['id'], '1.3.0']],
+            on_block=events['block'].append,
+            on_market=events['market'].append,
+            on_account=events['account'].append
+        )
+        thread = threading.Thread(target=notify.run_forever, daemon=True)
+        thread.start()
+        try:
+            wait_for(lambda: any(connection.block_callback is not None for connection in self.server.connections))
+
+            # Alice buys 100 BTS at 0.2 USD, below the ask of the market
+            reply = self.call('broadcast_transaction_synchronous', {'operations': [[1, {
+                'fee': {'amount': 0, 'asset_id': '1.3.0'},
+                'seller': self.alice['id'],
+                'amount_to_sell': {'amount': 200000, 'asset_id': self.usd['id']},
+                'min_to_receive': {'amount': 10000000, 'asset_id': '1.3.0'},
+                'expiration': '2030-01-01T00:00:00',
+                'fill_or_kill': False,
+                'extensions': []
+            }]]})
+            order_id = reply['result']['trx']['operation_results'][0][1]
+            block_id = self.server.produce_block()
+
+            wait_for(lambda: events['block'] and events['market'] and events['account'])
+            self.assertEqual(events['block'][-1], block_id)
+            self.assertEqual(events['market'][0][0]['id'], order_id)
+            self.assertEqual(events['account'][0]['owner'], self.alice['id'])
+        finally:
+            notify.close()
+            thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
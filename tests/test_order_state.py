@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+import threading
+import unittest
+
+from dexbot.order_state import OrderState
+
+from simulated_chain import SimulatedChain, limit_order
+
+
+class BlockingRPC:
+    """ RPC of the simulated node whose get_objects calls wait until they
+        are released
+    """
+
+    def __init__(self, node):
+        self.node = node
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def get_objects(self, ids, **kwargs):
+        self.entered.set()
+        self.release.wait(10)
+        return self.node.get_objects(ids, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.node, name)
+
+
+class OrderStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = SimulatedChain()
+        self.addCleanup(self.chain.close)
+        self.account = self.chain.add_account('alice')
+        self.order_state = OrderState('alice', self.chain.bitshares)
+
+    def place_order(self):
+        # Far from the market, the order stays open
+        self.chain.exchange.apply_transaction([
+            limit_order(self.account, self.chain.usd, 10000, self.chain.bts, 1000000)])
+
+    def notify(self):
+        """ Passes the account notification on, as the worker infrastructure does
+        """
+        self.chain.exchange.collect_notifications()
+        statistics_id = self.order_state.statistics_id
+        self.order_state.on_account(self.chain.node.get_objects([statistics_id])[0])
+
+    def full_account_orders(self):
+        full_account = self.chain.node.get_full_accounts(['alice'], False)[0][1]
+        return sorted(order['id'] for order in full_account['limit_orders'])
+
+    def test_replay(self):
+        self.place_order()
+        self.assertEqual(len(self.order_state.limit_orders()), 1)
+        self.place_order()
+        self.place_order()
+        self.notify()
+        orders = self.order_state.limit_orders()
+        self.assertEqual(sorted(order['id'] for order in orders), self.full_account_orders())
+        stats = self.order_state.stats()
+        self.assertEqual(stats['resyncs'], 1)
+        self.assertEqual(stats['replayed_operations'], 2)
+
+        # Nothing new, no RPC call
+        self.order_state.limit_orders()
+        self.assertEqual(self.order_state.stats()['avoided_rpcs'], 1)
+
+    def test_rpcs_outside_lock(self):
+        self.order_state.limit_orders()
+        self.place_order()
+        self.notify()
+        rpc = BlockingRPC(self.chain.node)
+        self.chain.bitshares.rpc = rpc
+        reader = threading.Thread(target=self.order_state.limit_orders)
+        reader.start()
+        try:
+            self.assertTrue(rpc.entered.wait(10))
+            # The notifications are handled while the replay waits for the node
+            notified = threading.Thread(target=self.order_state.on_block)
+            notified.start()
+            notified.join(5)
+            self.assertFalse(notified.is_alive())
+        finally:
+            rpc.release.set()
+            reader.join(10)
+        self.assertEqual(self.order_state.stats()['replayed_operations'], 1)
+        self.assertEqual(len(self.order_state.limit_orders()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
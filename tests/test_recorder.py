@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+from bitshares.blockchainobject import BlockchainObject
+from bitshares.instance import SharedInstance, set_shared_bitshares_instance
+from bitshares.market import Market
+from bitshares.price import FilledOrder, Order
+
+from dexbot.backtest.exchange import Exchange
+from dexbot.backtest.node import SimulatedNode
+from dexbot.backtest.simulated import SimulatedBitShares
+from dexbot.market_cache import MarketCache
+from dexbot.recorder import MarketRecorder, MarketData, MarketDataFile, unique_trades
+
+# 2018-06-01T00:00:00 UTC
+START = 1527811200
+
+
+class Clock:
+
+    def __init__(self, time):
+        self.time = time
+
+    def __call__(self):
+        return self.time
+
+
+class RecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        BlockchainObject.clear_cache()
+        self.path = tempfile.mkdtemp()
+        self.exchange = Exchange()
+        self.exchange.add_asset('USD', 4)
+        self.book = self.exchange.add_market('USD', 'BTS')
+        self.alice = self.exchange.add_account('alice', {'USD': 100, 'BTS': 1000})
+        self.bitshares = SimulatedBitShares(SimulatedNode(self.exchange))
+        # The fills look their assets up through the shared instance
+        self.shared_instance = SharedInstance.instance
+        set_shared_bitshares_instance(self.bitshares)
+        self.market = Market('BTS:USD', bitshares_instance=self.bitshares)
+        self.clock = Clock(START)
+        self.recorder = MarketRecorder(self.path, ticker_interval=2, chunk_rows=3, clock=self.clock)
+        self.recorder.set_markets([self.market])
+
+    def tearDown(self):
+        set_shared_bitshares_instance(self.shared_instance)
+        shutil.rmtree(self.path)
+
+    def notifications(self):
+        notifications, _ = self.exchange.collect_notifications()
+        return [
+            FilledOrder(item, blockchain_instance=self.bitshares) if 'pays' in item else
+            Order(item, blockchain_instance=self.bitshares)
+            for _, item in notifications
+        ]
+
+    def test_round_trip(self):
+        market_cache = MarketCache()
+        self.exchange.set_market_book(self.book, [[0.19, None]], [[0.21, None]])
+        for block in range(5):
+            self.clock.time = START + block * 3
+            block_id = self.exchange.produce_block(self.clock.time)
+            market_cache.on_block(block_id)
+            self.recorder.on_block(block_id, market_cache)
+
+        # Alice buys 100 BTS at 0.2 USD, half of it is sold to her
+        self.exchange.apply_transaction([[1, {
+            'fee': {'amount': 0, 'asset_id': '1.3.0'},
+            'seller': self.alice['id'],
+            'amount_to_sell': {'amount': 200000, 'asset_id': self.exchange.asset('USD')['id']},
+            'min_to_receive': {'amount': 10000000, 'asset_id': '1.3.0'},
+            'expiration': '2030-01-01T00:00:00',
+            'fill_or_kill': False,
+            'extensions': []
+        }]])
+        self.exchange.market_trade(self.book, 0.2, 50)
+        for update in self.notifications():
+            self.recorder.on_market(update)
+        self.recorder.on_account(self.exchange.get_object(self.alice['statistics']))
+        self.recorder.close()
+
+        data = MarketData(self.path)
+        self.assertEqual(data.markets(), ['BTS:USD'])
+        self.assertEqual(data.market('BTS:USD')['base_precision'], 4)
+        self.assertEqual(data.days('BTS:USD'), ['2018-06-01'])
+
+        blocks = data.read('BTS:USD', 'block')
+        self.assertEqual(blocks['block_num'].tolist(), [1, 2, 3, 4, 5])
+        tickers = data.read('BTS:USD', 'ticker')
+        self.assertEqual(len(tickers['time']), 3)
+        self.assertAlmostEqual(tickers['bid'][0], 0.19)
+        self.assertAlmostEqual(tickers['ask'][0], 0.21)
+
+        orders = data.read('BTS:USD', 'order')
+        self.assertEqual(orders['side'].tolist(), [1])
+        self.assertAlmostEqual(orders['price'][0], 0.2)
+        self.assertAlmostEqual(orders['amount'][0], 100)
+
+        # The fill of alice's order, and the trade of the market
+        trades = data.read('BTS:USD', 'trade')
+        self.assertEqual(len(trades['time']), 2)
+        self.assertAlmostEqual(trades['price'][0], 0.2)
+        self.assertAlmostEqual(trades['amount'][0], 50)
+        self.assertEqual(trades['side'][0], 1)
+
+        accounts = data.read('accounts', 'account')
+        self.assertEqual(accounts['account'].tolist(), [int(self.alice['id'].split('.')[2])])
+
+        # Time ranges skip the rows out of them
+        self.assertEqual(data.read('BTS:USD', 'block', START + 3, START + 9)['block_num'].tolist(), [2, 3])
+
+        feed = data.feed('BTS:USD')
+        self.assertEqual(feed.base, 'USD')
+        self.assertEqual([event['type'] for event in feed.events].count('block'), 5)
+        self.assertEqual([event['type'] for event in feed.events].count('ticker'), 3)
+
+    def trade(self, is_maker):
+        """ Records the fills of a trade between alice and bob
+        """
+        bob = self.exchange.add_account('bob', {'USD': 100, 'BTS': 1000})
+        usd = self.exchange.asset('USD')['id']
+        self.exchange.set_market_book(self.book, [[0.1, None]], [[0.3, None]])
+        self.clock.time = START
+        self.recorder.on_block(self.exchange.produce_block(self.clock.time), MarketCache())
+
+        # Alice buys 100 BTS at 0.2 USD, bob sells her 50 of them
+        for account, sell, sell_amount, receive, receive_amount in (
+                (self.alice, usd, 200000, '1.3.0', 10000000), (bob, '1.3.0', 5000000, usd, 100000)):
+            self.exchange.apply_transaction([[1, {
+                'fee': {'amount': 0, 'asset_id': '1.3.0'},
+                'seller': account['id'],
+                'amount_to_sell': {'amount': sell_amount, 'asset_id': sell},
+                'min_to_receive': {'amount': receive_amount, 'asset_id': receive},
+                'expiration': '2030-01-01T00:00:00',
+                'fill_or_kill': False,
+                'extensions': []
+            }]])
+        self.clock.time = START + 1
+        for update in self.notifications():
+            if not is_maker:
+                update.pop('is_maker', None)
+            self.recorder.on_market(update)
+        self.recorder.close()
+
+        data = MarketData(self.path)
+        trades = [event for event in data.events('BTS:USD') if event['type'] == 'trade']
+        return data.read('BTS:USD', 'trade'), trades
+
+    def test_trade_once(self):
+        fills, trades = self.trade(is_maker=True)
+        self.assertEqual(sorted(fills['maker'].tolist()), [0, 1])
+        self.assertEqual(len(trades), 1)
+        self.assertAlmostEqual(trades[0]['amount'], 50)
+        self.assertAlmostEqual(trades[0]['price'], 0.2)
+
+    def test_trade_once_without_maker(self):
+        fills, trades = self.trade(is_maker=False)
+        self.assertEqual(fills['maker'].tolist(), [-1, -1])
+        self.assertEqual(len(trades), 1)
+        self.assertAlmostEqual(trades[0]['amount'], 50)
+
+        # The fill of alice's order, placed first, is the one kept
+        keep = unique_trades(fills, numpy.array([START]))
+        self.assertEqual(fills['order'][keep].tolist(), [min(fills['order'].tolist())])
+        self.assertEqual(fills['side'][keep].tolist(), [1])
+
+    def test_incomplete_chunk_is_dropped(self):
+        for block in range(3):
+            self.recorder.writer.append('BTS_USD', 'block', (START + block, block))
+        path = self.recorder.writer.file_path('BTS_USD', '2018-06-01')
+        with open(path, 'ab') as fd:
+            fd.write(b'DXMC\x01\x00garbage')
+
+        with MarketDataFile(path) as data:
+            self.assertEqual(data.read('block')['block_num'].tolist(), [0, 1, 2])
+
+        # Appended by another recorder, as after a restart
+        recorder = MarketRecorder(self.path, chunk_rows=1, clock=self.clock)
+        recorder.writer.append('BTS_USD', 'block', (START + 3, 3))
+        with MarketDataFile(path) as data:
+            self.assertEqual(data.read('block')['block_num'].tolist(), [0, 1, 2, 3])
+        self.assertEqual(os.path.getsize(path), data.length)
+
+
+if __name__ == '__main__':
+    unittest.main()
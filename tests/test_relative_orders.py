@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+import unittest
+
+from dexbot.strategies.relative_orders import Strategy
+
+from simulated_chain import SimulatedChain
+
+
+class RelativeOrdersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = SimulatedChain()
+        self.chain.add_account('alice')
+
+    def tearDown(self):
+        self.chain.close()
+
+    def worker(self, **settings):
+        config = {'node': None, 'workers': {'relative': self.chain.worker_config('alice', **settings)}}
+        return Strategy(config=config, name='relative', bitshares_instance=self.chain.bitshares,
+                        clock=self.chain.exchange.now)
+
+    def test_orders_kept(self):
+        worker = self.worker()
+        self.assertEqual(len(worker['order_ids']), 2)
+        self.assertEqual(self.chain.exchange.orders_created, 2)
+        worker.update_orders()
+        self.assertEqual(self.chain.exchange.orders_created, 2)
+        self.assertEqual(self.chain.exchange.orders_canceled, 0)
+
+    def test_relative_amounts_kept(self):
+        # The funds of the live orders count towards their size
+        worker = self.worker(amount_relative=True, amount=10)
+        worker.update_orders()
+        self.assertEqual(self.chain.exchange.orders_created, 2)
+
+    def test_filled_at_once_placed_on_next_block(self):
+        # The buy order crosses the asks of the market and is filled at once
+        worker = self.worker(center_price_dynamic=False, center_price=0.3)
+        self.assertEqual(self.chain.exchange.orders_created, 2)
+        self.assertEqual(len(worker['order_ids']), 1)
+        self.assertTrue(worker.recheck_orders)
+
+        worker.ontick(self.chain.exchange.produce_block())
+        self.assertEqual(self.chain.exchange.orders_created, 3)
+        worker.ontick(self.chain.exchange.produce_block())
+        self.assertEqual(self.chain.exchange.orders_created, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+import os
+import queue
+import signal
+import types
+import unittest
+from unittest import mock
+
+from dexbot import cli
+from dexbot.shards import ShardSupervisor
+
+
+def worker(account):
+    return {'account': account, 'market': 'BTS:USD', 'module': 'dexbot.strategies.echo'}
+
+
+CONFIG = {
+    'node': None,
+    'workers': {'alice-1': worker('alice'), 'alice-2': worker('alice'), 'bob-1': worker('bob')}
+}
+
+
+class RunningProcess:
+
+    def __init__(self):
+        self.terminated = False
+
+    def is_alive(self):
+        return not self.terminated
+
+    def terminate(self):
+        self.terminated = True
+
+
+class ReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.supervisor = ShardSupervisor(CONFIG, 2)
+        # Shard processes as started by the supervisor
+        for shard in self.supervisor.shards:
+            shard.process = RunningProcess()
+            shard.commands = queue.Queue()
+        self.alice_shard, self.bob_shard = self.supervisor.shards
+
+    def reloaded(self, shard):
+        command, config = shard.commands.get_nowait()
+        self.assertEqual(command, 'reload')
+        return sorted(config['workers'])
+
+    def test_accounts_keep_their_shard(self):
+        config = {'node': None, 'workers': dict(CONFIG['workers'])}
+        del config['workers']['alice-2']
+        config['workers']['bob-2'] = worker('bob')
+        config['workers']['carol-1'] = worker('carol')
+        self.supervisor.reload_config(config)
+        self.assertEqual(self.reloaded(self.alice_shard), ['alice-1', 'carol-1'])
+        self.assertEqual(self.reloaded(self.bob_shard), ['bob-1', 'bob-2'])
+
+    def test_shard_without_workers(self):
+        config = {'node': None, 'workers': {'alice-1': worker('alice')}}
+        self.supervisor.reload_config(config)
+        self.assertEqual(self.reloaded(self.alice_shard), ['alice-1'])
+        self.assertTrue(self.bob_shard.process.terminated)
+        self.assertFalse(self.bob_shard.enabled)
+
+        # Started again once it gets workers
+        self.supervisor.reload_config(CONFIG)
+        self.assertTrue(self.bob_shard.enabled)
+        self.assertIsNotNone(self.bob_shard.restart_at)
+        self.assertEqual(sorted(self.bob_shard.config['workers']), ['bob-1'])
+
+    def test_empty_config_ignored(self):
+        self.supervisor.reload_config({'node': None, 'workers': {}})
+        self.assertTrue(self.alice_shard.commands.empty())
+        self.assertEqual(self.supervisor.config, CONFIG)
+
+
+@unittest.skipUnless(hasattr(signal, 'SIGUSR1'), 'SIGUSR1 is UNIX-only')
+class ReloadSignalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.handlers = {number: signal.getsignal(number)
+                         for number in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGUSR1)}
+
+    def tearDown(self):
+        for number, handler in self.handlers.items():
+            signal.signal(number, handler)
+
+    def test_sigusr1_reloads_shards(self):
+        reloaded = []
+        jobs_on_signal = []
+
+        class Supervisor(ShardSupervisor):
+
+            def run(self):
+                os.kill(os.getpid(), signal.SIGUSR1)
+                # The reload is left to the loop of the supervisor
+                jobs_on_signal.append(len(self.jobs))
+                for job in self.jobs:
+                    job()
+
+        ctx = types.SimpleNamespace(
+            config=CONFIG,
+            bitshares=types.SimpleNamespace(wallet=types.SimpleNamespace(masterpassword=None)),
+            obj={'systemd': False, 'configfile': 'config.yml'}
+        )
+        with mock.patch.object(cli, 'ShardSupervisor', Supervisor), \
+                mock.patch.object(cli, 'reload_config', lambda ctx, worker: reloaded.append(worker)):
+            cli.run_shards(ctx, 2)
+        self.assertEqual(jobs_on_signal, [1])
+        self.assertEqual(len(reloaded), 1)
+        self.assertIsInstance(reloaded[0], Supervisor)
+
+if __name__ == '__main__':
+    unittest.main()
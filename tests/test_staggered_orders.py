@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+import unittest
+
+from bitshares.price import FilledOrder
+
+from dexbot.strategies.staggered_orders import Strategy
+
+from simulated_chain import SimulatedChain, limit_order
+
+STAGGERED_ORDERS = {
+    'module': 'dexbot.strategies.staggered_orders',
+    'amount': 10,
+    'center_price_dynamic': True,
+    'spread': 4,
+    'increment': 4,
+    'upper_bound': 0.25,
+    'lower_bound': 0.16
+}
+
+
+class StaggeredOrdersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = SimulatedChain()
+
+    def tearDown(self):
+        self.chain.close()
+
+    def worker(self, balances=None):
+        self.account = self.chain.add_account('alice', balances)
+        config = {'node': None, 'workers': {'staggered': dict(STAGGERED_ORDERS, account='alice', market='BTS:USD')}}
+        return Strategy(config=config, name='staggered', bitshares_instance=self.chain.bitshares,
+                        clock=self.chain.exchange.now)
+
+    def market_fills(self, price, amount):
+        """ Plays a trade of the market, returns the fills of the worker's orders
+        """
+        self.chain.exchange.market_trade(self.chain.book, price, amount)
+        notifications, _ = self.chain.exchange.collect_notifications()
+        return [FilledOrder(data, bitshares_instance=self.chain.bitshares) for _, data in notifications
+                if data.get('account_id') == self.account['id']]
+
+    def test_fill_places_reverse_order(self):
+        worker = self.worker()
+        orders = worker.fetch_orders()
+        self.assertEqual(len(orders), len(worker.orders))
+
+        fills = self.market_fills(0.19, 1000)
+        self.assertTrue(fills)
+        for fill in fills:
+            worker.onMarketUpdate(fill)
+        self.assertTrue(worker.recheck_orders)
+
+        created = self.chain.exchange.orders_created
+        worker.ontick(self.chain.exchange.produce_block())
+        self.assertFalse(worker.recheck_orders)
+        self.assertEqual(self.chain.exchange.orders_created, created + len(fills))
+        self.assertEqual(len(worker.fetch_orders()), len(orders))
+
+    def test_fill_without_saved_orders(self):
+        # Without funds the ladder is never placed, nor any order saved
+        worker = self.worker({'USD': 0.01, 'BTS': 1})
+        self.assertTrue(worker.disabled)
+        self.assertIsNone(worker.fetch_orders())
+
+        # Bob buys 50 BTS at 0.2 USD, filled by the market
+        self.account = self.chain.add_account('bob')
+        self.chain.exchange.apply_transaction(
+            [limit_order(self.account, self.chain.usd, 100000, self.chain.bts, 5000000)])
+        fills = self.market_fills(0.19, 1000)
+        self.assertTrue(fills)
+        worker.on_order_matched(fills[0])
+        self.assertFalse(worker.recheck_orders)
+        worker.check_orders()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+import os
+import shutil
+import concurrent.futures
+import datetime
+import sqlite3
+import threading
+import tempfile
+import unittest
+
+from dexbot import storage
+from dexbot.storage import Config, DatabaseReader, DatabaseWorker, LazyDatabaseWorker, Storage, StorageCache
+
+
+class DatabaseWorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp(prefix='dexbot-test-')
+        self.path = os.path.join(self.data_dir, 'test.sqlite')
+        # Large batches, so that all the writes of a test are committed together
+        self.worker = DatabaseWorker(batch_size=100, batch_latency=60, path=self.path)
+
+    def tearDown(self):
+        self.worker.stop()
+        shutil.rmtree(self.data_dir)
+
+    def test_failing_write_rolled_back_alone(self):
+        def failing_write():
+            self.worker.session.add(Config('test', 'partial', '1'))
+            raise ValueError('failing write')
+
+        self.worker.set_item('test', 'before', 1)
+        self.worker.execute_noreturn(failing_write)
+        self.worker.set_item('test', 'after', 2)
+        self.worker.flush()
+
+        self.assertEqual(self.worker.get_item('test', 'before'), 1)
+        self.assertEqual(self.worker.get_item('test', 'after'), 2)
+        self.assertFalse(self.worker.contains('test', 'partial'))
+
+    def test_writes_survive_restart(self):
+        self.worker.set_item('test', 'key', {'value': 1})
+        self.worker.save_order('worker', '1.7.1', {'id': '1.7.1'})
+        self.worker.stop()
+        self.worker = DatabaseWorker(path=self.path)
+        self.assertEqual(self.worker.get_item('test', 'key'), {'value': 1})
+        self.assertEqual(self.worker.fetch_orders('worker'), {'1.7.1': {'id': '1.7.1'}})
+
+    def test_configure(self):
+        self.worker.set_item('test', 'key', 1)
+        self.worker.configure({'cache_size': -4096})
+        self.worker.set_item('test', 'key', 2)
+        self.assertEqual(self.worker.get_item('test', 'key'), 2)
+
+
+class FutureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp(prefix='dexbot-test-')
+        self.worker = DatabaseWorker(batch_size=100, batch_latency=60, path=os.path.join(self.data_dir, 'test.sqlite'))
+
+    def tearDown(self):
+        self.worker.stop()
+        shutil.rmtree(self.data_dir)
+
+    def test_result(self):
+        self.worker.set_item('test', 'key', {'value': 1})
+        future = self.worker.submit(self.worker._get_item, 'test', 'key')
+        self.assertIsInstance(future, concurrent.futures.Future)
+        self.assertEqual(future.result(10), {'value': 1})
+
+    def test_error_through_future(self):
+        def failing_read():
+            raise ValueError('failing read')
+
+        future = self.worker.submit(failing_read)
+        self.assertIsInstance(future.exception(10), ValueError)
+        with self.assertRaises(ValueError):
+            self.worker.execute(failing_read)
+        # The database thread carries on
+        self.worker.set_item('test', 'key', 1)
+        self.assertEqual(self.worker.get_item('test', 'key'), 1)
+
+    def test_read_flushes_queued_writes(self):
+        def committed_value():
+            # Read on a connection of its own, it sees committed writes only
+            connection = sqlite3.connect(self.worker.session.get_bind().url.database)
+            try:
+                return connection.execute("SELECT value FROM config WHERE key = 'key'").fetchall()
+            finally:
+                connection.close()
+
+        self.worker.set_item('test', 'key', 1)
+        self.assertEqual(self.worker.execute(committed_value), [('1',)])
+
+    def test_concurrent_readers(self):
+        results = {}
+
+        def read(number):
+            self.worker.set_item('test', number, number)
+            results[number] = self.worker.get_item('test', number)
+
+        threads = [threading.Thread(target=read, args=(number,)) for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(results, {number: number for number in range(8)})
+
+
+class StorageCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp(prefix='dexbot-test-')
+        self.previous = storage.db_worker, storage.db_reader, storage.storage_cache
+        self.worker = storage.use_database(os.path.join(self.data_dir, 'test.sqlite'))
+
+    def tearDown(self):
+        self.worker.stop()
+        storage.db_worker, storage.db_reader, storage.storage_cache = self.previous
+        shutil.rmtree(self.data_dir)
+
+    def database_value(self, key):
+        return self.worker.get_item('worker', key)
+
+    def test_write_seen_by_next_read(self):
+        worker_storage = Storage('worker')
+        worker_storage['key'] = {'value': 1}
+        self.assertEqual(storage.storage_cache.lookup('worker', 'key'), (True, '{"value": 1}'))
+        self.assertEqual(worker_storage['key'], {'value': 1})
+        worker_storage['key'] = {'value': 2}
+        self.assertEqual(worker_storage['key'], {'value': 2})
+        self.assertEqual(self.database_value('key'), {'value': 2})
+        # Each read gets its own copy
+        worker_storage['key']['value'] = 3
+        self.assertEqual(worker_storage['key'], {'value': 2})
+
+    def test_delete_evicts(self):
+        worker_storage = Storage('worker')
+        worker_storage['key'] = 1
+        del worker_storage['key']
+        self.assertNotIn('key', worker_storage)
+        self.assertIsNone(worker_storage['key'])
+        self.assertIsNone(self.database_value('key'))
+
+    def test_clear(self):
+        worker_storage = Storage('worker')
+        worker_storage['a'] = 1
+        worker_storage.clear()
+        self.assertEqual(worker_storage.items(), [])
+        self.assertNotIn('a', worker_storage)
+
+    def test_stale_read_not_cached(self):
+        cache = StorageCache()
+        generation = cache.generation('worker')
+        # A write lands while the read of the old value is under way
+        cache.set('worker', 'key', '2')
+        cache.fill('worker', 'key', '1', generation)
+        self.assertEqual(cache.lookup('worker', 'key'), (True, '2'))
+        cache.fill_category('worker', [('key', '1')], generation)
+        self.assertNotIn('worker', cache.complete)
+
+    def test_new_database_drops_entries(self):
+        Storage('worker')['key'] = 1
+        self.worker.stop()
+        self.worker = storage.use_database(os.path.join(self.data_dir, 'other.sqlite'))
+        self.assertEqual(storage.storage_cache.lookup('worker', 'key'), (False, None))
+        self.assertIsNone(Storage('worker')['key'])
+
+
+class DatabaseReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp(prefix='dexbot-test-')
+        self.path = os.path.join(self.data_dir, 'test.sqlite')
+        self.worker = LazyDatabaseWorker(batch_size=100, batch_latency=60, path=self.path)
+        self.reader = DatabaseReader(self.path, self.worker)
+
+    def tearDown(self):
+        self.worker.stop()
+        shutil.rmtree(self.data_dir)
+
+    def test_sees_queued_writes(self):
+        start = datetime.datetime.now() - datetime.timedelta(minutes=1)
+        self.worker.execute_noreturn(self.worker.save_journal, 'test', [('price', 0.2), ('base', 10)])
+        self.worker.execute_noreturn(self.worker.save_log, 'test', 1, 'message', datetime.datetime.now())
+        journal = self.reader.query_journal('test', start)
+        self.assertEqual(sorted((row.key, row.amount) for row in journal), [('base', 10), ('price', 0.2)])
+        self.assertEqual([row.message for row in self.reader.query_log('test', start)], ['message'])
+
+    def test_fresh_database(self):
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(self.reader.query_journal('test', datetime.datetime(2000, 1, 1)), [])
+
+    def test_fresh_storage(self):
+        previous = storage.db_worker, storage.db_reader, storage.storage_cache
+        try:
+            worker = storage.use_database(os.path.join(self.data_dir, 'fresh.sqlite'))
+            self.assertEqual(Storage('worker').query_journal(datetime.datetime(2000, 1, 1)), [])
+            self.assertEqual(Storage('worker').query_log(datetime.datetime(2000, 1, 1)), [])
+            worker.stop()
+        finally:
+            storage.db_worker, storage.db_reader, storage.storage_cache = previous
+
+
+class MigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp(prefix='dexbot-test-')
+        self.path = os.path.join(self.data_dir, 'test.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_duplicates_keep_live_row(self):
+        # A database of the former schema, without the unique indexes
+        connection = sqlite3.connect(self.path)
+        connection.executescript('''
+            CREATE TABLE config (id INTEGER PRIMARY KEY, category VARCHAR, key VARCHAR, value VARCHAR);
+            CREATE TABLE orders (id INTEGER PRIMARY KEY, worker VARCHAR, order_id VARCHAR, "order" VARCHAR);
+            INSERT INTO config (category, key, value) VALUES ('test', 'key', '"live"');
+            INSERT INTO config (category, key, value) VALUES ('test', 'key', '"stale"');
+            INSERT INTO config (category, key, value) VALUES ('test', 'other', '1');
+            INSERT INTO orders (worker, order_id, "order") VALUES ('worker', '1.7.1', '{"state": "live"}');
+            INSERT INTO orders (worker, order_id, "order") VALUES ('worker', '1.7.1', '{"state": "stale"}');
+        ''')
+        connection.commit()
+        connection.close()
+
+        worker = DatabaseWorker(path=self.path)
+        try:
+            self.assertEqual(worker.get_item('test', 'key'), 'live')
+            self.assertEqual(worker.get_item('test', 'other'), 1)
+            self.assertEqual(worker.fetch_orders('worker'), {'1.7.1': {'state': 'live'}})
+            # The unique index is in place, the key is updated in place
+            worker.set_item('test', 'key', 'updated')
+            self.assertEqual(worker.get_item('test', 'key'), 'updated')
+            self.assertEqual(len(worker.get_items('test')), 2)
+        finally:
+            worker.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
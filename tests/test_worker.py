@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+import time
+import unittest
+from unittest import mock
+
+from bitshares.account import AccountUpdate
+from bitshares.price import FilledOrder, Order
+
+from dexbot.worker import WorkerInfrastructure
+
+from simulated_chain import SimulatedChain, limit_order
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('Timed out')
+        time.sleep(0.01)
+
+
+class FakeWebsocket:
+
+    def __init__(self):
+        # Connected, the subscriptions are sent at once
+        self.ws = object()
+        self.__events__ = ['on_market', 'on_account', 'on_block']
+        self.subscribed = []
+        self.unsubscribed = []
+        self.accounts = []
+
+    def subscribe_to_market(self, callback_id, *ids):
+        self.subscribed.append(ids)
+
+    def unsubscribe_from_market(self, *ids):
+        self.unsubscribed.append(ids)
+
+    def get_full_accounts(self, names, subscribe):
+        self.accounts.extend(names)
+
+
+class FakeNotify:
+    """ Notifications of the node, recording the subscriptions made
+    """
+
+    def __init__(self, markets, accounts, **kwargs):
+        self.websocket = FakeWebsocket()
+        self.websocket.subscription_markets = self.get_market_ids(markets)
+        self.websocket.subscription_accounts = list(accounts)
+
+    @staticmethod
+    def get_market_ids(markets):
+        return [tuple(sorted(market.split(':'))) for market in markets]
+
+
+class WorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = SimulatedChain()
+        self.addCleanup(self.chain.close)
+        self.chain.exchange.add_asset('EUR', 4)
+        self.chain.exchange.add_market('EUR', 'BTS')
+        self.config = {'node': None, 'workers': {}}
+        for name, market in (('alice', 'BTS:USD'), ('bob', 'USD:BTS'), ('carol', 'BTS:EUR')):
+            self.chain.add_account(name, {'USD': 1000, 'EUR': 1000, 'BTS': 10000})
+            self.config['workers'][name] = self.chain.worker_config(
+                name, market=market, module='dexbot.strategies.echo')
+        self.infrastructure = WorkerInfrastructure(self.config, bitshares_instance=self.chain.bitshares)
+        self.addCleanup(self.infrastructure.dispatcher.shutdown, wait=True)
+        self.addCleanup(self.infrastructure.shutdown)
+        notify = mock.patch('dexbot.worker.Notify', FakeNotify)
+        notify.start()
+        self.addCleanup(notify.stop)
+        self.infrastructure.init_workers(self.config)
+        self.infrastructure.update_notify()
+        self.websocket = self.infrastructure.notify.websocket
+
+        self.dispatched = []
+        self.infrastructure.dispatch = lambda worker_name, event, data: self.dispatched.append((worker_name, event))
+
+    def order_notification(self, account, asset):
+        self.chain.exchange.apply_transaction([limit_order(
+            self.chain.exchange.account(account), self.chain.exchange.asset(asset), 10000, self.chain.bts, 1000000)])
+        notifications, _ = self.chain.exchange.collect_notifications()
+        return Order(notifications[-1][1], bitshares_instance=self.chain.bitshares)
+
+    def account_notification(self, account):
+        account = self.chain.exchange.account(account)
+        statistics = self.chain.exchange.get_object(account['statistics'])
+        return AccountUpdate(dict(statistics), bitshares_instance=self.chain.bitshares)
+
+
+class RoutingTest(WorkerTest):
+
+    def test_market_events(self):
+        # Both orientations of a market go to the same workers
+        self.infrastructure.on_market(self.order_notification('alice', 'USD'))
+        self.assertEqual(sorted(self.dispatched), [('alice', 'onMarketUpdate'), ('bob', 'onMarketUpdate')])
+        self.dispatched.clear()
+        self.infrastructure.on_market(self.order_notification('alice', 'EUR'))
+        self.assertEqual(self.dispatched, [('carol', 'onMarketUpdate')])
+
+    def test_account_events(self):
+        self.infrastructure.on_account(self.account_notification('bob'))
+        self.assertEqual(self.dispatched, [('bob', 'onAccount')])
+
+    def test_removed_worker(self):
+        self.infrastructure.stop('bob')
+        self.infrastructure.on_market(self.order_notification('alice', 'USD'))
+        self.infrastructure.on_account(self.account_notification('bob'))
+        self.assertEqual(self.dispatched, [('alice', 'onMarketUpdate')])
+
+
+class SubscriptionTest(WorkerTest):
+
+    def reload(self, workers):
+        self.infrastructure.reload_config({'node': None, 'workers': workers})
+
+    def test_initial_subscriptions(self):
+        self.assertEqual(sorted(self.websocket.subscription_markets), [('BTS', 'EUR'), ('BTS', 'USD')])
+        self.assertEqual(sorted(self.websocket.subscription_accounts), ['alice', 'bob', 'carol'])
+
+    def test_shared_market_stays_subscribed(self):
+        workers = dict(self.config['workers'])
+        del workers['bob']
+        self.reload(workers)
+        self.assertEqual(self.websocket.unsubscribed, [])
+        self.assertIn(('BTS', 'USD'), self.websocket.subscription_markets)
+
+    def test_unused_market_unsubscribed(self):
+        workers = dict(self.config['workers'])
+        del workers['carol']
+        self.reload(workers)
+        self.assertEqual(self.websocket.unsubscribed, [('BTS', 'EUR')])
+        self.assertEqual(self.websocket.subscription_markets, [('BTS', 'USD')])
+
+    def test_new_account_and_market(self):
+        self.chain.exchange.add_asset('CNY', 4)
+        self.chain.exchange.add_market('CNY', 'BTS')
+        self.chain.add_account('dave')
+        workers = dict(self.config['workers'])
+        workers['dave'] = self.chain.worker_config('dave', market='BTS:CNY', module='dexbot.strategies.echo')
+        # A second worker of an account already subscribed to
+        workers['alice-eur'] = self.chain.worker_config('alice', market='BTS:EUR', module='dexbot.strategies.echo')
+        self.reload(workers)
+        self.assertEqual(self.websocket.subscribed, [('BTS', 'CNY')])
+        self.assertEqual(self.websocket.accounts, ['dave'])
+        self.assertEqual(self.websocket.unsubscribed, [])
+
+
+class CoalesceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = SimulatedChain()
+        self.addCleanup(self.chain.close)
+        self.account = self.chain.add_account('alice')
+        config = {'node': None, 'workers': {'alice': self.chain.worker_config(
+            'alice', module='dexbot.strategies.echo', coalesce_market_updates=True)}}
+        self.infrastructure = WorkerInfrastructure(config, bitshares_instance=self.chain.bitshares)
+        self.addCleanup(self.infrastructure.dispatcher.shutdown, wait=True)
+        self.addCleanup(self.infrastructure.shutdown)
+        self.infrastructure.init_workers(config)
+
+        self.dispatched = []
+        dispatch = self.infrastructure.dispatch
+
+        def record(worker_name, event, data):
+            self.dispatched.append(event)
+            dispatch(worker_name, event, data)
+        self.infrastructure.dispatch = record
+
+        self.events = []
+        worker = self.infrastructure.workers['alice']
+        worker.onOrderPlaced += lambda d: self.events.append('placed')
+        worker.onOrderMatched += lambda d: self.events.append('matched {}'.format(d['order_id']))
+        worker.onMarketUpdate += lambda d: self.events.append('update')
+
+    def notify_market(self):
+        """ Passes the market notifications on as the node does, fills first
+        """
+        notifications, _ = self.chain.exchange.collect_notifications()
+        for _, data in sorted(notifications, key=lambda notification: 'pays' not in notification[1]):
+            if 'pays' in data:
+                self.infrastructure.on_market(FilledOrder(data, bitshares_instance=self.chain.bitshares))
+            else:
+                self.infrastructure.on_market(Order(data, bitshares_instance=self.chain.bitshares))
+
+    def test_burst_delivered_once(self):
+        # Two orders placed and one of them filled, all in one block
+        (_, bid), = self.chain.exchange.apply_transaction([
+            limit_order(self.account, self.chain.usd, 200000, self.chain.bts, 10000000)])
+        self.chain.exchange.apply_transaction([
+            limit_order(self.account, self.chain.usd, 10000, self.chain.bts, 1000000)])
+        self.chain.exchange.market_trade(self.chain.book, 0.15, 1000)
+        self.notify_market()
+        self.assertEqual(self.dispatched, [])
+
+        self.infrastructure.on_block(self.chain.exchange.produce_block())
+        self.assertEqual(self.dispatched, ['onMarketUpdateBatch', 'ontick'])
+        wait_for(lambda: 'update' in self.events)
+        self.assertIn('matched {}'.format(bid), self.events)
+        self.assertEqual(self.events.count('placed'), 2)
+        # A single market update for the whole block, last
+        self.assertEqual(self.events.count('update'), 1)
+        self.assertEqual(self.events[-1], 'update')
+
+
+if __name__ == '__main__':
+    unittest.main()